@@ -0,0 +1,99 @@
+"""
+Chunker Throughput Benchmark
+=============================
+Times DocumentChunker on large synthetic text against the original
+character-by-character implementation and checks that both produce the
+same chunks.
+
+Usage:
+    python benchmarks/bench_chunker.py --megabytes 10
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from document_processor import DocumentChunker
+
+
+def legacy_chunk_text(text: str, chunk_size: int = 500, chunk_overlap: int = 50):
+    """The original chunker, scanning backwards from each chunk end in Python"""
+    chunks = []
+    start = 0
+    text_length = len(text)
+    while start < text_length:
+        end = start + chunk_size
+        if end < text_length:
+            for i in range(end, start + chunk_size // 2, -1):
+                if text[i] in '.!?\n':
+                    end = i + 1
+                    break
+            else:
+                for i in range(end, start + chunk_size // 2, -1):
+                    if text[i].isspace():
+                        end = i
+                        break
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        start = end - chunk_overlap
+        if start <= end - chunk_size + chunk_overlap:
+            start = end
+    return chunks
+
+
+def synthetic_text(megabytes: float, style: str = "prose", seed: int = 0) -> str:
+    """
+    Zipf-distributed words
+    
+    "prose" has sentence punctuation, line breaks and some long unbroken
+    runs; "minified" is comma-separated with no boundaries at all (minified
+    JSON, CSV without line breaks, base64), the worst case for the legacy scan.
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = [f"term{i}" for i in range(20000)] + ["end.", "really?", "yes!", "\n", "\n\n", "x" * 400]
+    weights = 1.0 / np.arange(1, len(vocabulary) + 1)
+    weights[-6:] = [0.3, 0.05, 0.05, 0.1, 0.03, 0.001]
+    if style == "minified":
+        vocabulary, weights = vocabulary[:-6], weights[:-6]
+    cumulative = np.cumsum(weights)
+    words = int(megabytes * 1024 * 1024 / 7)
+    picks = np.searchsorted(cumulative, rng.random(words) * cumulative[-1])
+    separator = "," if style == "minified" else " "
+    return separator.join(map(vocabulary.__getitem__, picks.tolist()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--megabytes", type=float, default=10, help="Size of the synthetic text")
+    parser.add_argument("--style", choices=["prose", "minified"], default="prose", help="Kind of text")
+    parser.add_argument("--chunk-size", type=int, default=500, help="Chunk size in characters")
+    parser.add_argument("--chunk-overlap", type=int, default=50, help="Chunk overlap in characters")
+    parser.add_argument("--skip-legacy", action="store_true", help="Only time the current chunker")
+    args = parser.parse_args()
+    
+    text = synthetic_text(args.megabytes, args.style)
+    megabytes = len(text) / 1024 / 1024
+    chunker = DocumentChunker(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
+    
+    started = time.perf_counter()
+    chunks = chunker.chunk_text(text)
+    seconds = time.perf_counter() - started
+    print(f"text:              {megabytes:.1f} MB, {len(chunks):,} chunks")
+    print(f"chunker:           {seconds:.2f}s ({megabytes / seconds:.1f} MB/s)")
+    
+    if not args.skip_legacy:
+        started = time.perf_counter()
+        legacy = legacy_chunk_text(text, args.chunk_size, args.chunk_overlap)
+        legacy_seconds = time.perf_counter() - started
+        print(f"legacy chunker:    {legacy_seconds:.2f}s ({megabytes / legacy_seconds:.1f} MB/s)")
+        print(f"speedup:           {legacy_seconds / seconds:.1f}x")
+        print(f"identical output:  {legacy == chunks}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Character vs Token Chunking Benchmark
+======================================
+Chunks the same synthetic text in character mode (500/50, the upload
+default) and in token mode for an embedding model, then streams each
+result through the ingestion pipeline with the offline local-hash
+provider.
+
+Reports chunk counts, tokens per chunk (by the model's tokenizer), the
+embedding requests the provider would receive, stored vector memory at the
+model's width, and chunking and ingestion time. Token counts are exact
+when the model's tokenizer is installed (tiktoken for OpenAI, transformers
+for self-hosted models) and approximate otherwise.
+
+Usage:
+    python benchmarks/bench_chunking_modes.py --megabytes 5 --provider openai --model text-embedding-3-small
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from bench_chunker import synthetic_text
+from document_processor import DocumentStore
+from embedding_service import EMBEDDING_PROVIDERS, PROVIDER_BATCH_LIMITS, EmbeddingClient, make_batches
+from ingestion import IngestionPipeline
+from tokenization import create_chunker, get_tokenizer
+
+
+def model_dimensions(provider: str, model: str) -> int:
+    for entry in EMBEDDING_PROVIDERS[provider]["models"]:
+        if entry["id"] == model:
+            return entry["dimensions"]
+    return 1024
+
+
+async def ingest_seconds(text: str, chunker) -> float:
+    """Wall time of the streaming pipeline for the text, embedding with local-hash"""
+    client = EmbeddingClient("local-hash", model="hash-384")
+    with tempfile.TemporaryDirectory() as storage_dir:
+        store = DocumentStore(storage_dir=storage_dir)
+        started = time.perf_counter()
+        await IngestionPipeline(store, client, chunker=chunker).ingest("bench", text.encode("utf-8"), "bench.txt")
+        seconds = time.perf_counter() - started
+        store.wait_for_compaction()
+        return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--megabytes", type=float, default=5, help="Size of the synthetic text")
+    parser.add_argument("--provider", default="openai", help="Embedding provider whose tokenizer and limits apply")
+    parser.add_argument("--model", default="text-embedding-3-small", help="Embedding model")
+    parser.add_argument("--chunk-tokens", type=int, default=None, help="Token budget (default: model limit, max 512)")
+    args = parser.parse_args()
+    
+    text = synthetic_text(args.megabytes)
+    tokenizer = get_tokenizer(args.provider, args.model)
+    limits = PROVIDER_BATCH_LIMITS[args.provider]
+    dimensions = model_dimensions(args.provider, args.model)
+    print(f"text: {len(text) / 1024 / 1024:.1f} MB, tokenizer: {tokenizer.name}, {dimensions} dims")
+    print(f"{'mode':<24}{'chunks':>9}{'tokens/chunk':>14}{'requests':>10}{'vectors MB':>12}"
+          f"{'chunk s':>9}{'ingest s':>10}")
+    
+    for mode, size in (("characters", None), ("tokens", args.chunk_tokens)):
+        chunker = create_chunker(mode, args.provider, args.model, chunk_size=size)
+        started = time.perf_counter()
+        chunks = chunker.chunk_text(text)
+        chunk_seconds = time.perf_counter() - started
+        
+        tokens = np.array([len(tokenizer.token_ends(chunk)) for chunk in chunks])
+        requests = len(make_batches(chunks, limits["max_batch_size"], limits.get("max_batch_tokens")))
+        vector_mb = len(chunks) * dimensions * 4 / 1024 / 1024
+        seconds = asyncio.run(ingest_seconds(text, chunker))
+        label = f"{mode} {chunker.chunk_size}/{chunker.chunk_overlap}"
+        print(f"{label:<24}{len(chunks):>9,}{tokens.mean():>14.0f}{requests:>10,}{vector_mb:>12.1f}"
+              f"{chunk_seconds:>9.2f}{seconds:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
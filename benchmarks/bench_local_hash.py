@@ -0,0 +1,88 @@
+"""
+Ingestion and Retrieval Benchmark (offline)
+============================================
+Pushes synthetic chunks through the local-hash embedding provider and the
+real DocumentStore, then measures search latency. Needs no API key, model
+download or network, so it runs anywhere.
+
+Usage:
+    python benchmarks/bench_local_hash.py --chunks 1000000 --dims 384
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from embedding_service import EmbeddingClient
+from document_processor import DocumentStore
+
+
+def synthetic_chunks(count: int, words_per_chunk: int, seed: int = 0):
+    """Chunks of random words drawn from a Zipf-like vocabulary"""
+    rng = np.random.default_rng(seed)
+    vocabulary = [f"term{i}" for i in range(20000)]
+    cumulative = np.cumsum(1.0 / np.arange(1, len(vocabulary) + 1))
+    picks = np.searchsorted(cumulative, rng.random((count, words_per_chunk)) * cumulative[-1])
+    return [" ".join(map(vocabulary.__getitem__, row)) for row in picks.tolist()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=100000, help="Total chunks to ingest")
+    parser.add_argument("--chunks-per-doc", type=int, default=1000, help="Chunks per document")
+    parser.add_argument("--words", type=int, default=60, help="Words per chunk")
+    parser.add_argument("--dims", type=int, default=384, help="Embedding dimensions")
+    parser.add_argument("--queries", type=int, default=200, help="Search queries to time")
+    parser.add_argument("--backend", default=None, help="Vector index backend (default RAG_INDEX_BACKEND)")
+    args = parser.parse_args()
+    
+    client = EmbeddingClient("local-hash", model=f"hash-{args.dims}")
+    
+    with tempfile.TemporaryDirectory() as storage_dir:
+        store = DocumentStore(storage_dir=storage_dir, index_backend=args.backend)
+        embed_seconds = add_seconds = generate_seconds = 0.0
+        
+        for doc_number, start in enumerate(range(0, args.chunks, args.chunks_per_doc)):
+            started = time.perf_counter()
+            chunks = synthetic_chunks(min(args.chunks_per_doc, args.chunks - start), args.words, seed=doc_number)
+            generate_seconds += time.perf_counter() - started
+            
+            started = time.perf_counter()
+            embeddings = client.embed_texts(chunks, as_numpy=True)
+            embed_seconds += time.perf_counter() - started
+            
+            started = time.perf_counter()
+            store.add_document("bench", {
+                "id": f"doc{doc_number}",
+                "filename": f"doc{doc_number}.txt",
+                "text": "",
+                "chunks": chunks,
+                "embeddings": embeddings,
+                "embedding_provider": "local-hash",
+                "embedding_model": client.model
+            })
+            add_seconds += time.perf_counter() - started
+        
+        queries = synthetic_chunks(args.queries, 8, seed=2**32 - 1)
+        query_embeddings = client.embed_texts(queries, as_numpy=True)
+        latencies = []
+        for query_embedding in query_embeddings:
+            started = time.perf_counter()
+            store.search_chunks("bench", query_embedding, top_k=5, similarity_threshold=0.0)
+            latencies.append(time.perf_counter() - started)
+    
+    latencies_ms = np.array(latencies) * 1000
+    print(f"chunks:            {args.chunks:,} ({args.dims} dims)")
+    print(f"generate text:     {generate_seconds:.2f}s")
+    print(f"embed:             {embed_seconds:.2f}s ({args.chunks / embed_seconds:,.0f} chunks/s)")
+    print(f"add to store:      {add_seconds:.2f}s ({args.chunks / add_seconds:,.0f} chunks/s)")
+    print(f"search p50 / p95:  {np.percentile(latencies_ms, 50):.2f} / {np.percentile(latencies_ms, 95):.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,18 +5,84 @@ Handle document upload, text extraction, chunking, and storage
 """
 
 import os
-import json
-from typing import List, Dict, Any, Optional
+import mmap
+import time
+import codecs
+from typing import List, Dict, Any, Optional, Callable, Iterable, Iterator, Tuple
 from pathlib import Path
+from collections import OrderedDict
 import hashlib
 
+import numpy as np
+
+from vector_index import (
+    SessionIndex, QuantizedBackend, QUANTIZATION_MODES, DimensionReducer, REDUCTION_METHODS,
+    resolve_backend, chunk_embeddings, measure_recall
+)
+from session_storage import SessionStorage, encode_add, encode_delete
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+from near_duplicates import NearDuplicateIndex
+from pdf_extraction import ExtractionBudgetExceeded, pdf_extractor
+
+
+# Chunks break after a sentence end or at whitespace. No code point above U+3000 is
+# whitespace, so every larger one is looked up in the last (non-boundary) entry.
+_SENTENCE_ENDS = np.zeros(0x3002, dtype=bool)
+_SENTENCE_ENDS[[ord(c) for c in '.!?\n']] = True
+_WHITESPACE = np.array([chr(c).isspace() for c in range(0x3002)])
+_ASCII_SENTENCE_ENDS = _SENTENCE_ENDS[:256].tobytes()
+_ASCII_WHITESPACE = _WHITESPACE[:256].tobytes()
+
+
+def _boundary_positions(text: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Sorted positions of the sentence-ending and the whitespace characters in text"""
+    if text.isascii():
+        # One byte per character: translate bytes straight into boolean masks
+        data = text.encode("ascii")
+        sentence_ends = np.frombuffer(data.translate(_ASCII_SENTENCE_ENDS), dtype=bool)
+        whitespace = np.frombuffer(data.translate(_ASCII_WHITESPACE), dtype=bool)
+    else:
+        codes = np.frombuffer(text.encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+        codes = np.minimum(codes, len(_SENTENCE_ENDS) - 1)
+        sentence_ends = _SENTENCE_ENDS[codes]
+        whitespace = _WHITESPACE[codes]
+    return np.flatnonzero(sentence_ends), np.flatnonzero(whitespace)
+
+
+def _last_position(positions: np.ndarray, limit: int) -> int:
+    """Largest position <= limit, or -1"""
+    found = int(positions.searchsorted(limit, side="right"))
+    return int(positions[found - 1]) if found else -1
+
 
 class DocumentChunker:
-    """Split documents into chunks for embedding"""
+    """
+    Split documents into chunks for embedding
+    
+    Sentence and word boundaries are located once per text with a
+    vectorized scan, and each chunk end is found by binary search among
+    them, so chunking is linear in the text length.
+    
+    Sizes are in characters, or in tokens when a tokenizer is given (any
+    object whose token_ends(text) returns the end offset of each token,
+    see tokenization.py). Token chunks are packed up to chunk_size tokens
+    and then cut back to the last sentence or word boundary.
+    """
     
-    def __init__(self, chunk_size: int = 500, chunk_overlap: int = 50):
+    def __init__(self, chunk_size: int = 500, chunk_overlap: int = 50, tokenizer: Optional[Any] = None):
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        self.tokenizer = tokenizer
+    
+    @property
+    def config(self) -> Dict[str, Any]:
+        """Chunking settings, as recorded with each document"""
+        return {
+            "mode": "characters" if self.tokenizer is None else "tokens",
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            **({"tokenizer": self.tokenizer.name} if self.tokenizer is not None else {})
+        }
     
     def chunk_text(self, text: str) -> List[str]:
         """
@@ -31,26 +97,50 @@ class DocumentChunker:
         if not text or len(text) == 0:
             return []
         
+        return self._split(text, 0, final=True)[0]
+    
+    def stream(self) -> "StreamingChunker":
+        """Chunker for text that arrives in pieces"""
+        return StreamingChunker(self)
+    
+    def _split(self, text: str, start: int, final: bool) -> Tuple[List[str], int]:
+        """
+        Chunk text from a start position
+        
+        Args:
+            text: Text to split
+            start: Position of the first chunk
+            final: Whether text is complete; if not, stop before the first
+                chunk whose boundary could still depend on text to come
+            
+        Returns:
+            (chunks, start position of the next chunk)
+        """
+        if self.tokenizer is not None:
+            return self._split_tokens(text, start, final)
+        
         chunks = []
-        start = 0
         text_length = len(text)
+        sentence_ends = whitespace = None
         
-        while start < text_length:
+        while start < text_length and (final or start + self.chunk_size < text_length):
             end = start + self.chunk_size
             
             # If this is not the last chunk, try to break at a sentence or word boundary
+            # no further back than half a chunk
             if end < text_length:
-                # Look for sentence boundary (. ! ?)
-                for i in range(end, start + self.chunk_size // 2, -1):
-                    if text[i] in '.!?\n':
-                        end = i + 1
-                        break
+                if sentence_ends is None:
+                    sentence_ends, whitespace = _boundary_positions(text)
+                earliest = start + self.chunk_size // 2
+                # Look for sentence boundary (. ! ? or newline)
+                i = _last_position(sentence_ends, end)
+                if i > earliest:
+                    end = i + 1
                 else:
                     # If no sentence boundary, look for word boundary
-                    for i in range(end, start + self.chunk_size // 2, -1):
-                        if text[i].isspace():
-                            end = i
-                            break
+                    i = _last_position(whitespace, end)
+                    if i > earliest:
+                        end = i
             
             chunk = text[start:end].strip()
             if chunk:
@@ -63,9 +153,142 @@ class DocumentChunker:
             if start <= end - self.chunk_size + self.chunk_overlap:
                 start = end
         
+        return chunks, start
+    
+    def _split_tokens(self, text: str, start: int, final: bool) -> Tuple[List[str], int]:
+        """
+        _split() with chunk_size and chunk_overlap counted in tokens
+        
+        Each chunk is tokenized from its own start in a window of text a
+        few times the expected chunk length. A window must hold a margin of
+        tokens beyond the budget, so a token cut at the window edge never
+        decides the chunk end and streamed text chunks like the whole.
+        """
+        chunks = []
+        text_length = len(text)
+        sentence_ends = whitespace = None
+        window = 8 * self.chunk_size + 64
+        margin = 16
+        
+        while start < text_length:
+            window_end = min(text_length, start + window)
+            if window_end == text_length and not final:
+                break
+            ends = self.tokenizer.token_ends(text[start:window_end])
+            if window_end < text_length and len(ends) <= self.chunk_size + margin:
+                window *= 2
+                continue
+            
+            if len(ends) <= self.chunk_size:
+                # The rest of the text fits
+                end = text_length
+            else:
+                # Cut at the last sentence or word boundary within the budget,
+                # no further back than half the chunk
+                limit = start + int(ends[self.chunk_size - 1])
+                if sentence_ends is None:
+                    sentence_ends, whitespace = _boundary_positions(text)
+                earliest = start + (limit - start) // 2
+                i = _last_position(sentence_ends, limit - 1)
+                if i > earliest:
+                    end = i + 1
+                else:
+                    i = _last_position(whitespace, limit)
+                    end = i if i > earliest else limit
+            
+            chunk = text[start:end].strip()
+            if chunk:
+                chunks.append(chunk)
+            if end >= text_length:
+                start = end
+                break
+            
+            # Start the next chunk chunk_overlap tokens before this one ended
+            cut_tokens = int(ends.searchsorted(end - start, side="right"))
+            if self.chunk_overlap and cut_tokens > self.chunk_overlap:
+                next_start = start + int(ends[cut_tokens - self.chunk_overlap - 1])
+                start = next_start if next_start > start else end
+            else:
+                start = end
+        
+        return chunks, start
+
+
+class StreamingChunker:
+    """
+    Incremental DocumentChunker
+    
+    Produces exactly the chunks chunk_text() returns for the concatenated
+    text. A chunk is emitted once enough text past its end has arrived to
+    fix its boundary; only the unchunked tail is buffered.
+    """
+    
+    def __init__(self, chunker: DocumentChunker):
+        self.chunker = chunker
+        self.buffer = ""
+    
+    def feed(self, text: str) -> List[str]:
+        """Add text and return the chunks it completes"""
+        self.buffer += text
+        chunks, start = self.chunker._split(self.buffer, 0, final=False)
+        self.buffer = self.buffer[start:]
+        return chunks
+    
+    def close(self) -> List[str]:
+        """Return the remaining chunks once all text has been fed"""
+        chunks, _ = self.chunker._split(self.buffer, 0, final=True)
+        self.buffer = ""
         return chunks
 
 
+def _strip_pieces(pieces: Iterable[str]) -> Iterator[str]:
+    """Yield pieces of text whose concatenation equals "".join(pieces).strip()"""
+    started = False
+    pending = ""  # Trailing whitespace, kept back until more text follows
+    for piece in pieces:
+        if not started:
+            piece = piece.lstrip()
+            if not piece:
+                continue
+            started = True
+        content = piece.rstrip()
+        if content:
+            yield pending + content
+            pending = piece[len(content):]
+        else:
+            pending += piece
+
+
+def _group_pieces(pieces: Iterable[str], piece_chars: int) -> Iterator[str]:
+    """Join small pieces of text into pieces of at least piece_chars"""
+    group = []
+    length = 0
+    for piece in pieces:
+        group.append(piece)
+        length += len(piece)
+        if length >= piece_chars:
+            yield "".join(group)
+            group = []
+            length = 0
+    if group:
+        yield "".join(group)
+
+
+class MappedFile(mmap.mmap):
+    """
+    Read-only memory map of a file that remembers the file's path
+    
+    Extractors read it like any memory map; the PDF extractor hands the
+    path to its worker processes instead of copying the content to disk.
+    """
+    
+    def __new__(cls, path: str):
+        with open(path, 'rb') as f:
+            mapped = super().__new__(cls, f.fileno(), 0, access=mmap.ACCESS_READ)
+        mapped.path = str(path)
+        return mapped
+
+
 class DocumentProcessor:
     """Process documents for RAG"""
     
@@ -81,64 +304,88 @@ class DocumentProcessor:
         Returns:
             Extracted text
         """
+        return "".join(DocumentProcessor.iter_text(file_content, filename))
+    
+    @staticmethod
+    def iter_text(file_content: bytes, filename: str, piece_chars: int = 64 * 1024) -> Iterator[str]:
+        """
+        Extract text from a file piece by piece
+        
+        Each piece is yielded as soon as it is extracted: a PDF page, a run
+        of DOCX paragraphs or a block of decoded plain text. Joined
+        together, the pieces equal extract_text_from_file().
+        
+        Args:
+            file_content: File content as bytes, or a read-only memory map
+                of a spooled upload (read without copying it into memory)
+            filename: Original filename
+            piece_chars: Approximate size of plain text and DOCX pieces
+            
+        Yields:
+            Consecutive pieces of the extracted text
+        """
         file_ext = Path(filename).suffix.lower()
         
         try:
             if file_ext in ['.txt', '.md', '.py', '.js', '.html', '.css', '.json', '.xml']:
                 # Plain text files
-                return file_content.decode('utf-8', errors='ignore')
+                yield from DocumentProcessor._iter_decoded(file_content, piece_chars)
             
             elif file_ext == '.pdf':
                 # PDF files
-                return DocumentProcessor._extract_from_pdf(file_content)
+                yield from DocumentProcessor._iter_pdf(file_content)
             
             elif file_ext in ['.doc', '.docx']:
                 # Word documents
-                return DocumentProcessor._extract_from_docx(file_content)
+                yield from DocumentProcessor._iter_docx(file_content, piece_chars)
             
             else:
                 # Try to decode as text
-                return file_content.decode('utf-8', errors='ignore')
+                yield from DocumentProcessor._iter_decoded(file_content, piece_chars)
         
+        except ExtractionBudgetExceeded:
+            raise
         except Exception as e:
             raise Exception(f"Error extracting text from {filename}: {str(e)}")
     
     @staticmethod
-    def _extract_from_pdf(file_content: bytes) -> str:
-        """Extract text from PDF"""
+    def _iter_decoded(file_content: bytes, piece_chars: int) -> Iterator[str]:
+        """Decode UTF-8 text in blocks (multi-byte characters split across blocks are carried over)"""
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        for offset in range(0, len(file_content), piece_chars):
+            text = decoder.decode(file_content[offset:offset + piece_chars])
+            if text:
+                yield text
+        text = decoder.decode(b"", final=True)
+        if text:
+            yield text
+    
+    @staticmethod
+    def _iter_pdf(file_content: bytes) -> Iterator[str]:
+        """Extract text from PDF page by page (page ranges of long PDFs in parallel, see pdf_extraction.py)"""
         try:
-            from PyPDF2 import PdfReader
-            from io import BytesIO
-            
-            pdf_file = BytesIO(file_content)
-            pdf_reader = PdfReader(pdf_file)
-            
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-            
-            return text.strip()
+            yield from _strip_pieces(page + "\n" for page in pdf_extractor.iter_pages(file_content))
         
+        except ExtractionBudgetExceeded:
+            raise
         except ImportError:
             raise ImportError("PyPDF2 not installed. Install with: pip install PyPDF2")
         except Exception as e:
             raise Exception(f"Error reading PDF: {str(e)}")
     
     @staticmethod
-    def _extract_from_docx(file_content: bytes) -> str:
-        """Extract text from DOCX"""
+    def _iter_docx(file_content: bytes, piece_chars: int) -> Iterator[str]:
+        """Extract text from DOCX in runs of paragraphs"""
         try:
             from docx import Document
             from io import BytesIO
             
-            docx_file = BytesIO(file_content)
+            # A memory map is already a seekable file
+            docx_file = file_content if isinstance(file_content, mmap.mmap) else BytesIO(file_content)
             doc = Document(docx_file)
             
-            text = ""
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-            
-            return text.strip()
+            paragraphs = (paragraph.text + "\n" for paragraph in doc.paragraphs)
+            yield from _group_pieces(_strip_pieces(paragraphs), piece_chars)
         
         except ImportError:
             raise ImportError("python-docx not installed. Install with: pip install python-docx")
@@ -153,58 +400,513 @@ class DocumentProcessor:
 
 
 class DocumentStore:
-    """In-memory document store for RAG"""
+    """
+    Document store for RAG
     
-    def __init__(self, storage_dir: str = "./rag_storage"):
+    Sessions are loaded from disk on first access and kept in a bounded
+    LRU; evicted sessions drop out of memory and reload transparently.
+    """
+    
+    def __init__(self, storage_dir: str = "./rag_storage", index_backend: Optional[str] = None,
+                 index_options: Optional[Dict[str, Any]] = None,
+                 compaction_min_bytes: int = 8 * 1024 * 1024,
+                 max_sessions: Optional[int] = None, max_bytes: Optional[int] = None,
+                 quantization: Optional[str] = None, index_save_delay: Optional[float] = None):
         self.storage_dir = Path(storage_dir)
         self.storage_dir.mkdir(exist_ok=True)
-        self.documents = {}  # {session_id: {doc_id: document}}
-        self._load_from_disk()
+        self.documents = OrderedDict()  # {session_id: {doc_id: document}}, least recently used first
+        self.indexes = {}  # {session_id: SessionIndex}
+        self.lexical_indexes = {}  # {session_id: LexicalIndex}, built on first lexical search
+        self.near_duplicate_indexes = {}  # {session_id: NearDuplicateIndex}, built on first deduplicated upload
+        self.storages = {}  # {session_id: SessionStorage}
+        self.ingesting = {}  # {session_id: {doc_id: state of a document still being appended to}}
+        
+        # Vector index backend: "exact" (default), "hnsw", "faiss" or "auto"
+        self.index_backend = resolve_backend(index_backend or os.getenv("RAG_INDEX_BACKEND", "exact"))
+        self.index_options = index_options or {}
+        
+        # Default embedding quantization ("float16", "int8", "binary"); sessions can override it
+        self.quantization = self._check_quantization(quantization or os.getenv("RAG_QUANTIZATION"))
+        
+        # Session logs are compacted into a snapshot once they reach this size
+        self.compaction_min_bytes = compaction_min_bytes
+        
+        # A changed approximate index is saved on the first write this many seconds after its
+        # first unsaved change (and on eviction and save_indexes()), so it rarely needs a rebuild
+        self.index_save_delay = index_save_delay if index_save_delay is not None else float(
+            os.getenv("RAG_INDEX_SAVE_DELAY", "30")
+        )
+        self._index_changed = {}  # {session_id: monotonic time of the first change not in the saved index}
+        
+        # Bounds of the in-memory session cache
+        self.max_sessions = max_sessions or int(os.getenv("RAG_CACHE_MAX_SESSIONS", "64"))
+        self.max_bytes = max_bytes or int(os.getenv("RAG_CACHE_MAX_BYTES", str(1024 ** 3)))
+        self._session_bytes = {}  # {session_id: estimated resident bytes}
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+    
+    def _get_storage(self, session_id: str) -> SessionStorage:
+        """Get the on-disk storage for a session"""
+        if session_id not in self.storages:
+            self.storages[session_id] = SessionStorage(
+                self.storage_dir, session_id, compaction_min_bytes=self.compaction_min_bytes
+            )
+        return self.storages[session_id]
+    
+    @staticmethod
+    def _check_quantization(quantization: Optional[str]) -> Optional[str]:
+        """Validate a quantization mode ("none" or empty means full precision)"""
+        if not quantization or quantization == "none":
+            return None
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization: {quantization}. Available: {list(QUANTIZATION_MODES)}")
+        return quantization
+    
+    def _session_backend(self, session_id: str):
+        """Backend class and options for a session, honouring its quantization setting"""
+        config = self._get_storage(session_id).load_config()
+        quantization = config.get("quantization", self.quantization)
+        if quantization:
+            return QuantizedBackend, {"quantization": quantization}
+        return self.index_backend, self.index_options
     
-    def _get_session_file(self, session_id: str) -> Path:
-        """Get storage file path for a session"""
-        return self.storage_dir / f"{session_id}.json"
+    def set_quantization(self, session_id: str, quantization: Optional[str]):
+        """
+        Choose how a session's embeddings are held in its search index
+        
+        Full-precision embeddings stay on disk (memory-mapped) for rescoring;
+        the index is rebuilt with the new codes on next use.
+        
+        Args:
+            session_id: Session identifier
+            quantization: "float16", "int8", "binary", or None for full precision
+        """
+        storage = self._get_storage(session_id)
+        config = storage.load_config()
+        config["quantization"] = self._check_quantization(quantization)
+        storage.save_config(config)
+        self.indexes.pop(session_id, None)
     
-    def _load_from_disk(self):
-        """Load documents from disk"""
+    def _session_reducer(self, session_id: str) -> Optional[DimensionReducer]:
+        """Dimension reduction configured for a session, if any"""
+        storage = self._get_storage(session_id)
+        reduction = storage.load_config().get("reduction")
+        if not reduction:
+            return None
         try:
-            for file_path in self.storage_dir.glob("*.json"):
-                session_id = file_path.stem
-                with open(file_path, 'r') as f:
-                    self.documents[session_id] = json.load(f)
-        except Exception as e:
-            print(f"Error loading documents from disk: {e}")
+            components = storage.load_projection() if reduction["method"] == "pca" else None
+            return DimensionReducer(reduction["method"], reduction["dimensions"], components,
+                                    rescore_factor=reduction.get("rescore_factor", 4))
+        except ValueError as e:
+            print(f"Ignoring dimension reduction of session {session_id}: {e}")
+            return None
     
-    def _save_session(self, session_id: str):
-        """Save session documents to disk"""
+    def set_reduction(self, session_id: str, method: Optional[str], dimensions: Optional[int] = None,
+                      rescore_factor: int = 4) -> Dict[str, Any]:
+        """
+        Index a session's embeddings with fewer dimensions
+        
+        Stored embeddings keep their full width; the search index holds the
+        reduced vectors and its candidates are rescored at full width. Queries
+        are reduced the same way. A PCA projection is fitted on the session's
+        current chunks (call again to refit after large uploads).
+        
+        Args:
+            session_id: Session identifier
+            method: "truncate" (Matryoshka models only), "pca", or None for full width
+            dimensions: Reduced number of dimensions
+            rescore_factor: Candidates per result rescored at full width (0 disables rescoring)
+            
+        Returns:
+            The applied reduction, with the retained variance for PCA
+        """
+        storage = self._get_storage(session_id)
+        config = storage.load_config()
+        if not method or method == "none":
+            config.pop("reduction", None)
+            summary = {"reduction": None}
+        else:
+            if method not in REDUCTION_METHODS:
+                raise ValueError(f"Unknown reduction: {method}. Available: {list(REDUCTION_METHODS)}")
+            if not dimensions or dimensions <= 0:
+                raise ValueError("Reduced dimensions must be positive")
+            
+            embeddings = [
+                np.asarray(chunk_embeddings(doc), dtype=np.float32)
+                for doc in (self._get_session(session_id) or {}).values()
+                if len(chunk_embeddings(doc))
+            ]
+            summary = {"reduction": f"{method}{dimensions}", "method": method, "dimensions": dimensions}
+            if method == "pca":
+                if not embeddings:
+                    raise ValueError("PCA is fitted on the session's embeddings; upload documents first")
+                reducer, retained = DimensionReducer.fit_pca(np.concatenate(embeddings), dimensions, rescore_factor)
+                storage.save_projection(reducer.components)
+                summary["retained_variance"] = retained
+            elif embeddings:
+                DimensionReducer(method, dimensions).check_input(embeddings[0].shape[1])
+            config["reduction"] = {"method": method, "dimensions": dimensions, "rescore_factor": rescore_factor}
+        
+        storage.save_config(config)
+        self.indexes.pop(session_id, None)
+        
+        # A saved approximate index built with an earlier projection must not be reattached
+        index_file = self._get_index_file(session_id)
+        for path in (index_file, index_file.with_suffix(".labels")):
+            if path.exists():
+                path.unlink()
+        return summary
+    
+    def _get_index_file(self, session_id: str) -> Path:
+        """Get the vector index file path for a session (stored next to the session data)"""
+        backend_class, _ = self._session_backend(session_id)
+        storage = self._get_storage(session_id)
+        reduction = storage.load_config().get("reduction")
+        name = backend_class.name
+        if reduction:
+            name += f"-{reduction['method']}{reduction['dimensions']}"
+        return storage.index_file(name)
+    
+    @staticmethod
+    def _document_bytes(document: Dict[str, Any]) -> int:
+        """Estimated memory held for a document: text, chunks, embeddings and their index copy"""
+        embeddings = document.get("embeddings", [])
+        embedding_bytes = getattr(embeddings, "nbytes", len(embeddings) * 8)
+        text_bytes = len(document.get("text", "")) + sum(len(c) for c in document.get("chunks", []))
+        return text_bytes + 2 * embedding_bytes
+    
+    def _get_session(self, session_id: str, create: bool = False) -> Optional[Dict[str, Dict[str, Any]]]:
+        """
+        Get a session's documents, loading them from disk on first access
+        
+        Args:
+            session_id: Session identifier
+            create: Start an empty session if nothing is stored for it
+            
+        Returns:
+            {doc_id: document}, or None if the session does not exist
+        """
+        if session_id in self.documents:
+            self.stats["hits"] += 1
+            self.documents.move_to_end(session_id)
+            return self.documents[session_id]
+        
+        self.stats["misses"] += 1
+        storage = self._get_storage(session_id)
+        if storage.exists():
+            # Embeddings are memory-mapped, legacy JSON is migrated here
+            session_docs = storage.load()
+        elif create:
+            session_docs = {}
+        else:
+            self.storages.pop(session_id, None)
+            return None
+        
+        self.documents[session_id] = session_docs
+        self._session_bytes[session_id] = sum(self._document_bytes(d) for d in session_docs.values())
+        self._evict()
+        return session_docs
+    
+    def _evict(self):
+        """Drop least recently used sessions until the cache is within its bounds"""
+        while len(self.documents) > 1 and (
+            len(self.documents) > self.max_sessions
+            or sum(self._session_bytes.values()) > self.max_bytes
+        ):
+            session_id, _ = self.documents.popitem(last=False)
+            self._session_bytes.pop(session_id, None)
+            self.lexical_indexes.pop(session_id, None)
+            self.near_duplicate_indexes.pop(session_id, None)
+            self._save_index(session_id)
+            self.indexes.pop(session_id, None)
+            self._index_changed.pop(session_id, None)
+            storage = self.storages.get(session_id)
+            if storage is not None and not storage.compacting:
+                del self.storages[session_id]
+            self.stats["evictions"] += 1
+    
+    def cache_stats(self) -> Dict[str, Any]:
+        """Session cache counters for tuning the LRU bounds"""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+            "sessions": len(self.documents),
+            "bytes": sum(self._session_bytes.values()),
+            "max_sessions": self.max_sessions,
+            "max_bytes": self.max_bytes
+        }
+    
+    def _save_session(self, session_id: str, records: List[bytes]):
+        """
+        Append session changes to disk
+        
+        Only the changed documents are written, to the session's append-only
+        log. When the log has grown large it is compacted into a snapshot in
+        the background, and the vector index is saved alongside.
+        """
         try:
-            if session_id in self.documents:
-                with open(self._get_session_file(session_id), 'w') as f:
-                    json.dump(self.documents[session_id], f)
+            storage = self._get_storage(session_id)
+            storage.append(records)
+            changed = self._index_changed.setdefault(session_id, time.monotonic())
+            # A snapshot must not capture documents that are still being ingested
+            if self.ingesting.get(session_id):
+                return
+            if storage.maybe_compact(self.documents[session_id]) or (
+                time.monotonic() - changed >= self.index_save_delay
+            ):
+                self._save_index(session_id)
         except Exception as e:
             print(f"Error saving session to disk: {e}")
     
+    def _save_index(self, session_id: str):
+        """Save a session's approximate index next to its data, sparing a rebuild on reload"""
+        index = self.indexes.get(session_id)
+        # An index holding partially ingested documents is rebuilt on reload rather than saved
+        if index is None or self.ingesting.get(session_id):
+            return
+        try:
+            index.save(self._get_index_file(session_id))
+            self._index_changed.pop(session_id, None)
+        except Exception as e:
+            print(f"Error saving vector index for {session_id}: {e}")
+    
+    def save_indexes(self):
+        """Save every resident index with changes not yet saved (e.g. at shutdown)"""
+        for session_id in list(self._index_changed):
+            self._save_index(session_id)
+    
+    def wait_for_compaction(self):
+        """Block until background compactions of all sessions have finished"""
+        for storage in list(self.storages.values()):
+            storage.wait()
+    
+    def _get_index(self, session_id: str) -> SessionIndex:
+        """Get the vector index for a loaded session, loading or building it if needed"""
+        index = self.indexes.get(session_id)
+        if index is None:
+            backend_class, backend_options = self._session_backend(session_id)
+            index = SessionIndex.load(
+                self._get_index_file(session_id),
+                self.documents.get(session_id, {}),
+                backend_class=backend_class,
+                backend_options=backend_options,
+                reducer=self._session_reducer(session_id)
+            )
+            self.indexes[session_id] = index
+        return index
+    
     def add_document(self, session_id: str, document: Dict[str, Any]):
         """Add a document to the store"""
-        if session_id not in self.documents:
-            self.documents[session_id] = {}
+        self.add_documents(session_id, [document])
+    
+    def add_documents(self, session_id: str, documents: List[Dict[str, Any]]):
+        """Add several documents to a session, persisting them with a single log write"""
+        if not documents:
+            return
+        session_docs = self._get_session(session_id, create=True)
+        replaced = [session_docs[document.get("id")] for document in documents
+                    if session_docs.get(document.get("id"), document) is not document]
+        for document in documents:
+            self._index_document(session_id, document)
+        adopters = self._adopt_duplicates(session_id, replaced, skip={document.get("id") for document in documents})
+        self._save_session(session_id, [encode_add(document) for document in adopters + documents])
+        self._evict()
+    
+    def _index_document(self, session_id: str, document: Dict[str, Any]):
+        """Put a document in memory and in the session's indexes, replacing any previous version"""
+        session_docs = self._get_session(session_id, create=True)
         
+        # Index incrementally; validate before mutating so a bad document leaves the session intact
         doc_id = document.get("id")
-        self.documents[session_id][doc_id] = document
-        self._save_session(session_id)
+        index = self._get_index(session_id)
+        document["embeddings"] = np.asarray(document.get("embeddings", []), dtype=np.float32)
+        embeddings = index.check_dimensions(chunk_embeddings(document))
+        index.remove(doc_id)
+        index.add(doc_id, embeddings)
+        
+        # A replaced document moves to the end, matching its new index rows
+        previous = session_docs.pop(doc_id, None)
+        session_docs[doc_id] = document
+        self._session_bytes[session_id] += self._document_bytes(document) - (
+            self._document_bytes(previous) if previous else 0
+        )
+        lexical = self.lexical_indexes.get(session_id)
+        if lexical is not None:
+            lexical.remove(doc_id, previous["chunks"] if previous else None)
+            lexical.add(doc_id, document.get("chunks", []))
+        near_duplicates = self.near_duplicate_indexes.get(session_id)
+        if near_duplicates is not None:
+            near_duplicates.add(doc_id, document.get("chunks", []))
+    
+    def _unindex_document(self, session_id: str, doc_id: str) -> Dict[str, Any]:
+        """Drop a document from memory and from the session's indexes"""
+        self._get_index(session_id).remove(doc_id)
+        document = self.documents[session_id].pop(doc_id)
+        self._session_bytes[session_id] -= self._document_bytes(document)
+        if session_id in self.lexical_indexes:
+            self.lexical_indexes[session_id].remove(doc_id, document.get("chunks", []))
+        if session_id in self.near_duplicate_indexes:
+            self.near_duplicate_indexes[session_id].remove(doc_id)
+        return document
+    
+    def _adopt_duplicates(self, session_id: str, removed: List[Dict[str, Any]],
+                          skip: Iterable[str] = ()) -> List[Dict[str, Any]]:
+        """
+        Give documents the chunks they skipped as duplicates of removed documents
+        
+        A chunk skipped at ingestion is only a reference to the chunk it
+        duplicates. When that chunk's document is deleted or replaced, the
+        referencing documents take over a copy of its text and embedding
+        (appended after their own chunks, so existing chunk indices stay
+        valid) and stay retrievable.
+        
+        Args:
+            session_id: Session identifier
+            removed: Documents (or replaced versions) no longer in the session
+            skip: Documents whose references are left alone, e.g. those
+                that replaced the removed versions
+        
+        Returns:
+            Updated documents, already indexed, for the caller to persist
+        """
+        adopters: Dict[str, Dict[str, Any]] = {}
+        session_docs = self.documents.get(session_id, {})
+        for source in removed:
+            for document in list(session_docs.values()):
+                references = document.get("duplicate_chunks") or []
+                moved = [reference for reference in references if reference["doc_id"] == source["id"]]
+                if not moved or document["id"] == source["id"] or document["id"] in skip:
+                    continue
+                rows = [reference["chunk_index"] for reference in moved
+                        if reference["chunk_index"] < len(source["chunks"])]
+                own = np.asarray(chunk_embeddings(document), dtype=np.float32)
+                copied = np.asarray(source["embeddings"], dtype=np.float32)[rows]
+                updated = {
+                    **document,
+                    "chunks": list(document["chunks"]) + [source["chunks"][row] for row in rows],
+                    "embeddings": np.concatenate([own.reshape(-1, copied.shape[1]), copied]),
+                    "duplicate_chunks": [reference for reference in references
+                                         if reference["doc_id"] != source["id"]]
+                }
+                self._index_document(session_id, updated)
+                adopters[updated["id"]] = updated
+        return list(adopters.values())
+    
+    def append_chunks(self, session_id: str, document: Dict[str, Any], chunks: List[str], embeddings):
+        """
+        Add a batch of chunks to a document that is still being ingested
+        
+        The chunks are searchable as soon as this returns, but nothing is
+        written to disk until commit_document(), so a failed upload never
+        leaves a partial document in storage. The first batch replaces any
+        previous version of the document.
+        
+        Args:
+            session_id: Session identifier
+            document: Document being ingested (its chunks and embeddings are extended in place)
+            chunks: New chunk texts
+            embeddings: One embedding per new chunk
+        """
+        doc_id = document["id"]
+        session_docs = self._get_session(session_id, create=True)
+        index = self._get_index(session_id)
+        vectors = index.check_dimensions(embeddings)
+        if vectors is None:
+            return
+        
+        ingesting = self.ingesting.setdefault(session_id, {})
+        state = ingesting.get(doc_id)
+        replaced = None  # Stored version this upload starts replacing
+        if state is None or state["document"] is not document:
+            previous = state["previous"] if state is not None else session_docs.get(doc_id)
+            replaced = previous if state is None else None
+            state = ingesting[doc_id] = {"document": document, "previous": previous, "buffer": None}
+        
+        # Embeddings grow in a buffer with spare capacity; the document holds a view of the filled rows
+        first = len(document["chunks"])
+        end = first + len(vectors)
+        buffer = state["buffer"]
+        if buffer is None or len(buffer) < end:
+            grown = np.empty((max(end, 2 * first), vectors.shape[1]), dtype=np.float32)
+            if first:
+                grown[:first] = document["embeddings"][:first]
+            buffer = state["buffer"] = grown
+        buffer[first:end] = vectors
+        
+        resident = session_docs.get(doc_id) is document
+        before = self._document_bytes(document) if resident else 0
+        document["chunks"].extend(chunks)
+        document["embeddings"] = buffer[:end]
+        if resident:
+            index.add(doc_id, vectors, first_chunk=first)
+            lexical = self.lexical_indexes.get(session_id)
+            if lexical is not None:
+                lexical.extend(doc_id, chunks)
+            near_duplicates = self.near_duplicate_indexes.get(session_id)
+            if near_duplicates is not None:
+                near_duplicates.extend(doc_id, chunks)
+            self._session_bytes[session_id] += self._document_bytes(document) - before
+        else:
+            # First batch, or the session was evicted and reloaded since the last one
+            self._index_document(session_id, document)
+        if replaced is not None:
+            adopters = self._adopt_duplicates(session_id, [replaced], skip={doc_id})
+            if adopters:
+                self._save_session(session_id, [encode_add(adopter) for adopter in adopters])
+        self._evict()
+    
+    def commit_document(self, session_id: str, document: Dict[str, Any]):
+        """Persist a document built with append_chunks()"""
+        self._end_ingestion(session_id, document)
+        
+        # Copy out of the growth buffer, releasing its spare capacity
+        document["embeddings"] = np.array(document.get("embeddings", []), dtype=np.float32)
+        session_docs = self._get_session(session_id, create=True)
+        if session_docs.get(document["id"]) is document:
+            self._save_session(session_id, [encode_add(document)])
+            self._evict()
+        else:
+            self.add_document(session_id, document)
+    
+    def _end_ingestion(self, session_id: str, document: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Forget the ingestion state of a document, returning it"""
+        ingesting = self.ingesting.get(session_id, {})
+        state = ingesting.get(document["id"])
+        if state is None or state["document"] is not document:
+            return None
+        del ingesting[document["id"]]
+        if not ingesting:
+            del self.ingesting[session_id]
+        return state
+    
+    def abort_document(self, session_id: str, document: Dict[str, Any]):
+        """Withdraw a partially ingested document, restoring the version it was replacing"""
+        doc_id = document["id"]
+        state = self._end_ingestion(session_id, document)
+        if state is None:
+            return
+        
+        session_docs = self.documents.get(session_id)
+        if session_docs is None or session_docs.get(doc_id) is not document:
+            return
+        if state["previous"] is not None:
+            self._index_document(session_id, state["previous"])
+        else:
+            self._unindex_document(session_id, doc_id)
     
     def get_document(self, session_id: str, doc_id: str) -> Optional[Dict[str, Any]]:
         """Get a specific document"""
-        return self.documents.get(session_id, {}).get(doc_id)
+        return (self._get_session(session_id) or {}).get(doc_id)
     
     def list_documents(self, session_id: str) -> List[Dict[str, Any]]:
         """List all documents for a session"""
-        if session_id not in self.documents:
+        session_docs = self._get_session(session_id)
+        if session_docs is None:
             return []
         
         # Return simplified document list (without embeddings)
         docs = []
-        for doc_id, doc in self.documents[session_id].items():
+        for doc_id, doc in session_docs.items():
             docs.append({
                 "id": doc["id"],
                 "filename": doc["filename"],
@@ -216,61 +918,222 @@ class DocumentStore:
     
     def delete_document(self, session_id: str, doc_id: str) -> bool:
         """Delete a document"""
-        if session_id in self.documents and doc_id in self.documents[session_id]:
-            del self.documents[session_id][doc_id]
-            self._save_session(session_id)
+        session_docs = self._get_session(session_id)
+        if session_docs is not None and doc_id in session_docs:
+            document = self._unindex_document(session_id, doc_id)
+            adopters = self._adopt_duplicates(session_id, [document])
+            self._save_session(session_id, [encode_add(adopter) for adopter in adopters] + [encode_delete(doc_id)])
             return True
         return False
     
     def clear_session(self, session_id: str):
         """Clear all documents for a session"""
-        if session_id in self.documents:
-            del self.documents[session_id]
-            file_path = self._get_session_file(session_id)
-            if file_path.exists():
-                file_path.unlink()
+        self.documents.pop(session_id, None)
+        self._session_bytes.pop(session_id, None)
+        self.indexes.pop(session_id, None)
+        self.lexical_indexes.pop(session_id, None)
+        self.near_duplicate_indexes.pop(session_id, None)
+        self.ingesting.pop(session_id, None)
+        self._index_changed.pop(session_id, None)
+        self._get_storage(session_id).delete()
+        self.storages.pop(session_id, None)
     
     def search_chunks(self, session_id: str, query_embedding: List[float], 
-                     top_k: int = 3, similarity_threshold: float = 0.3) -> List[Dict[str, Any]]:
+                     top_k: int = 3, similarity_threshold: float = 0.3,
+                     ef_search: Optional[int] = None,
+                     nprobe: Optional[int] = None) -> List[Dict[str, Any]]:
         """
         Search for relevant chunks using cosine similarity
         
+        With the exact backend this is one matrix-vector product over the
+        session's normalized embedding matrix followed by a partial top-k
+        selection; approximate backends answer from their own index.
+        
         Args:
             session_id: Session identifier
             query_embedding: Query embedding vector
             top_k: Number of top results to return
             similarity_threshold: Minimum similarity score
+            ef_search: HNSW search breadth (approximate "hnsw" backend only)
+            nprobe: IVF lists to probe (approximate "faiss" backend only)
             
         Returns:
             List of relevant chunks with metadata
         """
-        if session_id not in self.documents:
+        session_docs = self._get_session(session_id)
+        if session_docs is None:
+            return []
+        
+        matches = self._get_index(session_id).search(
+            query_embedding, top_k=top_k, similarity_threshold=similarity_threshold,
+            ef_search=ef_search, nprobe=nprobe
+        )
+        
+        return [
+            {
+                "chunk": session_docs[doc_id]["chunks"][chunk_index],
+                "similarity": similarity,
+                "document": session_docs[doc_id]["filename"],
+                "doc_id": doc_id,
+                "chunk_index": chunk_index
+            }
+            for doc_id, chunk_index, similarity in matches
+        ]
+    
+    def _get_lexical_index(self, session_id: str) -> LexicalIndex:
+        """Get the BM25 index for a loaded session, building it from the chunk text if needed"""
+        lexical = self.lexical_indexes.get(session_id)
+        if lexical is None:
+            lexical = LexicalIndex()
+            for doc_id, doc in self.documents.get(session_id, {}).items():
+                lexical.add(doc_id, doc.get("chunks", []))
+            self.lexical_indexes[session_id] = lexical
+        return lexical
+    
+    def find_near_duplicate(self, session_id: str, signature: Optional[np.ndarray], threshold: float,
+                            exclude: Optional[Callable[[str], bool]] = None) -> Optional[Tuple[str, int]]:
+        """
+        Find a stored chunk nearly identical to a new one
+        
+        The session's LSH index is built from the chunk text on first use
+        and kept up to date as documents are added and removed.
+        
+        Args:
+            session_id: Session identifier
+            signature: MinHash signature of the new chunk (see near_duplicates.py)
+            threshold: Minimum estimated Jaccard similarity
+            exclude: Documents not to match
+            
+        Returns:
+            (doc_id, chunk_index) of the stored chunk, or None
+        """
+        index = self.near_duplicate_indexes.get(session_id)
+        if index is None:
+            index = NearDuplicateIndex()
+            for doc_id, doc in self._get_session(session_id, create=True).items():
+                index.add(doc_id, doc.get("chunks", []))
+            self.near_duplicate_indexes[session_id] = index
+        return index.query(signature, threshold, exclude)
+    
+    def search_lexical(self, session_id: str, query: str, top_k: int = 3) -> List[Dict[str, Any]]:
+        """
+        Search for chunks by keywords with BM25 (no query embedding needed)
+        
+        Args:
+            session_id: Session identifier
+            query: Query text
+            top_k: Number of top results to return
+            
+        Returns:
+            List of relevant chunks with metadata; "score" holds the BM25 score
+        """
+        session_docs = self._get_session(session_id)
+        if session_docs is None:
             return []
         
-        from embedding_service import cosine_similarity
+        return [
+            {
+                "chunk": session_docs[doc_id]["chunks"][chunk_index],
+                "similarity": None,
+                "score": score,
+                "document": session_docs[doc_id]["filename"],
+                "doc_id": doc_id,
+                "chunk_index": chunk_index
+            }
+            for doc_id, chunk_index, score in self._get_lexical_index(session_id).search(query, top_k)
+        ]
+    
+    def search_hybrid(self, session_id: str, query: str, query_embedding: List[float],
+                      top_k: int = 3, similarity_threshold: float = 0.3,
+                      candidates: Optional[int] = None, rrf_k: int = 60,
+                      ef_search: Optional[int] = None,
+                      nprobe: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Search with BM25 and embeddings, fused by reciprocal rank fusion
         
-        results = []
+        Args:
+            session_id: Session identifier
+            query: Query text
+            query_embedding: Query embedding vector
+            top_k: Number of top results to return
+            similarity_threshold: Minimum similarity for vector candidates
+            candidates: Results taken from each ranking before fusion (default 4 * top_k, at least 20)
+            rrf_k: Reciprocal rank fusion damping constant
+            ef_search: HNSW search breadth (approximate "hnsw" backend only)
+            nprobe: IVF lists to probe (approximate "faiss" backend only)
+            
+        Returns:
+            List of relevant chunks with metadata; "score" holds the fused
+            score and "similarity" the cosine similarity where it is known
+        """
+        session_docs = self._get_session(session_id)
+        if session_docs is None:
+            return []
         
-        # Search through all documents in the session
-        for doc_id, doc in self.documents[session_id].items():
-            chunks = doc.get("chunks", [])
-            embeddings = doc.get("embeddings", [])
+        depth = candidates or max(4 * top_k, 20)
+        vector_matches = self._get_index(session_id).search(
+            query_embedding, top_k=depth, similarity_threshold=similarity_threshold,
+            ef_search=ef_search, nprobe=nprobe
+        )
+        lexical_matches = self._get_lexical_index(session_id).search(query, depth)
+        similarities = {(doc_id, chunk_index): sim for doc_id, chunk_index, sim in vector_matches}
+        
+        return [
+            {
+                "chunk": session_docs[doc_id]["chunks"][chunk_index],
+                "similarity": similarities.get((doc_id, chunk_index)),
+                "score": score,
+                "document": session_docs[doc_id]["filename"],
+                "doc_id": doc_id,
+                "chunk_index": chunk_index
+            }
+            for doc_id, chunk_index, score in reciprocal_rank_fusion(
+                [vector_matches, lexical_matches], top_k=top_k, k=rrf_k
+            )
+        ]
+    
+    def recall_report(self, session_id: str, queries: Optional[List[List[float]]] = None,
+                      top_k: int = 10, samples: int = 100) -> Optional[Dict[str, Any]]:
+        """
+        Measure how closely a session's index matches exact search
+        
+        Args:
+            session_id: Session identifier
+            queries: Query embeddings; defaults to a sample of the stored chunk embeddings
+            top_k: Number of results compared per query
+            samples: Number of stored chunks sampled when no queries are given
             
-            for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-                similarity = cosine_similarity(query_embedding, embedding)
-                
-                if similarity >= similarity_threshold:
-                    results.append({
-                        "chunk": chunk,
-                        "similarity": similarity,
-                        "document": doc["filename"],
-                        "doc_id": doc_id,
-                        "chunk_index": i
-                    })
-        
-        # Sort by similarity and return top_k
-        results.sort(key=lambda x: x["similarity"], reverse=True)
-        return results[:top_k]
+        Returns:
+            Recall, latency and memory figures, or None if the session has no embeddings.
+            With dimension reduction, the same backend at full width is measured
+            too and recall_delta is the recall change caused by the reduction.
+        """
+        session_docs = self._get_session(session_id)
+        if not session_docs:
+            return None
+        
+        index = self._get_index(session_id)
+        if len(index) == 0:
+            return None
+        
+        if queries is None:
+            rows = np.random.default_rng(0).choice(len(index), size=min(samples, len(index)), replace=False)
+            queries = index.full_precision(np.sort(rows))
+        queries = np.asarray(queries, dtype=np.float32)
+        report = measure_recall(index, queries, top_k=top_k)
+        
+        if index.reducer is not None:
+            full_width = SessionIndex(index.backend_class, index.backend_options, session_docs)
+            for doc_id, doc in session_docs.items():
+                full_width.add(doc_id, chunk_embeddings(doc))
+            baseline = measure_recall(full_width, queries, top_k=top_k)
+            report.update({
+                "full_width_recall": baseline["recall"],
+                "recall_delta": report["recall"] - baseline["recall"],
+                "full_width_latency_ms": baseline["index_latency_ms"],
+                "full_width_index_bytes": baseline["index_bytes"]
+            })
+        return report
 
 
 # Global document store instance
@@ -0,0 +1,142 @@
+"""
+Embedding Micro-batching
+=========================
+Coalesces concurrent single-text embedding requests into batched calls
+
+Chat requests each embed one query. When many arrive together, the batcher
+holds requests for the same provider/model/key for up to max_wait (or until
+max_batch_size distinct texts are waiting), sends one batched call and fans
+the rows back out to the waiting callers. Local models get real batches and
+remote providers are hit with one round-trip instead of many.
+"""
+
+import os
+import asyncio
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+import numpy as np
+
+
+class _PendingBatch:
+    """Requests collected for one key while its batch is open"""
+    
+    def __init__(self, loop: asyncio.AbstractEventLoop, embed_many: Callable[[List[str]], Awaitable[Any]],
+                 limit: int):
+        self.loop = loop
+        self.embed_many = embed_many
+        self.limit = limit
+        self.rows: Dict[str, int] = {}  # {text: row in the batched call}
+        self.waiters: List[Tuple[str, asyncio.Future]] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class EmbeddingBatcher:
+    """
+    Per-key request coalescing with a time and size bound
+    
+    Keys identify calls that may share a batch (provider, model, tenant and
+    kind of input); the embed_many callable of the request that opened a
+    batch embeds the whole batch. Identical texts in one batch are embedded
+    once.
+    """
+    
+    def __init__(self, max_wait_ms: Optional[float] = None, max_batch_size: Optional[int] = None):
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else float(
+            os.getenv("RAG_EMBED_BATCH_WAIT_MS", "2")
+        )) / 1000
+        self.max_batch_size = max_batch_size or int(os.getenv("RAG_EMBED_BATCH_MAX", "64"))
+        self._pending: Dict[Hashable, _PendingBatch] = {}
+        self._running: Set[asyncio.Task] = set()
+        self.counters = {"requests": 0, "batches": 0, "texts": 0, "full_flushes": 0, "timeout_flushes": 0}
+        self.batch_sizes: Counter = Counter()
+        self._fill_total = 0.0
+    
+    async def embed(self, key: Hashable, text: str, embed_many: Callable[[List[str]], Awaitable[Any]],
+                    max_batch_size: Optional[int] = None) -> np.ndarray:
+        """
+        Embed one text, sharing a batched call with concurrent requests for the same key
+        
+        Args:
+            key: Batch compatibility key
+            text: Text to embed
+            embed_many: Coroutine function embedding a list of texts into rows
+            max_batch_size: Provider limit on texts per call (capped by the batcher's own)
+        
+        Returns:
+            float32 embedding of the text
+        """
+        limit = min(self.max_batch_size, max_batch_size or self.max_batch_size)
+        self.counters["requests"] += 1
+        if self.max_wait <= 0 or limit <= 1:
+            # Batching disabled
+            self._record(1, limit)
+            return np.asarray(await embed_many([text]), dtype=np.float32)[0]
+        
+        loop = asyncio.get_running_loop()
+        batch = self._pending.get(key)
+        if batch is None or batch.loop is not loop:
+            batch = _PendingBatch(loop, embed_many, limit)
+            self._pending[key] = batch
+            batch.timer = loop.call_later(self.max_wait, self._flush, key, batch, "timeout")
+        
+        future = loop.create_future()
+        batch.waiters.append((text, future))
+        batch.rows.setdefault(text, len(batch.rows))
+        if len(batch.rows) >= batch.limit:
+            self._flush(key, batch, "full")
+        return await future
+    
+    def _flush(self, key: Hashable, batch: _PendingBatch, reason: str):
+        """Close a batch and start its embedding call"""
+        if self._pending.get(key) is batch:
+            del self._pending[key]
+        if batch.timer is not None:
+            batch.timer.cancel()
+            batch.timer = None
+        if not batch.waiters:
+            return
+        
+        self._record(len(batch.rows), batch.limit, reason)
+        task = batch.loop.create_task(self._run(batch))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+    
+    async def _run(self, batch: _PendingBatch):
+        """Embed a closed batch and resolve its waiters"""
+        try:
+            rows = np.asarray(await batch.embed_many(list(batch.rows)), dtype=np.float32)
+            if len(rows) != len(batch.rows):
+                raise Exception(f"Batched embedding returned {len(rows)} rows for {len(batch.rows)} texts")
+        except Exception as e:
+            for _, future in batch.waiters:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for text, future in batch.waiters:
+            if not future.done():
+                future.set_result(rows[batch.rows[text]])
+    
+    def _record(self, size: int, limit: int, reason: Optional[str] = None):
+        self.counters["batches"] += 1
+        self.counters["texts"] += size
+        if reason:
+            self.counters[f"{reason}_flushes"] += 1
+        self.batch_sizes[size] += 1
+        self._fill_total += size / limit
+    
+    def stats(self) -> Dict[str, Any]:
+        """Batch count, mean batch size and fill (size / limit), and the batch size histogram"""
+        batches = self.counters["batches"]
+        return {
+            **self.counters,
+            "max_wait_ms": self.max_wait * 1000,
+            "max_batch_size": self.max_batch_size,
+            "mean_batch_size": self.counters["texts"] / batches if batches else 0.0,
+            "mean_fill": self._fill_total / batches if batches else 0.0,
+            "batch_sizes": dict(sorted(self.batch_sizes.items()))
+        }
+
+
+# Global batcher for query embeddings shared by all EmbeddingClient instances
+query_batcher = EmbeddingBatcher()
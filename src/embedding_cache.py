@@ -0,0 +1,281 @@
+"""
+Embedding Caches for RAG
+=========================
+Process-wide cache of query embeddings, so retried and repeated chat
+messages do not pay another provider round-trip, and a persistent
+content-addressed cache of chunk embeddings, so re-uploaded or overlapping
+documents only embed the chunks that are new
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from pathlib import Path
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple, Callable, Sequence
+import numpy as np
+
+
+def normalize_query(query: str) -> str:
+    """Canonical form of a query for cache lookups (Unicode NFC, collapsed whitespace)"""
+    return " ".join(unicodedata.normalize("NFC", query).split())
+
+
+def tenant_key(api_key: Optional[str]) -> str:
+    """
+    Opaque cache namespace for an API key
+    
+    Entries are never shared between keys, and the key itself is not kept
+    in memory by the cache.
+    """
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+
+
+class QueryEmbeddingCache:
+    """
+    Bounded LRU cache of query embeddings with a time-to-live
+    
+    Keys are (provider, model, tenant, normalized query), where tenant is a
+    hash of the API key, so one tenant's lookups can never be answered
+    from another tenant's entries.
+    """
+    
+    def __init__(self, max_entries: Optional[int] = None, ttl_seconds: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries if max_entries is not None else int(
+            os.getenv("RAG_QUERY_CACHE_SIZE", "1024")
+        )
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(
+            os.getenv("RAG_QUERY_CACHE_TTL", "3600")
+        )
+        self.clock = clock
+        self._entries: "OrderedDict[Tuple[str, str, str, str], Tuple[float, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+    
+    @staticmethod
+    def make_key(provider: str, model: str, api_key: Optional[str], query: str) -> Tuple[str, str, str, str]:
+        return (provider, model, tenant_key(api_key), normalize_query(query))
+    
+    def get(self, key: Tuple[str, str, str, str]) -> Optional[np.ndarray]:
+        """Cached embedding for a key (read-only float32 vector), or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            
+            expires_at, embedding = entry
+            if self.clock() >= expires_at:
+                del self._entries[key]
+                self.counters["expirations"] += 1
+                self.counters["misses"] += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return embedding
+    
+    def put(self, key: Tuple[str, str, str, str], embedding: Sequence[float]) -> np.ndarray:
+        """
+        Store an embedding, evicting the least recently used entries beyond max_entries
+        
+        Returns:
+            The stored read-only float32 vector
+        """
+        vector = np.array(embedding, dtype=np.float32).ravel()
+        vector.flags.writeable = False
+        if self.max_entries <= 0:
+            return vector
+        
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl_seconds, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters["evictions"] += 1
+        return vector
+    
+    def clear(self):
+        """Drop every entry (counters are kept)"""
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Hit-rate and size counters"""
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "hit_rate": self.counters["hits"] / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds
+            }
+
+
+# Global query embedding cache shared by all EmbeddingClient instances
+query_embedding_cache = QueryEmbeddingCache()
+
+
+class ChunkEmbeddingCache:
+    """
+    Disk-backed cache of chunk embeddings keyed by hash(provider, model, text)
+    
+    Vectors are stored as float32 blobs in SQLite. Every hit refreshes the
+    entry's last-used time, and once the cache grows past max_bytes the least
+    recently used entries are deleted until it is back under 90% of the cap.
+    """
+    
+    def __init__(self, path: str, max_bytes: int = 512 * 1024 * 1024,
+                 clock: Callable[[], float] = time.time):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self.total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0}
+    
+    @staticmethod
+    def make_key(provider: str, model: str, text: str) -> bytes:
+        """Content address of a chunk embedding"""
+        digest = hashlib.sha256()
+        for part in (provider, model, text):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.digest()
+    
+    def get_many(self, keys: Sequence[bytes]) -> Dict[bytes, np.ndarray]:
+        """
+        Look up embeddings by key
+        
+        Returns:
+            {key: float32 vector} for the keys that are cached
+        """
+        unique = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch
+                ).fetchall()
+                found.update((bytes(key), np.frombuffer(vector, dtype=np.float32)) for key, vector in rows)
+            
+            if found:
+                now = self.clock()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found]
+                )
+                self._conn.commit()
+            self.counters["hits"] += len(found)
+            self.counters["misses"] += len(unique) - len(found)
+        return found
+    
+    def put_many(self, items: Sequence[Tuple[bytes, Sequence[float]]]):
+        """Store embeddings, evicting least recently used entries beyond max_bytes"""
+        if not items:
+            return
+        
+        now = self.clock()
+        rows = [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items]
+        with self._lock:
+            for key, blob, _ in rows:
+                previous = self._conn.execute(
+                    "SELECT LENGTH(vector) FROM embeddings WHERE key = ?", (key,)
+                ).fetchone()
+                self.total_bytes += len(blob) - (previous[0] if previous else 0)
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+    
+    def _evict(self):
+        """Delete least recently used entries until the cache is under 90% of max_bytes"""
+        target = int(self.max_bytes * 0.9)
+        cursor = self._conn.execute("SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used")
+        doomed = []
+        for key, size in cursor:
+            if self.total_bytes <= target:
+                break
+            doomed.append((key,))
+            self.total_bytes -= size
+        cursor.close()
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", doomed)
+        self.counters["evictions"] += len(doomed)
+    
+    def clear(self):
+        """Delete every cached embedding"""
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self.total_bytes = 0
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Hit-rate and size counters"""
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            return {
+                **self.counters,
+                "hit_rate": self.counters["hits"] / lookups if lookups else 0.0,
+                "entries": entries,
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes
+            }
+
+
+_chunk_cache: Optional[ChunkEmbeddingCache] = None
+_chunk_cache_lock = threading.Lock()
+
+
+def get_chunk_cache() -> Optional[ChunkEmbeddingCache]:
+    """
+    Global chunk embedding cache, opened on first use
+    
+    Located at RAG_EMBEDDING_CACHE_PATH (default ./rag_storage/embedding_cache.db)
+    and capped at RAG_EMBEDDING_CACHE_MAX_BYTES (default 512 MB, 0 disables it).
+    """
+    global _chunk_cache
+    max_bytes = int(os.getenv("RAG_EMBEDDING_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+    if max_bytes <= 0:
+        return None
+    
+    with _chunk_cache_lock:
+        if _chunk_cache is None:
+            try:
+                _chunk_cache = ChunkEmbeddingCache(
+                    os.getenv("RAG_EMBEDDING_CACHE_PATH", "./rag_storage/embedding_cache.db"),
+                    max_bytes=max_bytes
+                )
+            except Exception as e:
+                print(f"Chunk embedding cache unavailable: {e}")
+                return None
+        return _chunk_cache
+
+
+def chunk_cache_stats() -> Optional[Dict[str, Any]]:
+    """Statistics of the global chunk cache, or None if it has not been opened"""
+    cache = _chunk_cache
+    return cache.stats() if cache is not None else None
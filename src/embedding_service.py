@@ -5,9 +5,18 @@ Unified interface for different embedding providers in cloud mode
 """
 
 import os
-from typing import List, Dict, Any, Optional
+import base64
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple, Union, Callable, Awaitable
 import numpy as np
 
+from embedding_cache import QueryEmbeddingCache, ChunkEmbeddingCache, query_embedding_cache, get_chunk_cache, tenant_key
+from embedding_batcher import EmbeddingBatcher, query_batcher
+from local_models import model_registry, ONNX_PREFIX
+from hash_embeddings import HashEmbedder, parse_dimensions
+from rate_limiter import RateLimiter, RetryPolicy, get_rate_limiter
+
 
 # Embedding provider configurations
 EMBEDDING_PROVIDERS = {
@@ -60,16 +69,189 @@ EMBEDDING_PROVIDERS = {
         ],
         "description": "Free, open-source models (runs on your server)",
         "requires_api_key": False
+    },
+    "onnx": {
+        "name": "ONNX Runtime (Free, Self-hosted, CPU-optimized)",
+        "models": [
+            {"id": "sentence-transformers/all-MiniLM-L6-v2", "name": "all-MiniLM-L6-v2 (Fast)", "dimensions": 384, "cost": "Free"},
+            {"id": "sentence-transformers/all-MiniLM-L6-v2:int8", "name": "all-MiniLM-L6-v2 int8 (Fastest)", "dimensions": 384, "cost": "Free"},
+            {"id": "sentence-transformers/all-mpnet-base-v2", "name": "all-mpnet-base-v2 (Quality)", "dimensions": 768, "cost": "Free"},
+            {"id": "BAAI/bge-small-en-v1.5", "name": "bge-small-en-v1.5", "dimensions": 384, "cost": "Free"},
+            {"id": "BAAI/bge-small-en-v1.5:int8", "name": "bge-small-en-v1.5 int8", "dimensions": 384, "cost": "Free"},
+            {"id": "BAAI/bge-base-en-v1.5", "name": "bge-base-en-v1.5 (Recommended)", "dimensions": 768, "cost": "Free"},
+            {"id": "BAAI/bge-base-en-v1.5:int8", "name": "bge-base-en-v1.5 int8", "dimensions": 768, "cost": "Free"}
+        ],
+        "description": "Hugging Face models exported to ONNX, optionally int8-quantized (no GPU needed)",
+        "requires_api_key": False
+    },
+    "local-hash": {
+        "name": "Local Hash (Offline, for benchmarks and tests)",
+        "models": [
+            {"id": "hash-384", "name": "Trigram hashing, 384 dimensions", "dimensions": 384, "cost": "Free"},
+            {"id": "hash-256", "name": "Trigram hashing, 256 dimensions", "dimensions": 256, "cost": "Free"},
+            {"id": "hash-768", "name": "Trigram hashing, 768 dimensions", "dimensions": 768, "cost": "Free"}
+        ],
+        "description": "Deterministic character-trigram feature hashing; no model download or network (lexical similarity only)",
+        "requires_api_key": False
     }
 }
 
 
+# Per-request limits of each provider's embedding API
+PROVIDER_BATCH_LIMITS = {
+    "openai": {"max_batch_size": 2048, "max_batch_tokens": 300000},
+    "cohere": {"max_batch_size": 96, "max_batch_tokens": None},
+    "google": {"max_batch_size": 100, "max_batch_tokens": None},
+    "voyage": {"max_batch_size": 128, "max_batch_tokens": 120000},
+    # Local model: one call, sentence-transformers batches internally
+    "huggingface": {"max_batch_size": 10000, "max_batch_tokens": None, "max_concurrency": 1},
+    "onnx": {"max_batch_size": 10000, "max_batch_tokens": None, "max_concurrency": 1},
+    "local-hash": {"max_batch_size": 10000, "max_batch_tokens": None, "max_concurrency": 1}
+}
+
+
+# Default per-key provider rate limits (override with RAG_<PROVIDER>_RPM / RAG_<PROVIDER>_TPM);
+# local providers are not limited
+PROVIDER_RATE_LIMITS = {
+    "openai": {"requests_per_minute": 3000, "tokens_per_minute": 1000000},
+    "cohere": {"requests_per_minute": 2000, "tokens_per_minute": None},
+    "google": {"requests_per_minute": 1500, "tokens_per_minute": None},
+    "voyage": {"requests_per_minute": 300, "tokens_per_minute": 1000000}
+}
+
+
+def provider_rate_limits(provider: str) -> Optional[Dict[str, Optional[float]]]:
+    """Rate limits for a provider, with environment overrides, or None if it is not limited"""
+    defaults = PROVIDER_RATE_LIMITS.get(provider)
+    if defaults is None:
+        return None
+    
+    prefix = f"RAG_{provider.upper()}"
+    limits = {}
+    for name, suffix in (("requests_per_minute", "RPM"), ("tokens_per_minute", "TPM")):
+        value = os.getenv(f"{prefix}_{suffix}")
+        limits[name] = (float(value) or None) if value is not None else defaults[name]
+    return limits
+
+
+# Bounded pool for local (CPU-bound) embedding models used from async code
+_local_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("RAG_LOCAL_EMBEDDING_WORKERS", "2")),
+    thread_name_prefix="local-embedding"
+)
+
+
+def join_batches(results: List[Any], expected: int, provider: str) -> np.ndarray:
+    """Stack per-batch provider results into one float32 matrix, checking the row count"""
+    matrices = [np.asarray(result, dtype=np.float32) for result in results if len(result)]
+    if not matrices:
+        embeddings = np.empty((0, 0), dtype=np.float32)
+    elif len(matrices) == 1:
+        embeddings = matrices[0]
+    else:
+        embeddings = np.concatenate(matrices)
+    
+    if len(embeddings) != expected:
+        raise Exception(f"{provider} returned {len(embeddings)} embeddings for {expected} texts")
+    return embeddings
+
+
+def decode_openai_embeddings(data: List[Any]) -> np.ndarray:
+    """Decode base64 float32 embeddings from an OpenAI response without a float list detour"""
+    return np.stack([
+        np.frombuffer(base64.b64decode(item.embedding), dtype=np.float32)
+        if isinstance(item.embedding, str) else np.asarray(item.embedding, dtype=np.float32)
+        for item in data
+    ])
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Conservative token count when the model's tokenizer is not available
+    
+    ASCII text is counted at 3 characters per token (English prose averages
+    about 4, code nearer 3) and every other character as a token of its own,
+    since BPE vocabularies split CJK and most non-Latin scripts into a token
+    or more per character.
+    """
+    non_ascii = len(text) - len(text.encode("ascii", "ignore"))
+    return (len(text) - non_ascii) // 3 + non_ascii + 1
+
+
+def estimate_token_ends(text: str) -> np.ndarray:
+    """
+    End offset in text of each token counted by estimate_tokens()
+    
+    A token ends at every non-ASCII character and at every third ASCII
+    character, so chunks sized with these offsets stay within the same
+    conservative bound that request batching uses.
+    """
+    codes = np.frombuffer(text.encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+    ascii_chars = codes < 128
+    ends = np.flatnonzero(~ascii_chars | (np.cumsum(ascii_chars) % 3 == 0) & ascii_chars) + 1
+    if len(text) and (not len(ends) or ends[-1] != len(text)):
+        ends = np.append(ends, len(text))
+    return ends.astype(np.int64)
+
+
+def make_batches(texts: List[str], max_batch_size: int, max_batch_tokens: Optional[int] = None,
+                 token_counts: Optional[List[int]] = None) -> List[Tuple[int, int]]:
+    """
+    Split texts into consecutive batches within a provider's request limits
+    
+    Args:
+        texts: Texts to embed
+        max_batch_size: Maximum number of texts per request
+        max_batch_tokens: Maximum tokens per request (None for no limit)
+        token_counts: Tokens of each text (estimated with estimate_tokens() if not given)
+        
+    Returns:
+        List of (start, end) ranges into texts
+    """
+    batches = []
+    start = 0
+    tokens = 0
+    for i, text in enumerate(texts):
+        if not max_batch_tokens:
+            text_tokens = 0
+        else:
+            text_tokens = token_counts[i] if token_counts is not None else estimate_tokens(text)
+        full = i - start >= max_batch_size or (
+            max_batch_tokens and i > start and tokens + text_tokens > max_batch_tokens
+        )
+        if full:
+            batches.append((start, i))
+            start, tokens = i, 0
+        tokens += text_tokens
+    if start < len(texts):
+        batches.append((start, len(texts)))
+    return batches
+
+
 class EmbeddingClient:
     """Unified client for multiple embedding providers"""
     
-    def __init__(self, provider: str, api_key: Optional[str] = None, model: Optional[str] = None):
+    def __init__(self, provider: str, api_key: Optional[str] = None, model: Optional[str] = None,
+                 query_cache: Optional[QueryEmbeddingCache] = None,
+                 chunk_cache: Optional[ChunkEmbeddingCache] = None,
+                 max_concurrency: Optional[int] = None,
+                 batcher: Optional[EmbeddingBatcher] = None):
         self.provider = provider
         self.api_key = api_key
+        self.query_cache = query_cache or query_embedding_cache
+        self.batcher = batcher or query_batcher
+        self.chunk_cache = chunk_cache  # Defaults to the global cache, opened on first use
+        
+        # Batches sent to the provider in parallel
+        self.batch_limits = PROVIDER_BATCH_LIMITS.get(provider, {"max_batch_size": 100})
+        self.max_concurrency = self.batch_limits.get("max_concurrency") or max_concurrency or int(
+            os.getenv("RAG_EMBEDDING_CONCURRENCY", "4")
+        )
+        
+        # Requests and tokens are paced per API key; rate limits and transient errors are retried
+        limits = provider_rate_limits(provider)
+        self.rate_limiter: Optional[RateLimiter] = get_rate_limiter(provider, api_key, **limits) if limits else None
+        self.retry_policy = RetryPolicy(max_retries=int(os.getenv("RAG_EMBEDDING_MAX_RETRIES", "5")))
         
         if provider not in EMBEDDING_PROVIDERS:
             raise ValueError(f"Unknown provider: {provider}. Available: {list(EMBEDDING_PROVIDERS.keys())}")
@@ -84,16 +266,36 @@ class EmbeddingClient:
         
         # Initialize provider-specific client
         self._init_client()
+        self._tokenizer = None  # Loaded on first count_tokens()
     
     def _init_client(self):
         """Initialize the provider-specific client"""
         if self.provider == "huggingface" and self.api_key is None:
-            # For self-hosted HF models, we'll use sentence-transformers
-            try:
-                from sentence_transformers import SentenceTransformer
-                self.client = SentenceTransformer(self.model)
-            except ImportError:
-                raise ImportError("sentence-transformers not installed. Install with: pip install sentence-transformers")
+            # For self-hosted HF models, we'll use sentence-transformers (loaded once per process)
+            self.client = model_registry.get(self.model)
+        elif self.provider == "onnx":
+            # Same models exported to ONNX Runtime; ":int8" model ids are quantized
+            self.client = model_registry.get(ONNX_PREFIX + self.model)
+        elif self.provider == "local-hash":
+            self.client = HashEmbedder(parse_dimensions(self.model))
+    
+    def count_tokens(self, text: str) -> int:
+        """
+        Tokens of a text as the provider counts them against its request limits
+        
+        Uses the model's own tokenizer for providers with a per-request token
+        limit where one is installed (tiktoken for OpenAI), and the
+        conservative estimate_tokens() otherwise.
+        """
+        if not self.batch_limits.get("max_batch_tokens"):
+            return estimate_tokens(text)
+        if self._tokenizer is None:
+            from tokenization import ApproximateTokenizer, get_tokenizer
+            tokenizer = get_tokenizer(self.provider, self.model)
+            self._tokenizer = False if isinstance(tokenizer, ApproximateTokenizer) else tokenizer
+        if not self._tokenizer:
+            return estimate_tokens(text)
+        return len(self._tokenizer.token_ends(text)) + self._tokenizer.special_tokens
     
     def embed_text(self, text: str) -> List[float]:
         """
@@ -107,42 +309,149 @@ class EmbeddingClient:
         """
         return self.embed_texts([text])[0]
     
-    def embed_texts(self, texts: List[str]) -> List[List[float]]:
+    def embed_texts(self, texts: List[str], as_numpy: bool = False) -> Union[List[List[float]], np.ndarray]:
         """
         Embed multiple text strings
         
+        Texts already embedded with this provider and model are served from
+        the chunk embedding cache; only the misses are sent to the provider.
+        
         Args:
             texts: List of texts to embed
+            as_numpy: Return a float32 matrix (one row per text) instead of lists
             
         Returns:
             List of embeddings
         """
+        cache = self._chunk_cache()
+        if cache is None or not texts:
+            embeddings = self._embed_texts(texts)
+        else:
+            keys, found, missing = self._lookup_cached(cache, texts)
+            if missing:
+                # Each batch is cached as soon as it arrives, so a failed upload keeps its progress
+                missing_keys = list(missing)
+                self._embed_texts(
+                    list(missing.values()),
+                    on_batch=lambda start, end, rows: self._store_cached(cache, found, missing_keys[start:end], rows)
+                )
+            embeddings = np.stack([found[key] for key in keys])
+        return embeddings if as_numpy else embeddings.tolist()
+    
+    def _chunk_cache(self) -> Optional[ChunkEmbeddingCache]:
+        """Chunk cache for this client; hashed embeddings are cheaper to recompute than to look up"""
+        if self.provider == "local-hash":
+            return None
+        return self.chunk_cache or get_chunk_cache()
+    
+    def _lookup_cached(self, cache: ChunkEmbeddingCache, texts: List[str]):
+        """
+        Split texts into cached embeddings and texts still to embed
+        
+        Returns:
+            (keys, {key: cached vector}, {key: missing text}); each missing
+            text appears once, even if it occurs several times in texts
+        """
+        keys = [cache.make_key(self.provider, self.model, text) for text in texts]
+        found = cache.get_many(keys)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        return keys, found, missing
+    
+    @staticmethod
+    def _store_cached(cache: ChunkEmbeddingCache, found: Dict[bytes, np.ndarray],
+                      keys: List[bytes], embeddings: Any):
+        """Add freshly computed embeddings to the cache and to the lookup results"""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if len(embeddings) != len(keys):
+            return  # Reported by join_batches
+        new_items = list(zip(keys, embeddings))
+        cache.put_many(new_items)
+        found.update(new_items)
+    
+    def _limited(self, tokens: int, function: Callable[..., Any], *args) -> Any:
+        """Call the provider within the rate limiter, retrying rate limits and transient errors"""
+        if self.rate_limiter is None:
+            return function(*args)
+        return self.retry_policy.call(self.rate_limiter, tokens, lambda: function(*args))
+    
+    async def _alimited(self, tokens: int, function: Callable[..., Awaitable[Any]], *args) -> Any:
+        """Async version of _limited()"""
+        if self.rate_limiter is None:
+            return await function(*args)
+        return await self.retry_policy.acall(self.rate_limiter, tokens, lambda: function(*args))
+    
+    def _plan_batches(self, texts: List[str]) -> Tuple[List[int], List[Tuple[int, int]]]:
+        """Token count of each text and the (start, end) batches within the provider's limits"""
+        token_counts = [self.count_tokens(text) for text in texts]
+        batches = make_batches(
+            texts, self.batch_limits["max_batch_size"], self.batch_limits.get("max_batch_tokens"), token_counts
+        )
+        return token_counts, batches
+    
+    def _embed_texts(self, texts: List[str],
+                     on_batch: Optional[Callable[[int, int, Any], None]] = None) -> np.ndarray:
+        """
+        Embed texts with the provider (uncached)
+        
+        Texts are split into batches within the provider's request limits;
+        the batches are sent with up to max_concurrency requests in flight
+        and the results are reassembled in input order. on_batch(start, end,
+        rows) is called as each batch completes.
+        """
+        embed_batch = self._batch_embedder()
+        token_counts, batches = self._plan_batches(texts)
+        
+        def run(batch: Tuple[int, int]):
+            start, end = batch
+            batch_texts = texts[start:end]
+            rows = self._limited(sum(token_counts[start:end]), embed_batch, batch_texts)
+            if on_batch is not None:
+                on_batch(start, end, rows)
+            return rows
+        
+        if len(batches) <= 1 or self.max_concurrency <= 1:
+            results = [run(batch) for batch in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as pool:
+                results = list(pool.map(run, batches))
+        
+        return join_batches(results, len(texts), self.provider)
+    
+    def _batch_embedder(self):
+        """Provider function embedding one batch of texts"""
         if self.provider == "openai":
-            return self._embed_openai(texts)
+            return self._embed_openai
         elif self.provider == "cohere":
-            return self._embed_cohere(texts)
+            return self._embed_cohere
         elif self.provider == "google":
-            return self._embed_google(texts)
+            return self._embed_google
         elif self.provider == "voyage":
-            return self._embed_voyage(texts)
-        elif self.provider == "huggingface":
-            return self._embed_huggingface(texts)
+            return self._embed_voyage
+        elif self.provider in ("huggingface", "onnx"):
+            return self._embed_huggingface
+        elif self.provider == "local-hash":
+            return self.client.encode
         else:
             raise NotImplementedError(f"Provider {self.provider} not yet implemented")
     
-    def _embed_openai(self, texts: List[str]) -> List[List[float]]:
+    def _embed_openai(self, texts: List[str]) -> np.ndarray:
         """OpenAI embeddings"""
         try:
             import openai
             
             client = openai.OpenAI(api_key=self.api_key)
             
+            # Raw float32 bytes, decoded straight into an array
             response = client.embeddings.create(
                 model=self.model,
-                input=texts
+                input=texts,
+                encoding_format="base64"
             )
             
-            return [item.embedding for item in response.data]
+            return decode_openai_embeddings(response.data)
             
         except Exception as e:
             raise Exception(f"OpenAI embedding error: {str(e)}")
@@ -172,16 +481,14 @@ class EmbeddingClient:
             
             genai.configure(api_key=self.api_key)
             
-            embeddings = []
-            for text in texts:
-                result = genai.embed_content(
-                    model=self.model,
-                    content=text,
-                    task_type="retrieval_document"
-                )
-                embeddings.append(result['embedding'])
+            # A list of contents is sent as one batchEmbedContents request
+            result = genai.embed_content(
+                model=self.model,
+                content=texts,
+                task_type="retrieval_document"
+            )
             
-            return embeddings
+            return result['embedding']
             
         except Exception as e:
             raise Exception(f"Google AI embedding error: {str(e)}")
@@ -204,25 +511,44 @@ class EmbeddingClient:
         except Exception as e:
             raise Exception(f"Voyage AI embedding error: {str(e)}")
     
-    def _embed_huggingface(self, texts: List[str]) -> List[List[float]]:
+    def _embed_huggingface(self, texts: List[str]) -> np.ndarray:
         """Hugging Face embeddings (self-hosted)"""
         try:
-            embeddings = self.client.encode(texts, convert_to_numpy=True)
-            return embeddings.tolist()
+            return self.client.encode(texts, convert_to_numpy=True)
             
         except Exception as e:
             raise Exception(f"Hugging Face embedding error: {str(e)}")
     
-    def embed_query(self, query: str) -> List[float]:
+    def embed_query(self, query: str, as_numpy: bool = False) -> Union[List[float], np.ndarray]:
         """
         Embed a search query (may use different parameters than documents)
         
+        Results are cached per provider, model and API key, so repeated
+        queries skip the provider round-trip.
+        
         Args:
             query: Search query text
+            as_numpy: Return a read-only float32 vector instead of a list
             
         Returns:
             Query embedding
         """
+        key = self.query_cache.make_key(self.provider, self.model, self.api_key, query)
+        embedding = self.query_cache.get(key)
+        if embedding is None:
+            embedding = self.query_cache.put(key, self._embed_query(query))
+        return embedding if as_numpy else embedding.tolist()
+    
+    def _embed_query(self, query: str) -> List[float]:
+        """Embed a search query with the provider (uncached)"""
+        if self.provider in ("cohere", "google"):
+            return self._limited(estimate_tokens(query), self._embed_search_query, query)
+        
+        # For others, use regular embedding
+        return self._embed_texts([query])[0]
+    
+    def _embed_search_query(self, query: str) -> List[float]:
+        """Query embedding for providers with a separate search-query input type"""
         # For Cohere, we use search_query type
         if self.provider == "cohere":
             try:
@@ -251,15 +577,231 @@ class EmbeddingClient:
             except Exception as e:
                 raise Exception(f"Google AI query embedding error: {str(e)}")
         
-        # For others, use regular embedding
         else:
-            return self.embed_text(query)
+            raise NotImplementedError(f"Provider {self.provider} has no search-query input type")
+    
+    # ------------------------------------------------------------------
+    # Async API: remote providers use their native async clients, local
+    # models run in a bounded thread pool, so the event loop never blocks
+    # ------------------------------------------------------------------
+    
+    async def aembed_texts(self, texts: List[str],
+                           as_numpy: bool = False) -> Union[List[List[float]], np.ndarray]:
+        """
+        Embed multiple text strings without blocking the event loop
+        
+        Args:
+            texts: List of texts to embed
+            as_numpy: Return a float32 matrix (one row per text) instead of lists
+            
+        Returns:
+            List of embeddings
+        """
+        cache = self._chunk_cache()
+        if cache is None or not texts:
+            embeddings = await self._aembed_texts(texts)
+        else:
+            # SQLite lookups are short but still disk I/O
+            keys, found, missing = await asyncio.to_thread(self._lookup_cached, cache, texts)
+            if missing:
+                missing_keys = list(missing)
+                await self._aembed_texts(
+                    list(missing.values()),
+                    on_batch=lambda start, end, rows: self._store_cached(cache, found, missing_keys[start:end], rows)
+                )
+            embeddings = np.stack([found[key] for key in keys])
+        return embeddings if as_numpy else embeddings.tolist()
+    
+    async def aembed_query(self, query: str, as_numpy: bool = False) -> Union[List[float], np.ndarray]:
+        """
+        Embed a search query without blocking the event loop
+        
+        Concurrent queries for the same provider, model and API key are
+        coalesced into one batched call by the query batcher.
+        
+        Args:
+            query: Search query text
+            as_numpy: Return a read-only float32 vector instead of a list
+            
+        Returns:
+            Query embedding
+        """
+        key = self.query_cache.make_key(self.provider, self.model, self.api_key, query)
+        embedding = self.query_cache.get(key)
+        if embedding is None:
+            batch_key = (self.provider, self.model, tenant_key(self.api_key), "query")
+            embedding = await self.batcher.embed(
+                batch_key, query, self._aembed_queries, self.batch_limits["max_batch_size"]
+            )
+            embedding = self.query_cache.put(key, embedding)
+        return embedding if as_numpy else embedding.tolist()
+    
+    async def _aembed_queries(self, queries: List[str]) -> np.ndarray:
+        """Embed search queries with the provider's async client (uncached, one row per query)"""
+        if self.provider in ("cohere", "google"):
+            return await self._alimited(
+                sum(map(estimate_tokens, queries)), self._aembed_search_queries, queries
+            )
+        return await self._aembed_texts(queries)
+    
+    async def _aembed_search_queries(self, queries: List[str]) -> np.ndarray:
+        """Query embeddings for providers with a separate search-query input type (async)"""
+        if self.provider == "cohere":
+            try:
+                import cohere
+                client = cohere.AsyncClient(api_key=self.api_key)
+                response = await client.embed(
+                    texts=queries,
+                    model=self.model,
+                    input_type="search_query"
+                )
+                return np.asarray(response.embeddings, dtype=np.float32)
+            except Exception as e:
+                raise Exception(f"Cohere query embedding error: {str(e)}")
+        
+        elif self.provider == "google":
+            try:
+                import google.generativeai as genai
+                genai.configure(api_key=self.api_key)
+                result = await genai.embed_content_async(
+                    model=self.model,
+                    content=queries,
+                    task_type="retrieval_query"
+                )
+                return np.asarray(result['embedding'], dtype=np.float32)
+            except Exception as e:
+                raise Exception(f"Google AI query embedding error: {str(e)}")
+        
+        else:
+            raise NotImplementedError(f"Provider {self.provider} has no search-query input type")
+    
+    async def _aembed_texts(self, texts: List[str],
+                            on_batch: Optional[Callable[[int, int, Any], None]] = None) -> np.ndarray:
+        """
+        Embed texts in provider-sized batches, at most max_concurrency at a time
+        
+        on_batch(start, end, rows) runs in a worker thread as each batch completes.
+        """
+        embed_batch = self._async_batch_embedder()
+        # Tokenizing (and loading the tokenizer on first use) happens off the event loop
+        token_counts, batches = await asyncio.to_thread(self._plan_batches, texts)
+        semaphore = asyncio.Semaphore(max(1, self.max_concurrency))
+        
+        async def run(start: int, end: int):
+            async with semaphore:
+                batch_texts = texts[start:end]
+                rows = await self._alimited(sum(token_counts[start:end]), embed_batch, batch_texts)
+            if on_batch is not None:
+                await asyncio.to_thread(on_batch, start, end, rows)
+            return rows
+        
+        results = await asyncio.gather(*(run(start, end) for start, end in batches))
+        return join_batches(results, len(texts), self.provider)
+    
+    def _async_batch_embedder(self):
+        """Async provider function embedding one batch of texts"""
+        if self.provider == "openai":
+            return self._aembed_openai
+        elif self.provider == "cohere":
+            return self._aembed_cohere
+        elif self.provider == "google":
+            return self._aembed_google
+        elif self.provider == "voyage":
+            return self._aembed_voyage
+        elif self.provider in ("huggingface", "onnx"):
+            return self._aembed_huggingface
+        elif self.provider == "local-hash":
+            return self._aembed_local_hash
+        else:
+            raise NotImplementedError(f"Provider {self.provider} not yet implemented")
+    
+    async def _aembed_openai(self, texts: List[str]) -> np.ndarray:
+        """OpenAI embeddings (async)"""
+        try:
+            import openai
+            
+            client = openai.AsyncOpenAI(api_key=self.api_key)
+            
+            response = await client.embeddings.create(
+                model=self.model,
+                input=texts,
+                encoding_format="base64"
+            )
+            
+            return decode_openai_embeddings(response.data)
+            
+        except Exception as e:
+            raise Exception(f"OpenAI embedding error: {str(e)}")
+    
+    async def _aembed_cohere(self, texts: List[str]) -> List[List[float]]:
+        """Cohere embeddings (async)"""
+        try:
+            import cohere
+            
+            client = cohere.AsyncClient(api_key=self.api_key)
+            
+            response = await client.embed(
+                texts=texts,
+                model=self.model,
+                input_type="search_document"
+            )
+            
+            return response.embeddings
+            
+        except Exception as e:
+            raise Exception(f"Cohere embedding error: {str(e)}")
+    
+    async def _aembed_google(self, texts: List[str]) -> List[List[float]]:
+        """Google AI embeddings (async)"""
+        try:
+            import google.generativeai as genai
+            
+            genai.configure(api_key=self.api_key)
+            
+            result = await genai.embed_content_async(
+                model=self.model,
+                content=texts,
+                task_type="retrieval_document"
+            )
+            
+            return result['embedding']
+            
+        except Exception as e:
+            raise Exception(f"Google AI embedding error: {str(e)}")
+    
+    async def _aembed_voyage(self, texts: List[str]) -> List[List[float]]:
+        """Voyage AI embeddings (async)"""
+        try:
+            import voyageai
+            
+            client = voyageai.AsyncClient(api_key=self.api_key)
+            
+            response = await client.embed(
+                texts=texts,
+                model=self.model,
+                input_type="document"
+            )
+            
+            return response.embeddings
+            
+        except Exception as e:
+            raise Exception(f"Voyage AI embedding error: {str(e)}")
+    
+    async def _aembed_huggingface(self, texts: List[str]) -> np.ndarray:
+        """Hugging Face embeddings, computed in the bounded local executor"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_local_executor, self._embed_huggingface, texts)
+    
+    async def _aembed_local_hash(self, texts: List[str]) -> np.ndarray:
+        """Hashed embeddings, computed in the bounded local executor"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_local_executor, self.client.encode, texts)
 
 
 def cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
     """Calculate cosine similarity between two vectors"""
-    vec1_np = np.array(vec1)
-    vec2_np = np.array(vec2)
+    vec1_np = np.asarray(vec1)
+    vec2_np = np.asarray(vec2)
     
     dot_product = np.dot(vec1_np, vec2_np)
     norm1 = np.linalg.norm(vec1_np)
@@ -0,0 +1,76 @@
+"""
+Feature-Hashing Embeddings
+===========================
+Deterministic offline embedder for benchmarks and tests
+
+Each text is lowercased, padded with spaces and split into byte trigrams.
+Every trigram is hashed to a signed bucket of a fixed-size vector and the
+vector is L2-normalized, so texts sharing many trigrams get high cosine
+similarity. Everything is computed with NumPy over the whole batch at
+once: no model download, no network, and identical output on every run.
+"""
+
+from typing import List
+import numpy as np
+
+
+_SIGNS = np.array([-1.0, 1.0])
+
+
+def _mix(codes: np.ndarray) -> np.ndarray:
+    """32-bit finalizer of MurmurHash3, spreading trigram codes over all bits"""
+    h = codes ^ (codes >> np.uint32(16))
+    h = h * np.uint32(0x85EBCA6B)
+    h ^= h >> np.uint32(13)
+    h = h * np.uint32(0xC2B2AE35)
+    h ^= h >> np.uint32(16)
+    return h
+
+
+def parse_dimensions(model_id: str) -> int:
+    """Vector size of a "hash-<dimensions>" model id"""
+    prefix, _, dimensions = model_id.rpartition("-")
+    if prefix != "hash" or not dimensions.isdigit() or int(dimensions) <= 0:
+        raise ValueError(f"Invalid local-hash model: {model_id}. Expected hash-<dimensions>, e.g. hash-384")
+    return int(dimensions)
+
+
+class HashEmbedder:
+    """
+    Signed feature hashing of character trigrams
+    
+    Provides the encode() call used for SentenceTransformer models.
+    """
+    
+    def __init__(self, dimensions: int = 384):
+        self.dimensions = dimensions
+    
+    def encode(self, texts: List[str], **kwargs) -> np.ndarray:
+        """
+        Embed texts
+        
+        Returns:
+            float32 matrix with one L2-normalized row per text (all zeros for empty text)
+        """
+        count = len(texts)
+        encoded = [f" {text.lower()} ".encode("utf-8") for text in texts]
+        lengths = np.fromiter((len(item) for item in encoded), dtype=np.int64, count=count)
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8).astype(np.uint32)
+        if len(data) < 3:
+            return np.zeros((count, self.dimensions), dtype=np.float32)
+        
+        # Trigram starting at every byte, dropping those that cross into the next text
+        rows = np.repeat(np.arange(count, dtype=np.int64), lengths)
+        codes = (data[:-2] << np.uint32(16)) | (data[1:-1] << np.uint32(8)) | data[2:]
+        within = rows[:-2] == rows[2:]
+        hashed = _mix(codes[within])
+        rows = rows[:-2][within]
+        
+        buckets = (hashed >> np.uint32(1)) % np.uint32(self.dimensions)
+        signs = _SIGNS[hashed & np.uint32(1)]
+        matrix = np.bincount(
+            rows * self.dimensions + buckets, weights=signs, minlength=count * self.dimensions
+        ).reshape(count, self.dimensions).astype(np.float32)
+        
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.clip(norms, 1e-12, None)
@@ -0,0 +1,450 @@
+"""
+Streaming Document Ingestion
+=============================
+Extract, chunk, embed and index a document as overlapping stages
+
+Instead of extracting all of the text, then chunking all of it, then
+embedding every chunk and finally indexing the document, an upload flows
+through four stages connected by bounded queues:
+
+    extract -> chunk -> embed -> index
+
+PDF pages are extracted while earlier chunks are being embedded, and each
+embedded batch is appended to the session index as soon as it arrives, so
+a large document is searchable after its first batch. The bounded queues
+apply backpressure: a fast extractor waits for a slow embedding provider
+instead of piling up chunks in memory. Per-stage timings show which stage
+limits throughput.
+
+Many small files are better ingested together with ingest_many(): they are
+extracted in parallel, their chunks are embedded in shared provider-sized
+requests, and all of them are written to the session log at once.
+
+With deduplication on, chunks nearly identical to one already in the
+session (or earlier in the same upload) are dropped before embedding;
+the document keeps a reference to the chunk each one duplicates in its
+duplicate_chunks field. When the referenced document is deleted or
+replaced, the store copies the chunk into the referencing document.
+"""
+
+import os
+import time
+import asyncio
+from datetime import datetime
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple
+
+from document_processor import DocumentProcessor, DocumentChunker, DocumentStore
+from near_duplicates import Deduplicator
+
+
+_DONE = None  # End-of-stream marker passed down the queues
+
+
+class StageMetrics:
+    """Work and time of one pipeline stage"""
+    
+    def __init__(self, unit: str):
+        self.unit = unit
+        self.items = 0  # Pieces or batches handled
+        self.units = 0  # Characters or chunks handled
+        self.busy_seconds = 0.0  # Doing the stage's own work
+        self.waiting_seconds = 0.0  # Waiting for input from the previous stage
+        self.blocked_seconds = 0.0  # Waiting for room in the next stage's queue
+    
+    def add(self, other: "StageMetrics"):
+        self.items += other.items
+        self.units += other.units
+        self.busy_seconds += other.busy_seconds
+        self.waiting_seconds += other.waiting_seconds
+        self.blocked_seconds += other.blocked_seconds
+    
+    def report(self) -> Dict[str, Any]:
+        return {
+            "items": self.items,
+            self.unit: self.units,
+            "busy_seconds": self.busy_seconds,
+            "waiting_seconds": self.waiting_seconds,
+            "blocked_seconds": self.blocked_seconds,
+            f"{self.unit}_per_second": self.units / self.busy_seconds if self.busy_seconds else 0.0
+        }
+
+
+def _new_metrics() -> Dict[str, StageMetrics]:
+    return {"extract": StageMetrics("chars"), "chunk": StageMetrics("chunks"),
+            "embed": StageMetrics("chunks"), "index": StageMetrics("chunks")}
+
+
+_totals = {"documents": 0, "failed": 0, "chunks": 0, "duplicate_chunks": 0, "seconds": 0.0}
+_stage_totals = _new_metrics()
+
+
+def ingestion_stats() -> Dict[str, Any]:
+    """Documents ingested since startup and the time spent in each stage"""
+    return {**_totals, "stages": {name: metrics.report() for name, metrics in _stage_totals.items()}}
+
+
+class IngestionPipeline:
+    """
+    Streams one document into a DocumentStore
+    
+    The embed stage runs several workers so that provider round-trips
+    overlap; the index stage puts their batches back in chunk order before
+    appending them to the document.
+    """
+    
+    def __init__(self, store: DocumentStore, embedding_client, chunker: Optional[DocumentChunker] = None,
+                 batch_size: Optional[int] = None, queue_size: Optional[int] = None,
+                 embed_workers: Optional[int] = None, extract_workers: Optional[int] = None,
+                 deduplicate: Optional[bool] = None, dedup_threshold: Optional[float] = None):
+        self.store = store
+        self.embedding_client = embedding_client
+        self.chunker = chunker or DocumentChunker(chunk_size=500, chunk_overlap=50)
+        # Chunks per embedding call and index append
+        self.batch_size = batch_size or int(os.getenv("RAG_INGEST_BATCH_SIZE", "128"))
+        # Items each queue holds before the stage feeding it waits
+        self.queue_size = queue_size or int(os.getenv("RAG_INGEST_QUEUE_SIZE", "4"))
+        self.embed_workers = embed_workers or int(os.getenv("RAG_INGEST_EMBED_WORKERS", "2"))
+        # Files extracted at a time by ingest_many()
+        self.extract_workers = extract_workers or int(os.getenv("RAG_INGEST_EXTRACT_WORKERS", "4"))
+        # Skip chunks at least this similar (estimated Jaccard of word 3-grams) to a stored one
+        if deduplicate is None:
+            deduplicate = os.getenv("RAG_DEDUP", "false").lower() == "true"
+        self.deduplicate = deduplicate
+        self.dedup_threshold = dedup_threshold or float(os.getenv("RAG_DEDUP_THRESHOLD", "0.9"))
+    
+    def _deduplicator(self, session_id: str) -> Optional[Deduplicator]:
+        if not self.deduplicate:
+            return None
+        return Deduplicator(partial(self.store.find_near_duplicate, session_id), self.dedup_threshold)
+    
+    async def ingest(self, session_id: str, file_content: bytes, filename: str,
+                     metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Extract, chunk, embed and index a document
+        
+        Args:
+            session_id: Session to add the document to
+            file_content: File content as bytes, or a read-only memory map of it
+            filename: Original filename
+            metadata: Extra document fields (e.g. embedding_provider)
+        
+        Returns:
+            doc_id, chunk count, elapsed seconds, seconds until the first
+            chunks were searchable, per-stage metrics and, when
+            deduplicating, the share of chunks skipped as duplicates
+        
+        Raises:
+            ValueError: If no text or no chunks could be extracted
+        """
+        run = _Run(self, session_id, filename, metadata or {})
+        pieces = asyncio.Queue(self.queue_size)
+        batches = asyncio.Queue(self.queue_size)
+        embedded = asyncio.Queue(self.queue_size)
+        
+        tasks = [
+            asyncio.ensure_future(run.extract(file_content, pieces)),
+            asyncio.ensure_future(run.chunk(pieces, batches)),
+            *(asyncio.ensure_future(run.embed(batches, embedded)) for _ in range(self.embed_workers)),
+            asyncio.ensure_future(run.index(embedded))
+        ]
+        try:
+            await asyncio.gather(*tasks)
+            if run.document is None:
+                if not run.duplicates:
+                    raise ValueError("No text could be extracted from the document")
+                # Every chunk duplicates stored ones; the document is kept for its references
+                run.document = run.new_document(run.doc_id.result())
+            if run.deduplicator is not None:
+                # Duplicates of this document's own chunks were found before its id was known
+                run.document["duplicate_chunks"] = [
+                    {**reference, "doc_id": reference["doc_id"] or run.document["id"]}
+                    for reference in run.duplicates
+                ]
+            run.document["text"] = "".join(run.text)
+            self.store.commit_document(session_id, run.document)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if run.document is not None:
+                self.store.abort_document(session_id, run.document)
+            _totals["failed"] += 1
+            raise
+        
+        seconds = time.perf_counter() - run.started
+        _totals["documents"] += 1
+        _totals["chunks"] += len(run.document["chunks"])
+        _totals["duplicate_chunks"] += len(run.duplicates)
+        _totals["seconds"] += seconds
+        for name, metrics in run.metrics.items():
+            _stage_totals[name].add(metrics)
+        return {
+            "doc_id": run.document["id"],
+            "chunks": len(run.document["chunks"]),
+            "seconds": seconds,
+            "first_searchable_seconds": run.first_searchable_seconds,
+            "stages": {name: metrics.report() for name, metrics in run.metrics.items()},
+            "deduplication": run.deduplicator.report() if run.deduplicator is not None else None
+        }
+    
+    async def ingest_many(self, session_id: str, files: List[Tuple[str, bytes]],
+                          metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Extract, chunk, embed and index several documents together
+        
+        A file that cannot be extracted is reported and skipped; the others
+        are still added. The chunks of all files go to the embedding client
+        in one call, which packs them into as few provider requests as its
+        limits allow, and the documents are persisted with a single write.
+        
+        Args:
+            session_id: Session to add the documents to
+            files: (filename, file content) pairs
+            metadata: Extra fields for every document (e.g. embedding_provider)
+        
+        Returns:
+            Per-file results (doc_id and chunk count, or the error), counts of
+            documents added and failed, elapsed seconds, per-stage metrics
+            and, when deduplicating, the share of chunks skipped
+        """
+        started = time.perf_counter()
+        metrics = _new_metrics()
+        semaphore = asyncio.Semaphore(max(1, self.extract_workers))
+        
+        async def prepare(filename: str, file_content: bytes) -> Tuple[str, List[str]]:
+            async with semaphore:
+                extract_started = time.perf_counter()
+                text = await asyncio.to_thread(DocumentProcessor.extract_text_from_file, file_content, filename)
+                chunk_started = time.perf_counter()
+                chunks = await asyncio.to_thread(self.chunker.chunk_text, text)
+            metrics["extract"].busy_seconds += chunk_started - extract_started
+            metrics["chunk"].busy_seconds += time.perf_counter() - chunk_started
+            if not chunks:
+                raise ValueError("No text could be extracted from the document")
+            return text, chunks
+        
+        prepared = await asyncio.gather(*(prepare(filename, content) for filename, content in files),
+                                        return_exceptions=True)
+        
+        results: List[Dict[str, Any]] = []
+        documents: List[Dict[str, Any]] = []
+        all_chunks: List[str] = []
+        deduplicator = self._deduplicator(session_id)
+        # Stored versions of documents in this batch are about to be replaced, so are not matched
+        replaced = {DocumentProcessor.generate_document_id(filename, outcome[0])
+                    for (filename, _), outcome in zip(files, prepared) if not isinstance(outcome, BaseException)}
+        for (filename, _), outcome in zip(files, prepared):
+            if isinstance(outcome, BaseException):
+                if not isinstance(outcome, Exception):
+                    raise outcome
+                results.append({"filename": filename, "success": False, "error": str(outcome)})
+                continue
+            text, chunks = outcome
+            metrics["extract"].items += 1
+            metrics["extract"].units += len(text)
+            metrics["chunk"].items += 1
+            metrics["chunk"].units += len(chunks)
+            doc_id = DocumentProcessor.generate_document_id(filename, text)
+            document = {
+                "id": doc_id,
+                "filename": filename,
+                "text": text,
+                "chunks": chunks,
+                "embeddings": [],
+                "upload_time": datetime.now().isoformat(),
+                **(metadata or {})
+            }
+            if deduplicator is not None:
+                document["chunks"], document["duplicate_chunks"] = deduplicator.filter(
+                    doc_id, chunks, replaced.__contains__
+                )
+            documents.append(document)
+            results.append({"filename": filename, "success": True, "doc_id": doc_id,
+                            "chunks": len(document["chunks"])})
+            all_chunks.extend(document["chunks"])
+        
+        if all_chunks:
+            embed_started = time.perf_counter()
+            embeddings = await self.embedding_client.aembed_texts(all_chunks, as_numpy=True)
+            metrics["embed"].busy_seconds += time.perf_counter() - embed_started
+            metrics["embed"].items += 1
+            metrics["embed"].units += len(all_chunks)
+            
+            # Each document gets its own copy, so deleting one releases its rows
+            offset = 0
+            for document in documents:
+                document["embeddings"] = embeddings[offset:offset + len(document["chunks"])].copy()
+                offset += len(document["chunks"])
+        if documents:
+            index_started = time.perf_counter()
+            self.store.add_documents(session_id, documents)
+            metrics["index"].busy_seconds += time.perf_counter() - index_started
+            metrics["index"].items += 1
+            metrics["index"].units += len(all_chunks)
+        
+        seconds = time.perf_counter() - started
+        failed = len(files) - len(documents)
+        _totals["documents"] += len(documents)
+        _totals["failed"] += failed
+        _totals["chunks"] += len(all_chunks)
+        _totals["duplicate_chunks"] += deduplicator.duplicates if deduplicator is not None else 0
+        _totals["seconds"] += seconds
+        for name, stage in metrics.items():
+            _stage_totals[name].add(stage)
+        return {
+            "documents": results,
+            "added": len(documents),
+            "failed": failed,
+            "chunks": len(all_chunks),
+            "seconds": seconds,
+            "stages": {name: stage.report() for name, stage in metrics.items()},
+            "deduplication": deduplicator.report() if deduplicator is not None else None
+        }
+
+
+class _Run:
+    """State of one document going through the pipeline"""
+    
+    def __init__(self, pipeline: IngestionPipeline, session_id: str, filename: str, metadata: Dict[str, Any]):
+        self.pipeline = pipeline
+        self.session_id = session_id
+        self.filename = filename
+        self.metadata = metadata
+        self.metrics = _new_metrics()
+        self.started = time.perf_counter()
+        self.first_searchable_seconds: Optional[float] = None
+        self.text: List[str] = []
+        # The document id hashes the first 1000 characters, so it is known once they are extracted
+        self.doc_id = asyncio.get_running_loop().create_future()
+        self.document: Optional[Dict[str, Any]] = None
+        self.deduplicator = pipeline._deduplicator(session_id)
+        self.duplicates: List[Dict[str, Any]] = []  # References of the chunks skipped as duplicates
+    
+    async def _get(self, queue: asyncio.Queue, metrics: StageMetrics):
+        started = time.perf_counter()
+        item = await queue.get()
+        metrics.waiting_seconds += time.perf_counter() - started
+        return item
+    
+    async def _put(self, queue: asyncio.Queue, item, metrics: StageMetrics):
+        started = time.perf_counter()
+        await queue.put(item)
+        metrics.blocked_seconds += time.perf_counter() - started
+    
+    def _resolve_doc_id(self):
+        if not self.doc_id.done():
+            self.doc_id.set_result(DocumentProcessor.generate_document_id(self.filename, "".join(self.text)))
+    
+    async def extract(self, file_content: bytes, pieces: asyncio.Queue):
+        """Extract text pieces in a worker thread (PDF parsing is blocking)"""
+        metrics = self.metrics["extract"]
+        iterator = DocumentProcessor.iter_text(file_content, self.filename)
+        length = 0
+        while True:
+            started = time.perf_counter()
+            piece = await asyncio.to_thread(next, iterator, _DONE)
+            metrics.busy_seconds += time.perf_counter() - started
+            if piece is _DONE:
+                break
+            metrics.items += 1
+            metrics.units += len(piece)
+            self.text.append(piece)
+            length += len(piece)
+            if length >= 1000:
+                self._resolve_doc_id()
+            await self._put(pieces, piece, metrics)
+        self._resolve_doc_id()
+        await self._put(pieces, _DONE, metrics)
+    
+    async def chunk(self, pieces: asyncio.Queue, batches: asyncio.Queue):
+        """Chunk text as it arrives and pass on batches of chunks"""
+        metrics = self.metrics["chunk"]
+        stream = self.pipeline.chunker.stream()
+        batch_size = self.pipeline.batch_size
+        pending: List[str] = []
+        while True:
+            piece = await self._get(pieces, metrics)
+            started = time.perf_counter()
+            if piece is _DONE:
+                chunks = stream.close()
+            else:
+                metrics.items += 1
+                chunks = stream.feed(piece)
+            metrics.units += len(chunks)
+            if self.deduplicator is not None:
+                chunks, references = self.deduplicator.filter(None, chunks, self._may_be_replaced)
+                self.duplicates.extend(references)
+            pending.extend(chunks)
+            metrics.busy_seconds += time.perf_counter() - started
+            
+            while len(pending) >= batch_size or (piece is _DONE and pending):
+                await self._put(batches, pending[:batch_size], metrics)
+                pending = pending[batch_size:]
+            if piece is _DONE:
+                break
+        for _ in range(self.pipeline.embed_workers):
+            await self._put(batches, _DONE, metrics)
+    
+    def _may_be_replaced(self, doc_id: str) -> bool:
+        """Whether a stored document may be the version this upload replaces"""
+        if self.doc_id.done():
+            return doc_id == self.doc_id.result()
+        # Until the id is known, any document with the same filename might be
+        stored = self.pipeline.store.get_document(self.session_id, doc_id)
+        return stored is not None and stored["filename"] == self.filename
+    
+    async def embed(self, batches: asyncio.Queue, embedded: asyncio.Queue):
+        """Embed batches of chunks (several workers run this concurrently)"""
+        metrics = self.metrics["embed"]
+        while True:
+            batch = await self._get(batches, metrics)
+            if batch is _DONE:
+                break
+            # Batches are numbered as they are taken, so the index stage can restore their order
+            sequence = metrics.items
+            metrics.items += 1
+            started = time.perf_counter()
+            embeddings = await self.pipeline.embedding_client.aembed_texts(batch, as_numpy=True)
+            metrics.busy_seconds += time.perf_counter() - started
+            metrics.units += len(batch)
+            await self._put(embedded, (sequence, batch, embeddings), metrics)
+        await self._put(embedded, _DONE, metrics)
+    
+    async def index(self, embedded: asyncio.Queue):
+        """Append embedded batches to the document in chunk order"""
+        metrics = self.metrics["index"]
+        waiting: Dict[int, tuple] = {}
+        running = self.pipeline.embed_workers
+        while running:
+            item = await self._get(embedded, metrics)
+            if item is _DONE:
+                running -= 1
+                continue
+            waiting[item[0]] = item[1:]
+            while metrics.items in waiting:
+                chunks, embeddings = waiting.pop(metrics.items)
+                await self._append(chunks, embeddings, metrics)
+    
+    def new_document(self, doc_id: str) -> Dict[str, Any]:
+        """Empty document that batches of chunks are appended to"""
+        return {
+            "id": doc_id,
+            "filename": self.filename,
+            "text": "",
+            "chunks": [],
+            "embeddings": [],
+            "upload_time": datetime.now().isoformat(),
+            **self.metadata
+        }
+    
+    async def _append(self, chunks: List[str], embeddings, metrics: StageMetrics):
+        if self.document is None:
+            self.document = self.new_document(await self.doc_id)
+        started = time.perf_counter()
+        self.pipeline.store.append_chunks(self.session_id, self.document, chunks, embeddings)
+        metrics.busy_seconds += time.perf_counter() - started
+        metrics.items += 1
+        metrics.units += len(chunks)
+        if self.first_searchable_seconds is None:
+            self.first_searchable_seconds = time.perf_counter() - self.started
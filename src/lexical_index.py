@@ -0,0 +1,176 @@
+"""
+Lexical Index for RAG
+======================
+In-process inverted index over chunk tokens with BM25 scoring
+
+Complements embedding search: exact identifiers such as function names or
+config keys are matched literally, and lexical queries need no embedding
+call at all. Results can be combined with vector search through
+reciprocal rank fusion.
+"""
+
+import re
+import math
+import heapq
+from collections import Counter
+from typing import List, Tuple, Dict, Iterable, Sequence
+
+
+_WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+_SUBWORD_PATTERN = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into lowercase search terms
+    
+    Compound identifiers are kept whole and also split into their parts,
+    so "extract_text_from_file" and "chunkSize" match both exactly and
+    by their individual words.
+    """
+    tokens = []
+    for word in _WORD_PATTERN.findall(text):
+        lowered = word.lower()
+        tokens.append(lowered)
+        if "_" in word or (not word.islower() and not word.isupper()):
+            parts = _SUBWORD_PATTERN.findall(word)
+            if len(parts) > 1:
+                tokens.extend(part.lower() for part in parts)
+    return tokens
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index for one session
+    
+    Postings map each term to the chunks containing it and the term
+    frequency. Chunks get increasing integer ids, so ties in score are
+    broken by insertion order, like the vector index.
+    """
+    
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[int, int]] = {}  # {term: {chunk_id: term frequency}}
+        self.chunk_lengths: Dict[int, int] = {}
+        self.chunk_keys: Dict[int, Tuple[str, int]] = {}  # {chunk_id: (doc_id, chunk_index)}
+        self.doc_chunks: Dict[str, List[int]] = {}
+        self.total_length = 0
+        self.next_id = 0
+    
+    def __len__(self) -> int:
+        return len(self.chunk_lengths)
+    
+    def add(self, doc_id: str, chunks: Sequence[str]):
+        """Index the chunks of a document (replacing any previous version)"""
+        self.remove(doc_id)
+        self.extend(doc_id, chunks)
+    
+    def extend(self, doc_id: str, chunks: Sequence[str]):
+        """Index more chunks of a document, numbered after the ones already indexed"""
+        chunk_ids = self.doc_chunks.setdefault(doc_id, [])
+        for chunk_index, chunk in enumerate(chunks, len(chunk_ids)):
+            chunk_id = self.next_id
+            self.next_id += 1
+            terms = Counter(tokenize(chunk))
+            for term, frequency in terms.items():
+                self.postings.setdefault(term, {})[chunk_id] = frequency
+            
+            length = sum(terms.values())
+            self.chunk_lengths[chunk_id] = length
+            self.chunk_keys[chunk_id] = (doc_id, chunk_index)
+            self.total_length += length
+            chunk_ids.append(chunk_id)
+    
+    def remove(self, doc_id: str, chunks: Sequence[str] = None) -> int:
+        """
+        Remove every chunk of a document
+        
+        Args:
+            doc_id: Document to remove
+            chunks: The document's chunk texts; re-tokenizing them avoids
+                scanning every posting list
+        
+        Returns:
+            Number of chunks removed
+        """
+        chunk_ids = self.doc_chunks.pop(doc_id, [])
+        if not chunk_ids:
+            return 0
+        
+        removed = set(chunk_ids)
+        if chunks is not None and len(chunks) == len(chunk_ids):
+            terms: Iterable[str] = {term for chunk in chunks for term in tokenize(chunk)}
+        else:
+            terms = list(self.postings)
+        
+        for term in terms:
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            for chunk_id in removed.intersection(postings):
+                del postings[chunk_id]
+            if not postings:
+                del self.postings[term]
+        
+        for chunk_id in chunk_ids:
+            self.total_length -= self.chunk_lengths.pop(chunk_id)
+            del self.chunk_keys[chunk_id]
+        return len(chunk_ids)
+    
+    def search(self, query: str, top_k: int = 3) -> List[Tuple[str, int, float]]:
+        """
+        Rank chunks against a query with Okapi BM25
+        
+        Args:
+            query: Query text
+            top_k: Number of top results to return
+        
+        Returns:
+            List of (doc_id, chunk_index, score), best first
+        """
+        if not self.chunk_lengths or top_k <= 0:
+            return []
+        
+        chunk_count = len(self.chunk_lengths)
+        average_length = self.total_length / chunk_count or 1.0
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            
+            idf = math.log(1 + (chunk_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, frequency in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.chunk_lengths[chunk_id] / average_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        
+        best = heapq.nsmallest(top_k, scores.items(), key=lambda item: (-item[1], item[0]))
+        return [(*self.chunk_keys[chunk_id], score) for chunk_id, score in best]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Tuple[str, int, float]]], top_k: int = 3,
+                           k: int = 60) -> List[Tuple[str, int, float]]:
+    """
+    Merge ranked result lists with reciprocal rank fusion
+    
+    Each chunk scores sum(1 / (k + rank)) over the lists it appears in, so
+    lists on different score scales (cosine, BM25) can be combined.
+    
+    Args:
+        rankings: Result lists of (doc_id, chunk_index, score), best first
+        top_k: Number of fused results to return
+        k: Damping constant; larger values flatten the rank weighting
+    
+    Returns:
+        List of (doc_id, chunk_index, fused_score), best first
+    """
+    fused: Dict[Tuple[str, int], float] = {}
+    for ranking in rankings:
+        for rank, (doc_id, chunk_index, _) in enumerate(ranking, start=1):
+            key = (doc_id, chunk_index)
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank)
+    
+    # sorted() is stable, so ties keep the order of first appearance
+    ordered = sorted(fused.items(), key=lambda item: -item[1])[:top_k]
+    return [(doc_id, chunk_index, score) for (doc_id, chunk_index), score in ordered]
@@ -0,0 +1,145 @@
+"""
+Local Embedding Models
+=======================
+Process-wide registry of loaded self-hosted embedding models
+
+Loading a SentenceTransformer reads hundreds of megabytes of weights, so
+models are loaded once per process and shared by every EmbeddingClient.
+The number of resident models is capped with LRU eviction.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+
+ONNX_PREFIX = "onnx:"
+
+
+def load_sentence_transformer(model_id: str) -> Any:
+    """Default loader for the huggingface provider"""
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        raise ImportError("sentence-transformers not installed. Install with: pip install sentence-transformers")
+    return SentenceTransformer(model_id)
+
+
+def load_local_model(model_id: str) -> Any:
+    """Load a SentenceTransformer, or an ONNX Runtime model for "onnx:<model id>" keys"""
+    if model_id.startswith(ONNX_PREFIX):
+        from onnx_embeddings import load_onnx_model
+        return load_onnx_model(model_id[len(ONNX_PREFIX):])
+    return load_sentence_transformer(model_id)
+
+
+def model_memory_bytes(model: Any) -> Optional[int]:
+    """Size of a model's weights, if it exposes torch parameters or reports its own size"""
+    memory_bytes = getattr(model, "memory_bytes", None)
+    if memory_bytes is not None:
+        return memory_bytes
+    try:
+        return sum(p.numel() * p.element_size() for p in model.parameters())
+    except Exception:
+        return None
+
+
+class LocalModelRegistry:
+    """
+    Loaded local models keyed by model id
+    
+    Concurrent requests for a model that is still loading wait for the
+    single load in progress instead of loading it again.
+    """
+    
+    def __init__(self, max_models: Optional[int] = None,
+                 loader: Callable[[str], Any] = load_local_model):
+        self.max_models = max_models or int(os.getenv("RAG_LOCAL_MODEL_CACHE", "2"))
+        self.loader = loader
+        self._models: "OrderedDict[str, Any]" = OrderedDict()
+        self._info: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._loading: Dict[str, threading.Lock] = {}
+        self.evictions = 0
+    
+    def get(self, model_id: str, warmup: bool = False) -> Any:
+        """
+        Get a loaded model, loading it on first use
+        
+        Args:
+            model_id: Model identifier understood by the loader
+            warmup: Run one inference after loading, so the first real
+                request does not pay for lazy initialization
+        
+        Returns:
+            The loaded model
+        """
+        with self._lock:
+            model = self._models.get(model_id)
+            if model is not None:
+                self._models.move_to_end(model_id)
+                self._info[model_id]["uses"] += 1
+                return model
+            load_lock = self._loading.setdefault(model_id, threading.Lock())
+        
+        with load_lock:
+            with self._lock:
+                # Another thread may have finished loading while we waited
+                model = self._models.get(model_id)
+                if model is not None:
+                    self._models.move_to_end(model_id)
+                    self._info[model_id]["uses"] += 1
+                    return model
+            
+            started = time.perf_counter()
+            model = self.loader(model_id)
+            info = {
+                "load_seconds": time.perf_counter() - started,
+                "warmup_seconds": None,
+                "memory_bytes": model_memory_bytes(model),
+                "uses": 1
+            }
+            if warmup:
+                started = time.perf_counter()
+                model.encode(["warmup"])
+                info["warmup_seconds"] = time.perf_counter() - started
+            
+            with self._lock:
+                self._models[model_id] = model
+                self._info[model_id] = info
+                self._loading.pop(model_id, None)
+                while len(self._models) > self.max_models:
+                    evicted, _ = self._models.popitem(last=False)
+                    self._info.pop(evicted, None)
+                    self.evictions += 1
+            return model
+    
+    def preload(self, model_ids: List[str], warmup: bool = True):
+        """Load (and optionally warm up) models ahead of the first request"""
+        for model_id in model_ids:
+            try:
+                self.get(model_id, warmup=warmup)
+                print(f"Preloaded local embedding model {model_id}")
+            except Exception as e:
+                print(f"Error preloading local embedding model {model_id}: {e}")
+    
+    def unload(self, model_id: str) -> bool:
+        """Drop a model from memory"""
+        with self._lock:
+            self._info.pop(model_id, None)
+            return self._models.pop(model_id, None) is not None
+    
+    def stats(self) -> Dict[str, Any]:
+        """Resident models with their load time, warmup time, memory and use count"""
+        with self._lock:
+            return {
+                "max_models": self.max_models,
+                "evictions": self.evictions,
+                "models": {model_id: dict(self._info[model_id]) for model_id in self._models}
+            }
+
+
+# Global registry shared by all EmbeddingClient instances
+model_registry = LocalModelRegistry()
@@ -0,0 +1,210 @@
+"""
+Near-Duplicate Chunk Detection
+===============================
+MinHash signatures and a banded LSH index over chunk text
+
+Uploaded corpora repeat a lot of boilerplate: page headers, license
+blocks, templated sections. A chunk's MinHash signature estimates the
+Jaccard similarity of its word 3-gram set with any other chunk's, and
+locality-sensitive hashing of signature bands finds the chunks likely to
+be similar without comparing against every chunk in the session.
+Candidates are then checked against the similarity threshold.
+"""
+
+import re
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+import numpy as np
+
+
+NUM_PERMUTATIONS = 64
+BANDS = 8  # 8 bands of 8 rows: chunks at 0.9 similarity share a band 99% of the time
+SHINGLE_WORDS = 3
+
+_PRIME = np.uint64(4294967311)  # Smallest prime above 2^32
+_rng = np.random.default_rng(0x5EED)
+_A = _rng.integers(1, 2 ** 32, NUM_PERMUTATIONS, dtype=np.uint64)
+_B = _rng.integers(0, 2 ** 32, NUM_PERMUTATIONS, dtype=np.uint64)
+_WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+ChunkKey = Tuple[Optional[str], int]  # (doc_id, chunk_index)
+
+
+def minhash_signature(text: str) -> Optional[np.ndarray]:
+    """
+    MinHash signature of the word 3-grams of a text
+    
+    Case and punctuation are ignored, so chunks differing only in those
+    have identical signatures.
+    
+    Returns:
+        NUM_PERMUTATIONS uint64 minima, or None for text without words
+    """
+    words = _WORD_PATTERN.findall(text.lower())
+    if not words:
+        return None
+    count = max(1, len(words) - SHINGLE_WORDS + 1)
+    shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(count)}
+    # hash() of str is salted per process, which is fine: signatures are never persisted
+    hashes = np.fromiter((hash(shingle) & 0xFFFFFFFF for shingle in shingles), dtype=np.uint64,
+                         count=len(shingles))
+    return ((hashes[:, None] * _A + _B) % _PRIME).min(axis=0)
+
+
+def similarity(first: np.ndarray, second: np.ndarray) -> float:
+    """Estimated Jaccard similarity of the texts behind two signatures"""
+    return float(np.count_nonzero(first == second)) / NUM_PERMUTATIONS
+
+
+class NearDuplicateIndex:
+    """
+    LSH index of chunk signatures for one session
+    
+    Each signature is split into BANDS bands; chunks sharing any band
+    are candidates and are compared on the full signature. Chunks are
+    keyed by (doc_id, chunk_index), like the lexical index.
+    """
+    
+    def __init__(self):
+        self.signatures: Dict[ChunkKey, np.ndarray] = {}
+        self.buckets: Dict[Tuple[int, bytes], Set[ChunkKey]] = {}
+        self.doc_chunks: Dict[Optional[str], int] = {}  # Chunks indexed per document
+    
+    def __len__(self) -> int:
+        return len(self.signatures)
+    
+    @staticmethod
+    def _bands(signature: np.ndarray) -> Iterable[Tuple[int, bytes]]:
+        rows = NUM_PERMUTATIONS // BANDS
+        return ((band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(BANDS))
+    
+    def add(self, doc_id: str, chunks: Iterable[str]):
+        """Index the chunks of a document, replacing any previous version"""
+        self.remove(doc_id)
+        self.extend(doc_id, chunks)
+    
+    def extend(self, doc_id: str, chunks: Iterable[str]):
+        """Index more chunks of a document, numbered after those already indexed"""
+        for chunk in chunks:
+            self.add_signature(doc_id, minhash_signature(chunk))
+    
+    def add_signature(self, doc_id: Optional[str], signature: Optional[np.ndarray]) -> int:
+        """
+        Index the next chunk of a document by its signature
+        
+        Returns:
+            The chunk's index within the document
+        """
+        chunk_index = self.doc_chunks.get(doc_id, 0)
+        self.doc_chunks[doc_id] = chunk_index + 1
+        if signature is not None:
+            key = (doc_id, chunk_index)
+            self.signatures[key] = signature
+            for band in self._bands(signature):
+                self.buckets.setdefault(band, set()).add(key)
+        return chunk_index
+    
+    def remove(self, doc_id: Optional[str]):
+        """Drop every chunk of a document"""
+        for chunk_index in range(self.doc_chunks.pop(doc_id, 0)):
+            signature = self.signatures.pop((doc_id, chunk_index), None)
+            if signature is None:
+                continue
+            for band in self._bands(signature):
+                bucket = self.buckets.get(band)
+                if bucket is not None:
+                    bucket.discard((doc_id, chunk_index))
+                    if not bucket:
+                        del self.buckets[band]
+    
+    def query(self, signature: Optional[np.ndarray], threshold: float,
+              exclude: Optional[Callable[[Optional[str]], bool]] = None) -> Optional[ChunkKey]:
+        """
+        Find an indexed chunk at least threshold similar to a signature
+        
+        Args:
+            signature: Signature of the new chunk
+            threshold: Minimum estimated Jaccard similarity (0-1)
+            exclude: Documents to ignore, e.g. the version being replaced
+        
+        Returns:
+            (doc_id, chunk_index) of the most similar such chunk, or None
+        """
+        if signature is None:
+            return None
+        candidates = set()
+        for band in self._bands(signature):
+            candidates.update(self.buckets.get(band, ()))
+        
+        best, best_similarity = None, threshold
+        for key in candidates:
+            if exclude is not None and exclude(key[0]):
+                continue
+            score = similarity(signature, self.signatures[key])
+            # Ties go to the earliest chunk, so references do not depend on set order
+            if score > best_similarity or (score == best_similarity and (best is None or key < best)):
+                best, best_similarity = key, score
+        return best
+
+
+class Deduplicator:
+    """
+    Filters the chunks of one upload against its session and itself
+    
+    Kept chunks are indexed locally, so later chunks of the same upload
+    (including other files of a batch) are checked against them too.
+    Suppressed chunks become references to the chunk they duplicate.
+    """
+    
+    def __init__(self, session_lookup: Callable[..., Optional[ChunkKey]], threshold: float):
+        """
+        Args:
+            session_lookup: lookup(signature, threshold, exclude) over the
+                session's stored chunks
+            threshold: Minimum estimated Jaccard similarity of a duplicate
+        """
+        self.session_lookup = session_lookup
+        self.threshold = threshold
+        self.local = NearDuplicateIndex()
+        self.positions: Dict[Optional[str], int] = {}  # Chunks seen per document
+        self.chunks = 0
+        self.duplicates = 0
+    
+    def filter(self, doc_id: Optional[str], chunks: List[str],
+               exclude: Optional[Callable[[Optional[str]], bool]] = None) -> Tuple[List[str], List[Dict]]:
+        """
+        Split a document's next chunks into new ones and duplicates
+        
+        Args:
+            doc_id: Document in this upload (None while not yet known)
+            chunks: Next chunks of the document, in order
+            exclude: Stored documents not to match, e.g. the version this
+                document replaces
+        
+        Returns:
+            (chunks to keep, one reference per duplicate: {"chunk": position
+            among all of the document's chunks, "doc_id", "chunk_index"})
+        """
+        kept: List[str] = []
+        references: List[Dict] = []
+        for chunk in chunks:
+            position = self.positions.get(doc_id, 0)
+            self.positions[doc_id] = position + 1
+            self.chunks += 1
+            signature = minhash_signature(chunk)
+            match = self.local.query(signature, self.threshold) or self.session_lookup(
+                signature, self.threshold, exclude
+            )
+            if match is None:
+                self.local.add_signature(doc_id, signature)
+                kept.append(chunk)
+            else:
+                self.duplicates += 1
+                references.append({"chunk": position, "doc_id": match[0], "chunk_index": match[1]})
+        return kept, references
+    
+    def report(self) -> Dict[str, float]:
+        return {
+            "chunks": self.chunks,
+            "duplicates": self.duplicates,
+            "ratio": self.duplicates / self.chunks if self.chunks else 0.0
+        }
@@ -0,0 +1,263 @@
+"""
+ONNX Runtime Embeddings
+========================
+CPU-optimized alternative to PyTorch SentenceTransformer inference for the
+self-hosted embedding models
+
+Models are exported to ONNX once (optionally int8-quantized with dynamic
+quantization) and cached on disk, then run with ONNX Runtime. Pooling and
+normalization follow each model's sentence-transformers configuration, so
+embeddings match the PyTorch path closely (see parity_check).
+
+Requires: pip install onnxruntime transformers torch
+"""
+
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import numpy as np
+
+
+# Pooling used by the sentence-transformers configuration of each model
+MODEL_POOLING = {
+    "sentence-transformers/all-MiniLM-L6-v2": "mean",
+    "sentence-transformers/all-mpnet-base-v2": "mean",
+    "BAAI/bge-small-en-v1.5": "cls",
+    "BAAI/bge-base-en-v1.5": "cls",
+}
+
+# Maximum sequence length used by sentence-transformers for each model
+MODEL_MAX_LENGTH = {
+    "sentence-transformers/all-MiniLM-L6-v2": 256,
+    "sentence-transformers/all-mpnet-base-v2": 384,
+    "BAAI/bge-small-en-v1.5": 512,
+    "BAAI/bge-base-en-v1.5": 512,
+}
+
+INT8_SUFFIX = ":int8"
+
+
+def parse_model_id(model_id: str):
+    """
+    Split an ONNX model id into (Hugging Face model id, quantize)
+    
+    "BAAI/bge-small-en-v1.5:int8" selects the int8-quantized export.
+    """
+    if model_id.endswith(INT8_SUFFIX):
+        return model_id[:-len(INT8_SUFFIX)], True
+    return model_id, False
+
+
+def pool_embeddings(hidden: np.ndarray, attention_mask: np.ndarray, pooling: str = "mean") -> np.ndarray:
+    """
+    Pool token embeddings into unit-length sentence embeddings
+    
+    Args:
+        hidden: Token embeddings (batch, sequence, dimensions)
+        attention_mask: 1 for real tokens, 0 for padding (batch, sequence)
+        pooling: "mean" over real tokens or "cls" (first token)
+    
+    Returns:
+        float32 matrix (batch, dimensions) with L2-normalized rows
+    """
+    if pooling == "cls":
+        pooled = hidden[:, 0].astype(np.float32)
+    else:
+        mask = attention_mask[..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        pooled = pooled.astype(np.float32)
+    
+    norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+    return pooled / np.clip(norms, 1e-12, None)
+
+
+def onnx_cache_dir() -> Path:
+    return Path(os.getenv("RAG_ONNX_CACHE", Path.home() / ".cache" / "dualmind" / "onnx"))
+
+
+def export_model(model_id: str, quantize: bool = False, cache_dir: Optional[Path] = None) -> Path:
+    """
+    Export a Hugging Face encoder to ONNX (and int8) unless already cached
+    
+    Args:
+        model_id: Hugging Face model id
+        quantize: Also write a dynamically int8-quantized copy
+        cache_dir: Export directory root (default RAG_ONNX_CACHE)
+    
+    Returns:
+        Path of the .onnx file to load
+    """
+    model_dir = (cache_dir or onnx_cache_dir()) / model_id.replace("/", "__")
+    fp32_path = model_dir / "model.onnx"
+    int8_path = model_dir / "model.int8.onnx"
+    
+    if not fp32_path.exists():
+        try:
+            import torch
+            from transformers import AutoModel, AutoTokenizer
+        except ImportError:
+            raise ImportError("ONNX export needs torch and transformers. Install with: pip install torch transformers")
+        
+        model_dir.mkdir(parents=True, exist_ok=True)
+        tokenizer = AutoTokenizer.from_pretrained(model_id)
+        model = AutoModel.from_pretrained(model_id)
+        model.eval()
+        
+        sample = tokenizer(["export sample"], return_tensors="pt")
+        input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+        dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+        
+        tmp_path = model_dir / "model.onnx.tmp"
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                ({name: sample[name] for name in input_names},),
+                str(tmp_path),
+                input_names=input_names,
+                output_names=["last_hidden_state"],
+                dynamic_axes=dynamic_axes,
+                opset_version=14
+            )
+        os.replace(tmp_path, fp32_path)
+    
+    if not quantize:
+        return fp32_path
+    
+    if not int8_path.exists():
+        try:
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+        except ImportError:
+            raise ImportError("onnxruntime not installed. Install with: pip install onnxruntime")
+        
+        tmp_path = model_dir / "model.int8.onnx.tmp"
+        quantize_dynamic(str(fp32_path), str(tmp_path), weight_type=QuantType.QInt8)
+        os.replace(tmp_path, int8_path)
+    return int8_path
+
+
+class OnnxEmbeddingModel:
+    """
+    Sentence embedding model served by ONNX Runtime
+    
+    Provides the encode() call used for SentenceTransformer models, so it
+    can be held by the local model registry and used by EmbeddingClient
+    unchanged.
+    """
+    
+    def __init__(self, model_id: str, threads: Optional[int] = None, cache_dir: Optional[Path] = None):
+        try:
+            import onnxruntime as ort
+            from transformers import AutoTokenizer
+        except ImportError:
+            raise ImportError("ONNX embeddings need onnxruntime and transformers. "
+                              "Install with: pip install onnxruntime transformers")
+        
+        self.model_id = model_id
+        self.hf_model_id, self.quantized = parse_model_id(model_id)
+        self.pooling = MODEL_POOLING.get(self.hf_model_id, "mean")
+        self.max_length = MODEL_MAX_LENGTH.get(self.hf_model_id, 512)
+        self.tokenizer = AutoTokenizer.from_pretrained(self.hf_model_id)
+        self.path = export_model(self.hf_model_id, quantize=self.quantized, cache_dir=cache_dir)
+        
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads or int(os.getenv("RAG_ONNX_THREADS", str(os.cpu_count() or 1)))
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(str(self.path), options, providers=["CPUExecutionProvider"])
+        self.input_names = [node.name for node in self.session.get_inputs()]
+    
+    @property
+    def memory_bytes(self) -> int:
+        """Size of the loaded ONNX weights"""
+        return self.path.stat().st_size
+    
+    def encode(self, texts: List[str], batch_size: int = 32, convert_to_numpy: bool = True,
+               **kwargs) -> np.ndarray:
+        """
+        Embed texts
+        
+        Returns:
+            float32 matrix with one L2-normalized row per text
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        
+        # Sorting by length keeps padding (wasted compute) small within a batch
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        embeddings = None
+        for start in range(0, len(texts), batch_size):
+            rows = order[start:start + batch_size]
+            encoded = self.tokenizer(
+                [texts[i] for i in rows], padding=True, truncation=True,
+                max_length=self.max_length, return_tensors="np"
+            )
+            feeds = {name: encoded[name].astype(np.int64) for name in self.input_names if name in encoded}
+            if "token_type_ids" in self.input_names and "token_type_ids" not in feeds:
+                feeds["token_type_ids"] = np.zeros_like(feeds["input_ids"])
+            
+            hidden = self.session.run(None, feeds)[0]
+            pooled = pool_embeddings(hidden, encoded["attention_mask"], self.pooling)
+            if embeddings is None:
+                embeddings = np.empty((len(texts), pooled.shape[1]), dtype=np.float32)
+            embeddings[rows] = pooled
+        return embeddings
+
+
+def load_onnx_model(model_id: str) -> OnnxEmbeddingModel:
+    """Loader for the local model registry"""
+    return OnnxEmbeddingModel(model_id)
+
+
+def parity_check(model_id: str, texts: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Compare ONNX Runtime embeddings against the PyTorch SentenceTransformer path
+    
+    Args:
+        model_id: ONNX model id (append ":int8" to check the quantized export)
+        texts: Sample texts (a small built-in set by default)
+    
+    Returns:
+        Cosine agreement between the two paths and their encode times
+    """
+    from sentence_transformers import SentenceTransformer
+    
+    texts = texts or [
+        "Retrieval augmented generation answers questions from uploaded documents.",
+        "def extract_text_from_file(content, filename): ...",
+        "The quarterly report shows revenue growth in every region.",
+        "short",
+        "Embeddings map text to vectors so similar meanings are close together. " * 8,
+    ]
+    hf_model_id, _ = parse_model_id(model_id)
+    
+    reference_model = SentenceTransformer(hf_model_id)
+    started = time.perf_counter()
+    reference = reference_model.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+    torch_seconds = time.perf_counter() - started
+    
+    onnx_model = OnnxEmbeddingModel(model_id)
+    started = time.perf_counter()
+    candidate = onnx_model.encode(texts)
+    onnx_seconds = time.perf_counter() - started
+    
+    cosines = np.sum(reference * candidate, axis=1)
+    return {
+        "model": model_id,
+        "texts": len(texts),
+        "min_cosine": float(cosines.min()),
+        "mean_cosine": float(cosines.mean()),
+        "max_abs_diff": float(np.abs(reference - candidate).max()),
+        "torch_seconds": torch_seconds,
+        "onnx_seconds": onnx_seconds,
+        "speedup": torch_seconds / onnx_seconds if onnx_seconds else None
+    }
+
+
+if __name__ == "__main__":
+    import sys
+    import json
+    
+    for model in sys.argv[1:] or ["sentence-transformers/all-MiniLM-L6-v2",
+                                  "sentence-transformers/all-MiniLM-L6-v2:int8"]:
+        print(json.dumps(parity_check(model), indent=2))
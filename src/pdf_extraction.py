@@ -0,0 +1,239 @@
+"""
+Parallel PDF Extraction
+========================
+Page-range text extraction across a process pool
+
+PyPDF2 is pure Python, so a long PDF keeps one core busy for a long time.
+The extractor splits a document into page ranges, extracts them in worker
+processes and yields page text in page order as soon as each range is
+done: extraction scales with cores and never holds the GIL of the server
+process. Small documents are extracted in-process straight from memory,
+where a pool would cost more than it saves; only documents split across
+workers need a file, and a source already backed by one is not copied.
+
+Each document has a CPU budget (summed over its page ranges, and also
+enforced inside each worker with a profiling timer where the platform has
+one) and a wall-clock budget; exceeding either cancels its remaining pages.
+"""
+
+import io
+import os
+import time
+import signal
+import tempfile
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+
+class ExtractionBudgetExceeded(ValueError):
+    """A document used more CPU or wall-clock time than its extraction budget"""
+
+
+def page_ranges(page_count: int, pages_per_task: int) -> List[Tuple[int, int]]:
+    """Consecutive [start, end) page ranges of at most pages_per_task pages"""
+    return [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+
+
+_timer_fired = False  # Set in a worker when its CPU timer expires
+
+
+def _cpu_budget_exceeded(signum, frame):
+    global _timer_fired
+    _timer_fired = True
+    raise ExtractionBudgetExceeded("PDF extraction exceeded its CPU budget")
+
+
+def _extract_page_range(path: str, start: int, end: int, cpu_limit: Optional[float] = None) -> Tuple[List[str], float]:
+    """
+    Extract the text of pages [start, end) (runs in a worker process)
+    
+    Args:
+        path: PDF file
+        start: First page
+        end: Page after the last one
+        cpu_limit: CPU seconds after which the worker abandons the range
+    
+    Returns:
+        (text of each page, CPU seconds spent)
+    """
+    global _timer_fired
+    from PyPDF2 import PdfReader
+    
+    started = time.process_time()
+    timed = cpu_limit is not None and hasattr(signal, "setitimer")
+    if timed:
+        _timer_fired = False
+        previous = signal.signal(signal.SIGPROF, _cpu_budget_exceeded)
+        signal.setitimer(signal.ITIMER_PROF, max(cpu_limit, 0.001))
+    try:
+        reader = PdfReader(path)
+        texts = [reader.pages[page].extract_text() for page in range(start, end)]
+    except Exception:
+        # PyPDF2 may catch the timer's exception and raise one of its own instead
+        if _timer_fired:
+            raise ExtractionBudgetExceeded("PDF extraction exceeded its CPU budget") from None
+        raise
+    finally:
+        if timed:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, previous)
+    return texts, time.process_time() - started
+
+
+class PdfExtractor:
+    """
+    Streams the page text of PDFs, extracting page ranges in parallel
+    
+    The process pool is shared by all documents and started on first use.
+    At most two ranges per worker are in flight for a document, so pages
+    waiting to be consumed stay bounded however long the PDF is.
+    """
+    
+    def __init__(self, max_workers: Optional[int] = None, pages_per_task: Optional[int] = None,
+                 cpu_seconds: Optional[float] = None, timeout: Optional[float] = None):
+        self.max_workers = max_workers or int(os.getenv("RAG_PDF_WORKERS", str(os.cpu_count() or 1)))
+        self.pages_per_task = pages_per_task or int(os.getenv("RAG_PDF_PAGES_PER_TASK", "8"))
+        # Per-document budgets; 0 disables a budget
+        self.cpu_seconds = cpu_seconds if cpu_seconds is not None else float(
+            os.getenv("RAG_PDF_CPU_SECONDS", "600")
+        )
+        self.timeout = timeout if timeout is not None else float(os.getenv("RAG_PDF_TIMEOUT", "300"))
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.counters = {"documents": 0, "parallel_documents": 0, "pages": 0, "cpu_seconds": 0.0,
+                         "budget_exceeded": 0}
+    
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # Spawned workers do not inherit the server's threads and sockets
+                self._pool = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+    
+    def shutdown(self):
+        """Stop the worker processes (they are restarted on next use)"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    
+    def iter_pages(self, source: Union[bytes, str, Path, Any]) -> Iterator[str]:
+        """
+        Text of each page in order, as soon as it and all earlier pages are extracted
+        
+        Args:
+            source: PDF content (bytes, or a memory map, optionally with the
+                path of its file as a path attribute), or the path of a PDF file
+        
+        Raises:
+            ExtractionBudgetExceeded: If the document runs over its CPU or time budget
+        """
+        from PyPDF2 import PdfReader
+        
+        path = str(source) if isinstance(source, (str, Path)) else getattr(source, "path", None)
+        if path is None:
+            # A memory map is already a seekable file
+            stream = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+            stream.seek(0)
+        reader = PdfReader(path if path is not None else stream)
+        ranges = page_ranges(len(reader.pages), self.pages_per_task)
+        self.counters["documents"] += 1
+        budget = _Budget(self.cpu_seconds, self.timeout)
+        try:
+            if self.max_workers <= 1 or len(ranges) <= 1:
+                # The document is parsed once, by the reader that counted its pages
+                for start, end in ranges:
+                    started = time.thread_time()
+                    texts = [reader.pages[page].extract_text() for page in range(start, end)]
+                    budget.charge(time.thread_time() - started)
+                    self._count(texts, 0.0)
+                    yield from texts
+            else:
+                self.counters["parallel_documents"] += 1
+                if path is not None:
+                    yield from self._iter_parallel(path, ranges, budget)
+                else:
+                    yield from self._iter_copy(source, ranges, budget)
+        except ExtractionBudgetExceeded:
+            self.counters["budget_exceeded"] += 1
+            raise
+    
+    def _iter_copy(self, content: Any, ranges: List[Tuple[int, int]], budget: "_Budget") -> Iterator[str]:
+        """Extract in parallel from a temporary copy of in-memory content"""
+        # Workers read the document from disk instead of each receiving a pickled copy
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+            f.write(content)
+        try:
+            yield from self._iter_parallel(f.name, ranges, budget)
+        finally:
+            os.unlink(f.name)
+    
+    def _iter_parallel(self, path: str, ranges: List[Tuple[int, int]], budget: "_Budget") -> Iterator[str]:
+        pool = self._get_pool()
+        pending = deque()  # Futures in page order
+        queued = iter(ranges)
+        try:
+            while True:
+                while len(pending) < 2 * self.max_workers:
+                    page_range = next(queued, None)
+                    if page_range is None:
+                        break
+                    pending.append(pool.submit(_extract_page_range, path, *page_range, budget.cpu_left()))
+                if not pending:
+                    return
+                
+                try:
+                    texts, cpu = pending.popleft().result(timeout=budget.time_left())
+                except FutureTimeoutError:
+                    raise ExtractionBudgetExceeded(f"PDF extraction exceeded its {budget.timeout:g}s time budget")
+                except BrokenProcessPool:
+                    # A worker died (e.g. out of memory); start a fresh pool next time
+                    with self._lock:
+                        if self._pool is pool:
+                            self._pool = None
+                    raise
+                budget.charge(cpu)
+                self._count(texts, cpu)
+                yield from texts
+        finally:
+            for future in pending:
+                future.cancel()
+    
+    def _count(self, texts: List[str], cpu: float):
+        self.counters["pages"] += len(texts)
+        self.counters["cpu_seconds"] += cpu
+    
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, "workers": self.max_workers, "pool_running": self._pool is not None}
+
+
+class _Budget:
+    """CPU and wall-clock allowance of one document"""
+    
+    def __init__(self, cpu_seconds: float, timeout: float):
+        self.cpu_seconds = cpu_seconds
+        self.timeout = timeout
+        self.cpu_used = 0.0
+        self.deadline = time.monotonic() + timeout if timeout else None
+    
+    def charge(self, cpu: float):
+        self.cpu_used += cpu
+        if self.cpu_seconds and self.cpu_used > self.cpu_seconds:
+            raise ExtractionBudgetExceeded(f"PDF extraction exceeded its {self.cpu_seconds:g}s CPU budget")
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise ExtractionBudgetExceeded(f"PDF extraction exceeded its {self.timeout:g}s time budget")
+    
+    def cpu_left(self) -> Optional[float]:
+        return max(0.0, self.cpu_seconds - self.cpu_used) if self.cpu_seconds else None
+    
+    def time_left(self) -> Optional[float]:
+        return max(0.0, self.deadline - time.monotonic()) if self.deadline is not None else None
+
+
+# Global extractor shared by all uploads
+pdf_extractor = PdfExtractor()
@@ -0,0 +1,233 @@
+"""
+Provider Rate Limiting
+=======================
+Token-bucket pacing and retry with backoff for embedding provider calls
+
+Each (provider, API key) pair gets one limiter with a request bucket and a
+token bucket, shared by every client and thread using that key. Callers
+reserve capacity before a request and wait if the buckets are in debt, so
+sustained throughput converges on the configured rate instead of bursting
+into 429s. When the provider still rate-limits, the whole limiter pauses
+for the Retry-After interval (or a jittered exponential backoff) and only
+the failed request is retried.
+"""
+
+import time
+import random
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from embedding_cache import tenant_key
+
+
+T = TypeVar("T")
+
+# HTTP statuses worth retrying: rate limited, timeouts and transient server errors
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+_RETRYABLE_NAMES = ("RateLimit", "ResourceExhausted", "Timeout", "ServiceUnavailable",
+                    "InternalServerError", "APIConnectionError", "ConnectionError")
+
+
+class TokenBucket:
+    """
+    Continuously refilled bucket that may go into debt
+    
+    A reservation larger than the current level is granted immediately but
+    the caller is told how long to wait; later reservations queue behind
+    the debt, so requests bigger than the burst size still pace correctly.
+    """
+    
+    def __init__(self, rate_per_second: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.clock = clock
+        self.level = capacity
+        self.updated = clock()
+    
+    def reserve(self, amount: float) -> float:
+        """Take amount from the bucket and return the seconds to wait before using it"""
+        now = self.clock()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        self.level -= amount
+        return max(0.0, -self.level / self.rate)
+    
+    def drain(self):
+        """Empty the bucket (after the provider reported a rate limit)"""
+        self.level = min(self.level, 0.0)
+
+
+class RateLimiter:
+    """Request and token buckets for one (provider, API key) pair"""
+    
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None,
+                 burst_seconds: float = 1.0, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.buckets = {
+            name: TokenBucket(per_minute / 60, max(1.0, per_minute / 60 * burst_seconds), clock)
+            for name, per_minute in (("requests", requests_per_minute), ("tokens", tokens_per_minute))
+            if per_minute
+        }
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+        self.counters = {"requests": 0, "tokens": 0, "throttled_seconds": 0.0, "retries": 0}
+    
+    def reserve(self, tokens: int = 0) -> float:
+        """Reserve one request and its tokens; returns the seconds to wait before sending it"""
+        with self._lock:
+            wait = max(0.0, self.blocked_until - self.clock())
+            if "requests" in self.buckets:
+                wait = max(wait, self.buckets["requests"].reserve(1))
+            if "tokens" in self.buckets and tokens:
+                wait = max(wait, self.buckets["tokens"].reserve(tokens))
+            self.counters["requests"] += 1
+            self.counters["tokens"] += tokens
+            self.counters["throttled_seconds"] += wait
+            return wait
+    
+    def pause(self, seconds: float):
+        """Stop every caller of this limiter for a while before a retry (the provider pushed back)"""
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, self.clock() + seconds)
+            for bucket in self.buckets.values():
+                bucket.drain()
+            self.counters["retries"] += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self.counters,
+                "requests_per_minute": self.buckets["requests"].rate * 60 if "requests" in self.buckets else None,
+                "tokens_per_minute": self.buckets["tokens"].rate * 60 if "tokens" in self.buckets else None
+            }
+
+
+_limiters: Dict[Tuple[str, str], RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider: str, api_key: Optional[str], requests_per_minute: Optional[float] = None,
+                     tokens_per_minute: Optional[float] = None) -> RateLimiter:
+    """Process-wide limiter for a provider and API key (created with the given limits on first use)"""
+    key = (provider, tenant_key(api_key))
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = RateLimiter(requests_per_minute, tokens_per_minute)
+        return limiter
+
+
+def rate_limiter_stats() -> Dict[str, Dict[str, Any]]:
+    """Counters per provider, summed over API keys (keys are never reported)"""
+    totals: Dict[str, Dict[str, Any]] = {}
+    with _limiters_lock:
+        limiters = list(_limiters.items())
+    for (provider, _), limiter in limiters:
+        stats = limiter.stats()
+        total = totals.setdefault(provider, {"keys": 0, "requests": 0, "tokens": 0, "throttled_seconds": 0.0,
+                                             "retries": 0})
+        total["keys"] += 1
+        for name in ("requests", "tokens", "throttled_seconds", "retries"):
+            total[name] += stats[name]
+    return totals
+
+
+def _error_chain(error: BaseException):
+    """The error and the errors it was raised from"""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        yield error
+        error = error.__cause__ or error.__context__
+
+
+def _status(error: BaseException) -> Optional[int]:
+    for attribute in ("status_code", "http_status", "status", "code"):
+        value = getattr(error, attribute, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether an SDK error is a rate limit, timeout or transient server error"""
+    for cause in _error_chain(error):
+        status = _status(cause)
+        if status is not None:
+            return status in RETRYABLE_STATUSES
+        if any(name in type(cause).__name__ for name in _RETRYABLE_NAMES):
+            return True
+    return False
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the provider asked us to wait (Retry-After / retry-after-ms headers), if any"""
+    for cause in _error_chain(error):
+        headers = getattr(cause, "headers", None) or getattr(getattr(cause, "response", None), "headers", None)
+        if not headers:
+            continue
+        try:
+            milliseconds = headers.get("retry-after-ms")
+            if milliseconds is not None:
+                return float(milliseconds) / 1000
+            value = headers.get("retry-after") or headers.get("Retry-After")
+            if value is None:
+                continue
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except Exception:
+            continue
+    return None
+
+
+class RetryPolicy:
+    """Retry schedule for provider calls: jittered exponential backoff unless Retry-After says otherwise"""
+    
+    def __init__(self, max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+    
+    def delay(self, attempt: int, error: BaseException) -> float:
+        requested = retry_after(error)
+        if requested is not None:
+            return min(requested, self.max_delay)
+        return min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+    
+    def call(self, limiter: RateLimiter, tokens: int, function: Callable[[], T]) -> T:
+        """
+        Run a provider call within the limiter, retrying retryable failures
+        
+        The wait before each attempt comes from the limiter, which includes
+        any pause set after a failure, so concurrent callers back off together.
+        """
+        for attempt in range(self.max_retries + 1):
+            time.sleep(limiter.reserve(tokens))
+            try:
+                return function()
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                self._backoff(limiter, attempt, e)
+    
+    async def acall(self, limiter: RateLimiter, tokens: int, function: Callable[[], Awaitable[T]]) -> T:
+        """Async version of call()"""
+        for attempt in range(self.max_retries + 1):
+            await asyncio.sleep(limiter.reserve(tokens))
+            try:
+                return await function()
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                self._backoff(limiter, attempt, e)
+    
+    def _backoff(self, limiter: RateLimiter, attempt: int, error: BaseException):
+        delay = self.delay(attempt, error)
+        print(f"Embedding request failed ({error}); retrying in {delay:.1f}s")
+        limiter.pause(delay)
@@ -5,12 +5,12 @@ Reference: https://google.github.io/adk-docs/
 
 All branding and configuration can be customized in branding_config.py
 """
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Query, Request
 from fastapi.responses import HTMLResponse, FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Literal
 import uuid
 import os
 from pathlib import Path
@@ -47,6 +47,24 @@ if static_dir.exists():
 user_sessions = {}
 
 
+@app.on_event("startup")
+async def preload_local_models():
+    """Load and warm up local embedding models listed in RAG_PRELOAD_MODELS"""
+    from local_models import model_registry
+    
+    model_ids = [m.strip() for m in os.getenv("RAG_PRELOAD_MODELS", "").split(",") if m.strip()]
+    if model_ids:
+        await asyncio.to_thread(model_registry.preload, model_ids)
+
+
+@app.on_event("shutdown")
+async def save_rag_indexes():
+    """Save vector indexes changed since they were last saved, so restarts reattach them"""
+    from document_processor import document_store
+    
+    await asyncio.to_thread(document_store.save_indexes)
+
+
 # Pydantic models
 class ChatRequest(BaseModel):
     message: str
@@ -73,6 +91,9 @@ class RAGChatRequest(BaseModel):
     embedding_api_key: Optional[str] = None  # Separate API key for embeddings
     use_rag: bool = True  # Whether to use RAG
     top_k: int = 3  # Number of relevant chunks to retrieve
+    ef_search: Optional[int] = None  # HNSW search breadth (recall vs. latency)
+    nprobe: Optional[int] = None  # IVF lists probed per query (recall vs. latency)
+    retrieval_mode: Literal["vector", "hybrid", "lexical"] = "vector"  # "lexical" skips query embedding
 
 
 class DocumentUploadRequest(BaseModel):
@@ -82,6 +103,27 @@ class DocumentUploadRequest(BaseModel):
     embedding_provider: str = "openai"
     embedding_model: Optional[str] = None
     embedding_api_key: Optional[str] = None
+    chunking: str = "characters"  # "characters" or "tokens" (of the embedding model)
+    chunk_size: Optional[int] = None  # Default 500 characters, or up to 512 tokens
+    chunk_overlap: Optional[int] = None  # Default 50 characters, or a tenth of the chunk size
+    deduplicate: Optional[bool] = None  # Skip near-duplicate chunks (default: RAG_DEDUP)
+
+
+class BatchUploadFile(BaseModel):
+    filename: str
+    content: str  # Base64 encoded file content
+
+
+class DocumentBatchUploadRequest(BaseModel):
+    files: List[BatchUploadFile]
+    session_id: str
+    embedding_provider: str = "openai"
+    embedding_model: Optional[str] = None
+    embedding_api_key: Optional[str] = None
+    chunking: str = "characters"
+    chunk_size: Optional[int] = None
+    chunk_overlap: Optional[int] = None
+    deduplicate: Optional[bool] = None
 
 
 class DocumentListResponse(BaseModel):
@@ -94,6 +136,18 @@ class DocumentDeleteRequest(BaseModel):
     doc_id: str
 
 
+class QuantizationRequest(BaseModel):
+    session_id: str
+    quantization: Optional[str] = None  # "float16", "int8", "binary" or None for full precision
+
+
+class ReductionRequest(BaseModel):
+    session_id: str
+    method: Optional[str] = None  # "truncate" (Matryoshka models), "pca" or None for full width
+    dimensions: Optional[int] = None
+    rescore_factor: int = 4
+
+
 class EmbeddingProvidersResponse(BaseModel):
     providers: Dict[str, Any]
 
@@ -1889,70 +1943,256 @@ async def get_local_embedding_models():
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _check_session_id(session_id: str):
+    """Reject RAG session ids that cannot safely name a storage directory"""
+    from session_storage import check_session_id
+    
+    try:
+        check_session_id(session_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @app.post("/api/rag/upload")
 async def upload_document(request: DocumentUploadRequest):
-    """Upload and process a document for RAG"""
+    """
+    Upload and process a document for RAG
+    
+    The document streams through the ingestion pipeline (extract, chunk,
+    embed, index), so its first chunks are searchable before the rest
+    of it has been embedded.
+    """
+    _check_session_id(request.session_id)
     try:
         import base64
-        from datetime import datetime
-        from document_processor import (
-            DocumentProcessor, DocumentChunker, document_store
-        )
-        from embedding_service import EmbeddingClient
         
         # Decode file content
         file_content = base64.b64decode(request.content)
         
-        # Extract text from document
-        processor = DocumentProcessor()
-        text = processor.extract_text_from_file(file_content, request.filename)
-        
-        if not text or len(text.strip()) == 0:
-            raise HTTPException(status_code=400, detail="No text could be extracted from the document")
+        return await _ingest_upload(
+            file_content, request.filename, request.session_id, request.embedding_provider,
+            request.embedding_model, request.embedding_api_key, request.chunking,
+            request.chunk_size, request.chunk_overlap, request.deduplicate
+        )
         
-        # Chunk the text
-        chunker = DocumentChunker(chunk_size=500, chunk_overlap=50)
-        chunks = chunker.chunk_text(text)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/rag/upload/raw")
+async def upload_document_raw(
+    request: Request,
+    session_id: str = Query(...),
+    filename: str = Query(...),
+    embedding_provider: str = Query("openai"),
+    embedding_model: Optional[str] = Query(None),
+    chunking: str = Query("characters"),
+    chunk_size: Optional[int] = Query(None),
+    chunk_overlap: Optional[int] = Query(None),
+    deduplicate: Optional[bool] = Query(None),
+    embedding_api_key: Optional[str] = Header(None, alias="X-Embedding-Api-Key")
+):
+    """
+    Upload a document sent as the raw request body
+    
+    Unlike the JSON route, the file is neither base64 encoded nor held in
+    memory: the body is kept in memory up to RAG_UPLOAD_SPOOL_BYTES and
+    spooled to a temporary file beyond, which is read through a memory map
+    (and by path in PDF extraction workers). Bodies over
+    RAG_UPLOAD_MAX_BYTES are rejected.
+    """
+    _check_session_id(session_id)
+    import tempfile
+    from document_processor import MappedFile
+    
+    max_bytes = int(os.getenv("RAG_UPLOAD_MAX_BYTES", str(100 * 1024 * 1024)))
+    spool_bytes = int(os.getenv("RAG_UPLOAD_SPOOL_BYTES", str(1024 * 1024)))
+    too_large = HTTPException(status_code=413, detail=f"Uploads are limited to {max_bytes} bytes")
+    declared = request.headers.get("content-length")
+    if declared is not None and declared.isdigit() and int(declared) > max_bytes:
+        raise too_large
+    
+    buffer = bytearray()
+    spool = None  # Named temporary file once the body outgrows the buffer
+    mapped = None
+    try:
+        size = 0
+        async for block in request.stream():
+            size += len(block)
+            if size > max_bytes:
+                raise too_large
+            if spool is None and size > spool_bytes:
+                spool = tempfile.NamedTemporaryFile(suffix=Path(filename).suffix, delete=False)
+                spool.write(buffer)
+                buffer = bytearray()
+            if spool is not None:
+                spool.write(block)
+            else:
+                buffer += block
         
-        if not chunks:
-            raise HTTPException(status_code=400, detail="Could not create chunks from document")
+        if spool is not None:
+            # Map the file instead of reading it back; closing first flushes its write buffer
+            spool.close()
+            mapped = MappedFile(spool.name)
+            file_content = mapped
+        else:
+            file_content = bytes(buffer)
         
-        # Initialize embedding client
-        embedding_client = EmbeddingClient(
+        return await _ingest_upload(
+            file_content, filename, session_id, embedding_provider, embedding_model,
+            embedding_api_key, chunking, chunk_size, chunk_overlap, deduplicate
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if mapped is not None:
+            try:
+                mapped.close()
+            except BufferError:
+                # An extraction thread abandoned by a failed upload still reads it; unmapped when collected
+                pass
+        if spool is not None:
+            spool.close()
+            try:
+                os.unlink(spool.name)
+            except OSError:
+                pass
+
+
+async def _ingest_upload(file_content, filename: str, session_id: str, embedding_provider: str,
+                         embedding_model: Optional[str], embedding_api_key: Optional[str], chunking: str,
+                         chunk_size: Optional[int], chunk_overlap: Optional[int],
+                         deduplicate: Optional[bool]) -> Dict[str, Any]:
+    """Run one uploaded file through the ingestion pipeline and build the upload response"""
+    from document_processor import document_store
+    from embedding_service import EmbeddingClient
+    from ingestion import IngestionPipeline
+    from tokenization import create_chunker
+    
+    # Initialize embedding client (local models load off the event loop)
+    embedding_client = await asyncio.to_thread(
+        EmbeddingClient,
+        provider=embedding_provider,
+        api_key=embedding_api_key,
+        model=embedding_model
+    )
+    
+    try:
+        # Loading a model tokenizer reads files, so it happens off the event loop too
+        chunker = await asyncio.to_thread(
+            create_chunker, chunking, embedding_provider, embedding_client.model, chunk_size, chunk_overlap
+        )
+        pipeline = IngestionPipeline(document_store, embedding_client, chunker=chunker, deduplicate=deduplicate)
+        result = await pipeline.ingest(
+            session_id, file_content, filename,
+            metadata={
+                "embedding_provider": embedding_provider,
+                "embedding_model": embedding_model or "default",
+                "chunking": chunker.config
+            }
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {
+        "success": True,
+        "doc_id": result["doc_id"],
+        "filename": filename,
+        "chunks": result["chunks"],
+        "message": f"Document processed successfully with {result['chunks']} chunks",
+        "ingestion": {
+            "seconds": result["seconds"],
+            "first_searchable_seconds": result["first_searchable_seconds"],
+            "stages": result["stages"]
+        },
+        "deduplication": result["deduplication"]
+    }
+
+
+@app.post("/api/rag/upload/batch")
+async def upload_documents(request: DocumentBatchUploadRequest):
+    """
+    Upload and process many documents at once (e.g. a folder)
+    
+    The files are extracted in parallel, their chunks are embedded in
+    shared batches and all of them are saved with one write. Files that
+    cannot be decoded or extracted are reported individually and do not
+    stop the others.
+    """
+    _check_session_id(request.session_id)
+    max_files = int(os.getenv("RAG_BATCH_MAX_FILES", "1000"))
+    if len(request.files) > max_files:
+        raise HTTPException(status_code=400, detail=f"At most {max_files} files can be uploaded at once")
+    
+    try:
+        import base64
+        import binascii
+        from document_processor import document_store
+        from embedding_service import EmbeddingClient
+        from ingestion import IngestionPipeline
+        from tokenization import create_chunker
+        
+        # Decode file contents, keeping each file's position for the per-file report
+        results: List[Optional[Dict[str, Any]]] = [None] * len(request.files)
+        decoded = []
+        positions = []
+        for position, file in enumerate(request.files):
+            try:
+                decoded.append((file.filename, base64.b64decode(file.content)))
+                positions.append(position)
+            except (binascii.Error, ValueError) as e:
+                results[position] = {"filename": file.filename, "success": False,
+                                     "error": f"Invalid base64 content: {e}"}
+        
+        embedding_client = await asyncio.to_thread(
+            EmbeddingClient,
             provider=request.embedding_provider,
             api_key=request.embedding_api_key,
             model=request.embedding_model
         )
         
-        # Generate embeddings for all chunks
-        embeddings = embedding_client.embed_texts(chunks)
-        
-        # Generate document ID
-        doc_id = DocumentProcessor.generate_document_id(request.filename, text)
-        
-        # Create document object
-        document = {
-            "id": doc_id,
-            "filename": request.filename,
-            "text": text,
-            "chunks": chunks,
-            "embeddings": embeddings,
-            "upload_time": datetime.now().isoformat(),
-            "embedding_provider": request.embedding_provider,
-            "embedding_model": request.embedding_model or "default"
-        }
-        
-        # Store document
-        document_store.add_document(request.session_id, document)
+        try:
+            chunker = await asyncio.to_thread(
+                create_chunker, request.chunking, request.embedding_provider, embedding_client.model,
+                request.chunk_size, request.chunk_overlap
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        pipeline = IngestionPipeline(document_store, embedding_client, chunker=chunker,
+                                     deduplicate=request.deduplicate)
+        result = await pipeline.ingest_many(
+            request.session_id, decoded,
+            metadata={
+                "embedding_provider": request.embedding_provider,
+                "embedding_model": request.embedding_model or "default",
+                "chunking": chunker.config
+            }
+        )
+        for position, file_result in zip(positions, result["documents"]):
+            results[position] = file_result
         
+        failed = len(request.files) - result["added"]
         return {
-            "success": True,
-            "doc_id": doc_id,
-            "filename": request.filename,
-            "chunks": len(chunks),
-            "message": f"Document processed successfully with {len(chunks)} chunks"
+            "success": failed == 0,
+            "documents": results,
+            "added": result["added"],
+            "failed": failed,
+            "chunks": result["chunks"],
+            "message": f"Processed {result['added']} of {len(request.files)} documents "
+                       f"with {result['chunks']} chunks",
+            "ingestion": {
+                "seconds": result["seconds"],
+                "stages": result["stages"]
+            },
+            "deduplication": result["deduplication"]
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1960,6 +2200,7 @@ async def upload_document(request: DocumentUploadRequest):
 @app.get("/api/rag/documents/{session_id}", response_model=DocumentListResponse)
 async def list_documents(session_id: str):
     """List all documents for a session"""
+    _check_session_id(session_id)
     try:
         from document_processor import document_store
         
@@ -1977,6 +2218,7 @@ async def list_documents(session_id: str):
 @app.delete("/api/rag/document")
 async def delete_document(request: DocumentDeleteRequest):
     """Delete a document"""
+    _check_session_id(request.session_id)
     try:
         from document_processor import document_store
         
@@ -1994,6 +2236,7 @@ async def delete_document(request: DocumentDeleteRequest):
 @app.delete("/api/rag/documents/{session_id}")
 async def clear_documents(session_id: str):
     """Clear all documents for a session"""
+    _check_session_id(session_id)
     try:
         from document_processor import document_store
         
@@ -2005,9 +2248,78 @@ async def clear_documents(session_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/rag/stats")
+async def get_rag_stats():
+    """Get document store and embedding cache statistics"""
+    from document_processor import document_store
+    from embedding_cache import query_embedding_cache, chunk_cache_stats
+    from embedding_batcher import query_batcher
+    from ingestion import ingestion_stats
+    from local_models import model_registry
+    from pdf_extraction import pdf_extractor
+    from rate_limiter import rate_limiter_stats
+    
+    return {
+        "session_cache": document_store.cache_stats(),
+        "query_embedding_cache": query_embedding_cache.stats(),
+        "query_batcher": query_batcher.stats(),
+        "chunk_embedding_cache": chunk_cache_stats(),
+        "local_models": model_registry.stats(),
+        "rate_limits": rate_limiter_stats(),
+        "ingestion": ingestion_stats(),
+        "pdf_extraction": pdf_extractor.stats()
+    }
+
+
+@app.post("/api/rag/quantization")
+async def set_quantization(request: QuantizationRequest):
+    """Choose the embedding quantization used to search a session"""
+    from document_processor import document_store
+    
+    _check_session_id(request.session_id)
+    try:
+        document_store.set_quantization(request.session_id, request.quantization)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {"success": True, "quantization": request.quantization}
+
+
+@app.post("/api/rag/reduction")
+async def set_reduction(request: ReductionRequest):
+    """Index a session's embeddings with fewer dimensions (truncation or PCA)"""
+    from document_processor import document_store
+    
+    _check_session_id(request.session_id)
+    try:
+        summary = await asyncio.to_thread(
+            document_store.set_reduction, request.session_id, request.method,
+            request.dimensions, request.rescore_factor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {"success": True, **summary}
+
+
+@app.get("/api/rag/recall/{session_id}")
+async def get_recall_report(session_id: str, top_k: int = 10, samples: int = 100):
+    """Compare a session's search index against exact search"""
+    from document_processor import document_store
+    
+    _check_session_id(session_id)
+    report = await asyncio.to_thread(document_store.recall_report, session_id, None, top_k, samples)
+    if report is None:
+        raise HTTPException(status_code=404, detail="No embeddings stored for this session")
+    return report
+
+
 @app.post("/api/rag/chat/stream")
 async def rag_chat_stream(request: RAGChatRequest):
     """Stream chat responses with RAG enhancement"""
+    if request.session_id:
+        _check_session_id(request.session_id)
+    
     async def generate_stream():
         try:
             from cloud_providers import CloudProviderClient
@@ -2034,24 +2346,50 @@ async def rag_chat_stream(request: RAGChatRequest):
             context_chunks = []
             if request.use_rag:
                 try:
-                    # Initialize embedding client for query
-                    embedding_api_key = request.embedding_api_key or request.api_key
-                    embedding_client = EmbeddingClient(
-                        provider=request.embedding_provider,
-                        api_key=embedding_api_key,
-                        model=request.embedding_model
-                    )
-                    
-                    # Embed the query
-                    query_embedding = embedding_client.embed_query(message)
-                    
-                    # Search for relevant chunks
-                    context_chunks = document_store.search_chunks(
-                        session_id=session_id,
-                        query_embedding=query_embedding,
-                        top_k=request.top_k,
-                        similarity_threshold=0.3
-                    )
+                    if request.retrieval_mode == "lexical":
+                        # Keyword search only, no embedding round-trip; loading the
+                        # session or building its BM25 index happens off the event loop
+                        context_chunks = await asyncio.to_thread(
+                            document_store.search_lexical,
+                            session_id=session_id,
+                            query=message,
+                            top_k=request.top_k
+                        )
+                    else:
+                        # Initialize embedding client for query
+                        embedding_api_key = request.embedding_api_key or request.api_key
+                        embedding_client = await asyncio.to_thread(
+                            EmbeddingClient,
+                            provider=request.embedding_provider,
+                            api_key=embedding_api_key,
+                            model=request.embedding_model
+                        )
+                        
+                        # Embed the query
+                        query_embedding = await embedding_client.aembed_query(message, as_numpy=True)
+                        
+                        # Search for relevant chunks
+                        if request.retrieval_mode == "hybrid":
+                            context_chunks = await asyncio.to_thread(
+                                document_store.search_hybrid,
+                                session_id=session_id,
+                                query=message,
+                                query_embedding=query_embedding,
+                                top_k=request.top_k,
+                                similarity_threshold=0.3,
+                                ef_search=request.ef_search,
+                                nprobe=request.nprobe
+                            )
+                        else:
+                            context_chunks = await asyncio.to_thread(
+                                document_store.search_chunks,
+                                session_id=session_id,
+                                query_embedding=query_embedding,
+                                top_k=request.top_k,
+                                similarity_threshold=0.3,
+                                ef_search=request.ef_search,
+                                nprobe=request.nprobe
+                            )
                     
                     # Augment message with context if found
                     if context_chunks:
@@ -0,0 +1,497 @@
+"""
+Session Storage for RAG
+========================
+On-disk layout of a RAG session: float32 embedding blobs that are
+memory-mapped on load, a compact JSON sidecar for text and metadata, and
+an append-only log of the changes made since the last snapshot
+
+    rag_storage/<session_id>/
+        snapshot.<gen>.json          documents, chunks and metadata (commit point)
+        snapshot.<gen>.<dims>.npy    float32 embeddings, one row per chunk
+        wal.<gen>.log                add/delete records written after snapshot <gen>
+        <backend>.index              optional approximate vector index
+        config.json                  optional per-session settings (e.g. quantization)
+        projection.npy               optional PCA projection for reduced-dimension search
+
+A snapshot of generation G contains every change from the logs of earlier
+generations, so a session is loaded by reading the newest snapshot and
+replaying the logs of generation G and above.
+"""
+
+import os
+import re
+import json
+import zlib
+import shutil
+import struct
+import threading
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+import numpy as np
+
+
+SNAPSHOT_VERSION = 1
+_SNAPSHOT_PATTERN = re.compile(r"^snapshot\.(\d+)\.json$")
+_BLOB_PATTERN = re.compile(r"^snapshot\.(\d+)\.\d+\.npy$")
+_LOG_PATTERN = re.compile(r"^wal\.(\d+)\.log$")
+_SESSION_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]+")
+
+# Log record: magic, payload length, CRC32 of payload
+_RECORD_MAGIC = b"RAGW"
+_RECORD_HEADER = struct.Struct("<4sII")
+_META_LENGTH = struct.Struct("<I")
+
+
+def _fsync_replace(tmp_path: Path, final_path: Path):
+    """Atomically move a fully written temporary file into place"""
+    with open(tmp_path, 'rb+') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, final_path)
+
+
+def _remove_quietly(path: Path):
+    """Delete a file, ignoring files that are gone or still mapped (Windows)"""
+    try:
+        path.unlink()
+    except OSError:
+        pass
+
+
+def check_session_id(session_id: str) -> str:
+    """
+    Validate a session id before it is used in a path
+
+    Raises:
+        ValueError: If the id is not made of letters, digits, "_" and "-"
+            (so it can never name ".", ".." or a nested path)
+    """
+    if not isinstance(session_id, str) or not _SESSION_ID_PATTERN.fullmatch(session_id):
+        raise ValueError(f"Invalid session id: {session_id!r}")
+    return session_id
+
+
+def _session_path(storage_dir: Path, name: str) -> Path:
+    """Path of a session's directory or legacy file, which must lie directly inside storage_dir"""
+    root = Path(storage_dir).resolve()
+    path = (root / name).resolve()
+    if path.parent != root:
+        raise ValueError(f"Session path {path} is outside the storage directory {root}")
+    return path
+
+
+def encode_add(document: Dict[str, Any]) -> bytes:
+    """Encode an add-document log record (metadata as JSON, embeddings as raw float32)"""
+    embeddings = np.ascontiguousarray(document.get("embeddings", []), dtype=np.float32)
+    meta = {key: value for key, value in document.items() if key != "embeddings"}
+    meta = json.dumps({
+        "op": "add",
+        "document": meta,
+        "shape": list(embeddings.shape) if embeddings.size else [0, 0]
+    }, separators=(',', ':')).encode("utf-8")
+    return _META_LENGTH.pack(len(meta)) + meta + embeddings.tobytes()
+
+
+def encode_delete(doc_id: str) -> bytes:
+    """Encode a delete-document log record"""
+    meta = json.dumps({"op": "delete", "id": doc_id}, separators=(',', ':')).encode("utf-8")
+    return _META_LENGTH.pack(len(meta)) + meta
+
+
+def decode_record(payload: bytes) -> Dict[str, Any]:
+    """Decode a log record; embeddings are a zero-copy view into the payload"""
+    (meta_length,) = _META_LENGTH.unpack_from(payload)
+    meta_end = _META_LENGTH.size + meta_length
+    record = json.loads(payload[_META_LENGTH.size:meta_end].decode("utf-8"))
+    if record["op"] == "add":
+        rows, dims = record.pop("shape")
+        record["document"]["embeddings"] = np.frombuffer(
+            payload, dtype=np.float32, count=rows * dims, offset=meta_end
+        ).reshape(rows, dims)
+    return record
+
+
+class SessionStorage:
+    """
+    Persist and load the documents of one RAG session
+
+    Changes are appended to a write-ahead log, so a new document costs
+    only its own bytes on disk. Once the log outgrows the snapshot it is
+    compacted into a new snapshot on a background thread.
+    """
+
+    def __init__(self, storage_dir: Path, session_id: str,
+                 compaction_min_bytes: int = 8 * 1024 * 1024, compaction_ratio: float = 1.0):
+        self.session_id = check_session_id(session_id)
+        self.session_dir = _session_path(storage_dir, session_id)
+        self.legacy_file = _session_path(storage_dir, f"{session_id}.json")
+        self.compaction_min_bytes = compaction_min_bytes
+        self.compaction_ratio = compaction_ratio
+
+        self.generation = self._latest_generation() or 0  # Newest committed snapshot
+        self.log_generation = self.generation  # Log currently being appended to
+        self.snapshot_bytes = 0
+        self.log_bytes = 0
+
+        self._lock = threading.Lock()
+        self._compaction: Optional[threading.Thread] = None
+
+    def _generations(self, pattern: re.Pattern) -> List[int]:
+        if not self.session_dir.is_dir():
+            return []
+        return sorted(
+            int(match.group(1))
+            for match in (pattern.match(p.name) for p in self.session_dir.iterdir())
+            if match
+        )
+
+    def _latest_generation(self) -> Optional[int]:
+        """Generation of the newest committed snapshot, if any"""
+        generations = self._generations(_SNAPSHOT_PATTERN)
+        return generations[-1] if generations else None
+
+    def _meta_file(self, generation: int) -> Path:
+        return self.session_dir / f"snapshot.{generation}.json"
+
+    def _blob_file(self, generation: int, dimensions: int) -> Path:
+        return self.session_dir / f"snapshot.{generation}.{dimensions}.npy"
+
+    def _log_file(self, generation: int) -> Path:
+        return self.session_dir / f"wal.{generation}.log"
+
+    def index_file(self, backend_name: str) -> Path:
+        """Path of the approximate vector index kept next to the session data"""
+        return self.session_dir / f"{backend_name}.index"
+
+    @property
+    def config_file(self) -> Path:
+        return self.session_dir / "config.json"
+
+    def load_config(self) -> Dict[str, Any]:
+        """Per-session settings, empty if none were saved"""
+        try:
+            with open(self.config_file, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def save_config(self, config: Dict[str, Any]):
+        """Atomically replace the per-session settings"""
+        self.session_dir.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.config_file.with_name("config.json.tmp")
+        with open(tmp_file, 'w') as f:
+            json.dump(config, f)
+        _fsync_replace(tmp_file, self.config_file)
+
+    @property
+    def projection_file(self) -> Path:
+        return self.session_dir / "projection.npy"
+
+    def load_projection(self) -> Optional[np.ndarray]:
+        """Saved PCA projection (reduced dimensions x full dimensions), if any"""
+        try:
+            return np.load(self.projection_file)
+        except FileNotFoundError:
+            return None
+
+    def save_projection(self, components: np.ndarray):
+        """Atomically replace the session's PCA projection"""
+        self.session_dir.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.projection_file.with_name("projection.npy.tmp")
+        with open(tmp_file, 'wb') as f:
+            np.save(f, np.asarray(components, dtype=np.float32))
+        _fsync_replace(tmp_file, self.projection_file)
+
+    def exists(self) -> bool:
+        """Whether anything has been stored for this session"""
+        return (self._latest_generation() is not None or bool(self._generations(_LOG_PATTERN))
+                or self.legacy_file.exists())
+
+    # ------------------------------------------------------------------
+    # Loading
+    # ------------------------------------------------------------------
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Load the session documents
+
+        Embeddings are returned as read-only views into memory-mapped
+        float32 blobs (or into the log records replayed on top of them),
+        so no per-float Python objects are created. Legacy JSON sessions
+        are migrated to the binary layout on first load.
+
+        Returns:
+            {doc_id: document}
+        """
+        generation = self._latest_generation()
+        if generation is None and not self._generations(_LOG_PATTERN):
+            if self.legacy_file.exists():
+                return self._migrate_legacy()
+            return {}
+
+        documents = self._load_snapshot(generation) if generation is not None else {}
+        self.generation = generation or 0
+
+        logs = [g for g in self._generations(_LOG_PATTERN) if g >= self.generation]
+        self.log_bytes = 0
+        for log_generation in logs:
+            self.log_bytes += self._replay_log(log_generation, documents)
+        self.log_generation = logs[-1] if logs else self.generation
+        return documents
+
+    def _load_snapshot(self, generation: int) -> Dict[str, Dict[str, Any]]:
+        meta_file = self._meta_file(generation)
+        with open(meta_file, 'r') as f:
+            meta = json.load(f)
+
+        blobs = {
+            int(dims): np.load(self._blob_file(generation, int(dims)), mmap_mode='r')
+            for dims in meta.get("blobs", [])
+        }
+        self.snapshot_bytes = meta_file.stat().st_size + sum(blob.nbytes for blob in blobs.values())
+
+        documents = {}
+        for entry in meta["documents"]:
+            document = dict(entry)
+            dims = document.pop("dimensions", None)
+            row = document.pop("row", 0)
+            rows = document.pop("rows", 0)
+            if rows:
+                document["embeddings"] = blobs[dims][row:row + rows]
+            else:
+                document["embeddings"] = np.empty((0, dims or 0), dtype=np.float32)
+            documents[document["id"]] = document
+        return documents
+
+    def _replay_log(self, generation: int, documents: Dict[str, Dict[str, Any]]) -> int:
+        """
+        Apply the records of one log file to documents
+
+        A record that is cut short or fails its checksum marks a torn tail
+        from an interrupted write; the log is truncated there.
+
+        Returns:
+            Size of the valid part of the log in bytes
+        """
+        log_file = self._log_file(generation)
+        valid_bytes = 0
+        with open(log_file, 'rb') as f:
+            while True:
+                header = f.read(_RECORD_HEADER.size)
+                if len(header) < _RECORD_HEADER.size:
+                    break
+                magic, length, checksum = _RECORD_HEADER.unpack(header)
+                if magic != _RECORD_MAGIC:
+                    break
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != checksum:
+                    break
+
+                record = decode_record(payload)
+                if record["op"] == "add":
+                    document = record["document"]
+                    # Re-adding moves a document to the end, as in DocumentStore
+                    documents.pop(document["id"], None)
+                    documents[document["id"]] = document
+                elif record["op"] == "delete":
+                    documents.pop(record["id"], None)
+                valid_bytes = f.tell()
+
+        if valid_bytes < log_file.stat().st_size:
+            print(f"Truncating torn tail of {log_file} at byte {valid_bytes}")
+            with open(log_file, 'rb+') as f:
+                f.truncate(valid_bytes)
+                os.fsync(f.fileno())
+        return valid_bytes
+
+    # ------------------------------------------------------------------
+    # Appending
+    # ------------------------------------------------------------------
+
+    def append(self, payloads: List[bytes]):
+        """
+        Durably append encoded records to the log with a single write
+
+        Args:
+            payloads: Records from encode_add() / encode_delete()
+        """
+        data = b"".join(
+            _RECORD_HEADER.pack(_RECORD_MAGIC, len(payload), zlib.crc32(payload)) + payload
+            for payload in payloads
+        )
+        with self._lock:
+            self.session_dir.mkdir(parents=True, exist_ok=True)
+            with open(self._log_file(self.log_generation), 'ab') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self.log_bytes += len(data)
+
+    # ------------------------------------------------------------------
+    # Snapshots and compaction
+    # ------------------------------------------------------------------
+
+    @property
+    def compacting(self) -> bool:
+        """Whether a background compaction is running"""
+        return self._compaction is not None and self._compaction.is_alive()
+
+    def needs_compaction(self) -> bool:
+        """Whether the log has grown enough to be folded into a snapshot"""
+        threshold = max(self.compaction_min_bytes, self.compaction_ratio * self.snapshot_bytes)
+        return self.log_bytes >= threshold
+
+    def maybe_compact(self, documents: Dict[str, Dict[str, Any]]) -> bool:
+        """
+        Start a background compaction if the log is large enough
+
+        Returns:
+            True if a compaction was started
+        """
+        if self.compacting or not self.needs_compaction():
+            return False
+        self.compact(documents, background=True)
+        return True
+
+    def compact(self, documents: Dict[str, Dict[str, Any]], background: bool = False):
+        """
+        Fold the current state into a new snapshot and start a new log
+
+        New appends go to the next log generation immediately, so writes
+        never wait for the snapshot; it is written from a point-in-time
+        copy of the documents.
+        """
+        self.wait()
+        with self._lock:
+            generation = self.log_generation + 1
+            self.log_generation = generation
+            self.log_bytes = 0
+            captured = dict(documents)
+
+        if background:
+            self._compaction = threading.Thread(
+                target=self._write_snapshot, args=(generation, captured, documents),
+                name=f"rag-compaction-{self.session_id}", daemon=True
+            )
+            self._compaction.start()
+        else:
+            self._write_snapshot(generation, captured, documents)
+
+    def save(self, documents: Dict[str, Dict[str, Any]]):
+        """Synchronously write a full snapshot of the session"""
+        self.compact(documents, background=False)
+
+    def wait(self):
+        """Wait for a running background compaction to finish"""
+        if self._compaction is not None:
+            self._compaction.join()
+            self._compaction = None
+
+    def _write_snapshot(self, generation: int, captured: Dict[str, Dict[str, Any]],
+                        live_documents: Dict[str, Dict[str, Any]]):
+        """
+        Write snapshot files for a generation
+
+        Blobs are written to temporary files and renamed into place; the
+        JSON sidecar is renamed last and is the commit point, so a crash
+        leaves the previous snapshot and logs intact.
+        """
+        try:
+            self.session_dir.mkdir(parents=True, exist_ok=True)
+
+            entries: List[Dict[str, Any]] = []
+            groups: Dict[int, List[np.ndarray]] = {}
+            for document in captured.values():
+                embeddings = np.asarray(document.get("embeddings", []), dtype=np.float32)
+                entry = {key: value for key, value in document.items() if key != "embeddings"}
+                if embeddings.size:
+                    dims = embeddings.shape[1]
+                    group = groups.setdefault(dims, [])
+                    entry["dimensions"] = dims
+                    entry["row"] = sum(len(block) for block in group)
+                    entry["rows"] = len(embeddings)
+                    group.append(embeddings)
+                entries.append(entry)
+
+            for dims, blocks in groups.items():
+                blob_file = self._blob_file(generation, dims)
+                tmp_file = blob_file.with_name(blob_file.name + ".tmp")
+                # Stream rows into the blob instead of concatenating in memory
+                blob = np.lib.format.open_memmap(
+                    tmp_file, mode='w+', dtype=np.float32,
+                    shape=(sum(len(block) for block in blocks), dims)
+                )
+                row = 0
+                for block in blocks:
+                    blob[row:row + len(block)] = block
+                    row += len(block)
+                blob.flush()
+                del blob
+                _fsync_replace(tmp_file, blob_file)
+
+            meta = {
+                "version": SNAPSHOT_VERSION,
+                "session_id": self.session_id,
+                "blobs": sorted(groups),
+                "documents": entries
+            }
+            meta_file = self._meta_file(generation)
+            tmp_file = meta_file.with_name(meta_file.name + ".tmp")
+            with open(tmp_file, 'w') as f:
+                json.dump(meta, f, separators=(',', ':'))
+            _fsync_replace(tmp_file, meta_file)
+
+            # Release in-memory copies in favour of the mapped blobs
+            saved = self._load_snapshot(generation)
+            with self._lock:
+                self.generation = generation
+                for doc_id, document in captured.items():
+                    if live_documents.get(doc_id) is document and doc_id in saved:
+                        document["embeddings"] = saved[doc_id]["embeddings"]
+            self._remove_stale()
+        except Exception as e:
+            print(f"Error compacting session {self.session_id}: {e}")
+
+    def _remove_stale(self):
+        """Delete snapshots and logs already folded into the current snapshot"""
+        for path in self.session_dir.iterdir():
+            match = (_SNAPSHOT_PATTERN.match(path.name) or _BLOB_PATTERN.match(path.name)
+                     or _LOG_PATTERN.match(path.name))
+            if match and int(match.group(1)) < self.generation:
+                _remove_quietly(path)
+            elif path.name.startswith("snapshot.") and path.name.endswith(".tmp"):
+                _remove_quietly(path)
+
+    def _migrate_legacy(self) -> Dict[str, Dict[str, Any]]:
+        """Convert a <session_id>.json file with float lists to the binary layout"""
+        with open(self.legacy_file, 'r') as f:
+            documents = json.load(f)
+
+        for document in documents.values():
+            document["embeddings"] = np.asarray(document.get("embeddings", []), dtype=np.float32)
+
+        self.save(documents)
+        _remove_quietly(self.legacy_file)
+        return documents
+
+    def delete(self):
+        """Remove everything stored for this session"""
+        self.wait()
+        shutil.rmtree(self.session_dir, ignore_errors=True)
+        _remove_quietly(self.legacy_file)
+        self.generation = 0
+        self.log_generation = 0
+        self.snapshot_bytes = 0
+        self.log_bytes = 0
+
+    @staticmethod
+    def list_sessions(storage_dir: Path) -> List[str]:
+        """Session ids with data in a storage directory (binary or legacy JSON)"""
+        sessions = set()
+        for path in Path(storage_dir).iterdir():
+            if path.is_dir() and any(
+                _SNAPSHOT_PATTERN.match(p.name) or _LOG_PATTERN.match(p.name) for p in path.iterdir()
+            ):
+                sessions.add(path.name)
+            elif path.is_file() and path.suffix == ".json":
+                sessions.add(path.stem)
+        return sorted(sessions)
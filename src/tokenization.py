@@ -0,0 +1,171 @@
+"""
+Embedding Model Tokenizers
+===========================
+Token counts from each embedding model's own tokenizer, for chunking
+documents by token budget instead of by characters
+
+OpenAI models are tokenized with tiktoken and the self-hosted models with
+their Hugging Face tokenizer. Providers without a local tokenizer (Cohere,
+Google, Voyage), and installs missing the library, fall back to the
+conservative estimate used for request batching: 3 ASCII characters per
+token and a token per other character. Tokenizers are loaded once per
+model and shared by all uploads.
+"""
+
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+import numpy as np
+
+from document_processor import DocumentChunker
+from embedding_service import estimate_token_ends
+from onnx_embeddings import MODEL_MAX_LENGTH, parse_model_id
+
+
+CHUNKING_MODES = ("characters", "tokens")
+
+# Maximum input tokens of each provider's models, with per-model exceptions
+PROVIDER_MAX_TOKENS = {
+    "openai": 8191,
+    "cohere": 512,
+    "google": 2048,
+    "voyage": 4000,
+    "huggingface": 512,
+    "onnx": 512
+}
+MODEL_MAX_TOKENS = {
+    "voyage-large-2": 16000,
+    "voyage-code-2": 16000,
+    **MODEL_MAX_LENGTH
+}
+
+
+class ApproximateTokenizer:
+    """Conservative token estimate of embedding_service (no model tokenizer available)"""
+    
+    name = "approximate"
+    special_tokens = 0
+    
+    def token_ends(self, text: str) -> np.ndarray:
+        """End offset in text of each token"""
+        return estimate_token_ends(text)
+
+
+class TiktokenTokenizer:
+    """OpenAI BPE tokenizer"""
+    
+    special_tokens = 0
+    
+    def __init__(self, model: str):
+        import tiktoken
+        try:
+            self.encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            self.encoding = tiktoken.get_encoding("cl100k_base")
+        self.name = f"tiktoken:{self.encoding.name}"
+    
+    def token_ends(self, text: str) -> np.ndarray:
+        """End offset in text of each token"""
+        tokens = self.encoding.encode(text, disallowed_special=())
+        _, starts = self.encoding.decode_with_offsets(tokens)
+        return np.asarray(starts[1:] + [len(text)], dtype=np.int64)
+
+
+class HuggingFaceTokenizer:
+    """Fast Hugging Face tokenizer of a self-hosted model"""
+    
+    def __init__(self, model_id: str):
+        from transformers import AutoTokenizer
+        self.tokenizer = AutoTokenizer.from_pretrained(model_id)
+        self.special_tokens = self.tokenizer.num_special_tokens_to_add()
+        self.name = f"huggingface:{model_id}"
+    
+    def token_ends(self, text: str) -> np.ndarray:
+        """End offset in text of each token"""
+        encoded = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+        return np.asarray([end for _, end in encoded["offset_mapping"]], dtype=np.int64)
+
+
+def load_tokenizer(provider: str, model: str) -> Any:
+    """
+    Tokenizer of an embedding model, or the approximation if it has none locally
+    
+    Loading also falls back to the approximation when the library is
+    installed but the tokenizer files cannot be fetched (offline, model
+    not cached, failed BPE download), so token-mode uploads still work.
+    """
+    try:
+        if provider == "openai":
+            return TiktokenTokenizer(model)
+        if provider in ("huggingface", "onnx"):
+            return HuggingFaceTokenizer(parse_model_id(model)[0])
+    except Exception as e:
+        print(f"Tokenizer for {provider}/{model} unavailable ({e}); estimating tokens conservatively")
+    return ApproximateTokenizer()
+
+
+_tokenizers: Dict[Tuple[str, str], Any] = {}
+_tokenizers_lock = threading.Lock()
+
+
+def get_tokenizer(provider: str, model: str) -> Any:
+    """Process-wide tokenizer for a provider and model, loaded on first use"""
+    key = (provider, model)
+    with _tokenizers_lock:
+        tokenizer = _tokenizers.get(key)
+    if tokenizer is None:
+        tokenizer = load_tokenizer(provider, model)
+        with _tokenizers_lock:
+            tokenizer = _tokenizers.setdefault(key, tokenizer)
+    return tokenizer
+
+
+def max_input_tokens(provider: str, model: str) -> Optional[int]:
+    """Tokens the model accepts per input, if limited"""
+    if provider == "onnx":
+        model = parse_model_id(model)[0]
+    return MODEL_MAX_TOKENS.get(model, PROVIDER_MAX_TOKENS.get(provider))
+
+
+def create_chunker(mode: str, provider: str, model: str, chunk_size: Optional[int] = None,
+                   chunk_overlap: Optional[int] = None) -> DocumentChunker:
+    """
+    Chunker for an upload
+    
+    Args:
+        mode: "characters" (sizes in characters, default 500/50) or "tokens"
+            (sizes in tokens of the embedding model)
+        provider: Embedding provider
+        model: Embedding model id
+        chunk_size: Chunk size; in token mode defaults to the model's input
+            limit capped at RAG_CHUNK_TOKENS (default 512)
+        chunk_overlap: Overlap between chunks; in token mode defaults to a
+            tenth of the chunk size
+    
+    Returns:
+        DocumentChunker
+    
+    Raises:
+        ValueError: If the mode is unknown, the sizes are invalid or the
+            chunk size exceeds what the model accepts
+    """
+    if mode not in CHUNKING_MODES:
+        raise ValueError(f"Unknown chunking mode: {mode}. Choose from {', '.join(CHUNKING_MODES)}")
+    
+    if mode == "characters":
+        chunk_size = 500 if chunk_size is None else chunk_size
+        chunk_overlap = 50 if chunk_overlap is None else chunk_overlap
+        tokenizer = None
+    else:
+        tokenizer = get_tokenizer(provider, model)
+        limit = max_input_tokens(provider, model)
+        usable = limit - tokenizer.special_tokens if limit else None
+        default = int(os.getenv("RAG_CHUNK_TOKENS", "512"))
+        chunk_size = min(default, usable or default) if chunk_size is None else chunk_size
+        if usable and chunk_size > usable:
+            raise ValueError(f"Chunk size of {chunk_size} tokens exceeds the {usable} tokens {model} accepts")
+        chunk_overlap = chunk_size // 10 if chunk_overlap is None else chunk_overlap
+    
+    if chunk_size <= 0 or not 0 <= chunk_overlap < chunk_size:
+        raise ValueError("Chunk size must be positive and the overlap smaller than the chunk size")
+    return DocumentChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap, tokenizer=tokenizer)
@@ -0,0 +1,907 @@
+"""
+Vector Index for RAG
+=====================
+Per-session embedding index used by DocumentStore for similarity search
+
+A SessionIndex keeps the chunk metadata table and delegates nearest-neighbour
+search to a backend: exact NumPy search by default, an approximate index
+(HNSW via hnswlib, IVF via faiss-cpu) for very large knowledge bases, or
+quantized codes rescored against the full-precision embeddings. Sessions
+can also index fewer dimensions (Matryoshka truncation or a PCA projection)
+and rescore the candidates at full width.
+"""
+
+import os
+import json
+import time
+import zlib
+from pathlib import Path
+from typing import List, Tuple, Optional, Sequence, Dict, Any
+import numpy as np
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Return a float32 copy of vectors with every row scaled to unit length (zero rows stay zero)"""
+    matrix = np.array(vectors, dtype=np.float32, copy=True, ndmin=2)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def top_k_indices(scores: np.ndarray, top_k: int, similarity_threshold: float) -> np.ndarray:
+    """
+    Select the best scoring positions above a threshold
+    
+    Ties are broken by position, so the order is the same as a stable
+    descending sort over all scores.
+    
+    Args:
+        scores: Similarity score per row
+        top_k: Number of positions to return
+        similarity_threshold: Minimum score to be returned
+    
+    Returns:
+        Row positions ordered from best to worst
+    """
+    candidates = np.flatnonzero(scores >= similarity_threshold)
+    if top_k <= 0 or len(candidates) == 0:
+        return candidates[:0]
+    
+    candidate_scores = scores[candidates]
+    if top_k < len(candidates):
+        # Partial selection, then resolve ties at the k-th score by position
+        partitioned = np.argpartition(-candidate_scores, top_k - 1)[:top_k]
+        kth_score = candidate_scores[partitioned].min()
+        above = np.flatnonzero(candidate_scores > kth_score)
+        ties = np.flatnonzero(candidate_scores == kth_score)[:top_k - len(above)]
+        selected = np.concatenate([above, ties])
+    else:
+        selected = np.arange(len(candidates))
+    
+    order = np.lexsort((selected, -candidate_scores[selected]))
+    return candidates[selected[order]]
+
+
+def _grow_rows(arrays: List[np.ndarray], size: int, needed: int) -> List[np.ndarray]:
+    """Grow row-aligned arrays geometrically so appends stay amortized O(1) per row"""
+    capacity = max(len(arrays[0]), 1)
+    if needed <= capacity:
+        return arrays
+    while capacity < needed:
+        capacity *= 2
+    
+    grown = []
+    for array in arrays:
+        new_array = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+        new_array[:size] = array[:size]
+        grown.append(new_array)
+    return grown
+
+
+def _rank_candidates(labels: np.ndarray, scores: np.ndarray, top_k: int,
+                     similarity_threshold: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Filter approximate candidates by threshold and order them by score, then label"""
+    keep = (labels >= 0) & (scores >= similarity_threshold)
+    labels, scores = labels[keep], scores[keep]
+    order = np.lexsort((labels, -scores))[:top_k]
+    return labels[order], scores[order]
+
+
+class VectorIndexBackend:
+    """
+    Interface for nearest-neighbour backends used by SessionIndex
+    
+    Backends receive unit-length float32 vectors, each identified by an
+    integer label that is unique within the session and increases with
+    insertion order. Scores are inner products (cosine similarity).
+    """
+    
+    name = "base"
+    persistent = False  # Whether the backend state is worth saving to disk
+    
+    def __init__(self, dimensions: int, **options):
+        self.dimensions = dimensions
+    
+    def add(self, labels: np.ndarray, vectors: np.ndarray):
+        """Add normalized vectors under the given labels"""
+        raise NotImplementedError
+    
+    def remove(self, labels: np.ndarray):
+        """Remove vectors by label"""
+        raise NotImplementedError
+    
+    def search(self, query: np.ndarray, top_k: int, similarity_threshold: float,
+               ef_search: Optional[int] = None,
+               nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the best matching labels for a normalized query
+        
+        top_k never exceeds the number of vectors in the index.
+        
+        Returns:
+            (labels, scores) ordered from best to worst
+        """
+        raise NotImplementedError
+    
+    def save(self, path: Path):
+        """Persist the index to a file"""
+        raise NotImplementedError
+    
+    @classmethod
+    def load(cls, path: Path, dimensions: int, **options) -> "VectorIndexBackend":
+        """Load an index previously written by save()"""
+        raise NotImplementedError
+
+
+class ExactBackend(VectorIndexBackend):
+    """Brute-force search over a contiguous float32 matrix (always available)"""
+    
+    name = "exact"
+    
+    def __init__(self, dimensions: int, initial_capacity: int = 256, **options):
+        super().__init__(dimensions)
+        self.size = 0
+        self._matrix = np.empty((initial_capacity, dimensions), dtype=np.float32)
+        self._labels = np.empty(initial_capacity, dtype=np.int64)
+    
+    @property
+    def matrix(self) -> np.ndarray:
+        """Normalized embeddings of all indexed chunks"""
+        return self._matrix[:self.size]
+    
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the indexed vectors"""
+        return self.matrix.nbytes
+    
+    def add(self, labels: np.ndarray, vectors: np.ndarray):
+        needed = self.size + len(labels)
+        self._matrix, self._labels = _grow_rows([self._matrix, self._labels], self.size, needed)
+        self._matrix[self.size:needed] = vectors
+        self._labels[self.size:needed] = labels
+        self.size = needed
+    
+    def remove(self, labels: np.ndarray):
+        keep = ~np.isin(self._labels[:self.size], labels)
+        kept = int(keep.sum())
+        if kept < self.size:
+            self._matrix[:kept] = self.matrix[keep]
+            self._labels[:kept] = self._labels[:self.size][keep]
+            self.size = kept
+    
+    def search(self, query, top_k, similarity_threshold, ef_search=None, nprobe=None):
+        scores = self.matrix @ query
+        rows = top_k_indices(scores, top_k, similarity_threshold)
+        return self._labels[rows], scores[rows]
+
+
+class HNSWBackend(VectorIndexBackend):
+    """Approximate search with an HNSW graph (requires hnswlib)"""
+    
+    name = "hnsw"
+    persistent = True
+    
+    def __init__(self, dimensions: int, M: int = 16, ef_construction: int = 200,
+                 ef_search: int = 64, initial_capacity: int = 1024, **options):
+        super().__init__(dimensions)
+        try:
+            import hnswlib
+        except ImportError:
+            raise ImportError("hnswlib not installed. Install with: pip install hnswlib")
+        
+        self.default_ef = ef_search
+        self.index = hnswlib.Index(space="ip", dim=dimensions)
+        self.index.init_index(max_elements=initial_capacity, ef_construction=ef_construction, M=M)
+    
+    def add(self, labels, vectors):
+        # Deleted elements keep their slot, so capacity follows the total ever added
+        needed = self.index.get_current_count() + len(labels)
+        if needed > self.index.get_max_elements():
+            self.index.resize_index(max(needed, 2 * self.index.get_max_elements()))
+        self.index.add_items(vectors, labels)
+    
+    def remove(self, labels):
+        for label in labels:
+            self.index.mark_deleted(int(label))
+    
+    def search(self, query, top_k, similarity_threshold, ef_search=None, nprobe=None):
+        self.index.set_ef(max(ef_search or self.default_ef, top_k))
+        labels, distances = self.index.knn_query(query, k=top_k)
+        # hnswlib's "ip" space reports 1 - inner product
+        return _rank_candidates(labels[0].astype(np.int64), 1.0 - distances[0],
+                                top_k, similarity_threshold)
+    
+    def save(self, path):
+        self.index.save_index(str(path))
+    
+    @classmethod
+    def load(cls, path, dimensions, **options):
+        backend = cls(dimensions, initial_capacity=1, **options)
+        backend.index.load_index(str(path))
+        return backend
+
+
+class FaissIVFBackend(VectorIndexBackend):
+    """
+    Approximate search with an inverted-file index (requires faiss-cpu)
+    
+    Small sessions are searched exactly; once a session holds train_size
+    vectors the index is trained into IVF lists and searched with nprobe.
+    """
+    
+    name = "faiss"
+    persistent = True
+    
+    def __init__(self, dimensions: int, train_size: int = 10000, nprobe: int = 8, **options):
+        super().__init__(dimensions)
+        try:
+            import faiss
+        except ImportError:
+            raise ImportError("faiss-cpu not installed. Install with: pip install faiss-cpu")
+        
+        self.faiss = faiss
+        self.train_size = train_size
+        self.default_nprobe = nprobe
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dimensions))
+    
+    @property
+    def trained_ivf(self) -> bool:
+        return isinstance(self.index, self.faiss.IndexIVF)
+    
+    def _train(self):
+        """Move the vectors collected so far into a trained IVF index"""
+        faiss = self.faiss
+        labels = faiss.vector_to_array(self.index.id_map).astype(np.int64)
+        vectors = self.index.index.reconstruct_n(0, self.index.ntotal)
+        nlist = max(1, int(4 * np.sqrt(len(labels))))
+        
+        quantizer = faiss.IndexFlatIP(self.dimensions)
+        index = faiss.IndexIVFFlat(quantizer, self.dimensions, nlist, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        index.add_with_ids(vectors, labels)
+        self.index = index
+    
+    def add(self, labels, vectors):
+        self.index.add_with_ids(np.ascontiguousarray(vectors), labels.astype(np.int64))
+        if not self.trained_ivf and self.index.ntotal >= self.train_size:
+            self._train()
+    
+    def remove(self, labels):
+        self.index.remove_ids(np.asarray(labels, dtype=np.int64))
+    
+    def search(self, query, top_k, similarity_threshold, ef_search=None, nprobe=None):
+        if self.trained_ivf:
+            self.index.nprobe = nprobe or self.default_nprobe
+        scores, labels = self.index.search(query.reshape(1, -1), top_k)
+        return _rank_candidates(labels[0], scores[0], top_k, similarity_threshold)
+    
+    def save(self, path):
+        self.faiss.write_index(self.index, str(path))
+    
+    @classmethod
+    def load(cls, path, dimensions, **options):
+        backend = cls(dimensions, **options)
+        backend.index = backend.faiss.read_index(str(path))
+        return backend
+
+
+# Number of set bits in every byte value, for Hamming distances between sign codes
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint16)
+
+QUANTIZATION_MODES = ("float16", "int8", "binary")
+
+# Candidates rescored per requested result; coarser codes need a wider pool
+DEFAULT_RESCORE_FACTORS = {"float16": 2, "int8": 4, "binary": 16}
+
+
+class QuantizedBackend(VectorIndexBackend):
+    """
+    First-pass search over compressed codes
+    
+    Vectors are kept as float16 (half the memory), int8 with a per-vector
+    scale (a quarter) or packed 1-bit sign codes (1/32). Scores are only
+    approximate, so SessionIndex asks for rescore_factor * top_k candidates
+    and rescores them against the full-precision embeddings.
+    """
+    
+    name = "quantized"
+    
+    def __init__(self, dimensions: int, quantization: str = "int8", rescore_factor: Optional[int] = None,
+                 block_rows: int = 8192, initial_capacity: int = 256, **options):
+        super().__init__(dimensions)
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization: {quantization}. Available: {list(QUANTIZATION_MODES)}")
+        
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor or DEFAULT_RESCORE_FACTORS[quantization]
+        self.block_rows = block_rows
+        self.size = 0
+        
+        if quantization == "binary":
+            codes = np.empty((initial_capacity, (dimensions + 7) // 8), dtype=np.uint8)
+        else:
+            codes = np.empty((initial_capacity, dimensions), dtype=np.dtype(quantization))
+        self._codes = codes
+        self._scales = np.empty(initial_capacity, dtype=np.float32)
+        self._labels = np.empty(initial_capacity, dtype=np.int64)
+    
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the codes (and int8 scales)"""
+        scale_bytes = self.size * 4 if self.quantization == "int8" else 0
+        return self._codes[:self.size].nbytes + scale_bytes
+    
+    def _encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Quantize normalized vectors into (codes, scales)"""
+        if self.quantization == "binary":
+            return np.packbits(vectors > 0, axis=1), np.ones(len(vectors), dtype=np.float32)
+        if self.quantization == "float16":
+            return vectors.astype(np.float16), np.ones(len(vectors), dtype=np.float32)
+        
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    
+    def add(self, labels, vectors):
+        needed = self.size + len(labels)
+        self._codes, self._scales, self._labels = _grow_rows(
+            [self._codes, self._scales, self._labels], self.size, needed
+        )
+        codes, scales = self._encode(vectors)
+        self._codes[self.size:needed] = codes
+        self._scales[self.size:needed] = scales
+        self._labels[self.size:needed] = labels
+        self.size = needed
+    
+    def remove(self, labels):
+        keep = ~np.isin(self._labels[:self.size], labels)
+        kept = int(keep.sum())
+        if kept < self.size:
+            self._codes[:kept] = self._codes[:self.size][keep]
+            self._scales[:kept] = self._scales[:self.size][keep]
+            self._labels[:kept] = self._labels[:self.size][keep]
+            self.size = kept
+    
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """Approximate cosine similarity of every stored vector to a normalized query"""
+        scores = np.empty(self.size, dtype=np.float32)
+        if self.quantization == "binary":
+            query_bits = np.packbits(query > 0)
+        
+        # Decode block by block so no full-size float32 copy is ever materialized
+        for start in range(0, self.size, self.block_rows):
+            end = min(start + self.block_rows, self.size)
+            codes = self._codes[start:end]
+            if self.quantization == "binary":
+                # Sign-random-projection estimate: angle ~ pi * hamming / dims
+                hamming = _POPCOUNT[np.bitwise_xor(codes, query_bits)].sum(axis=1)
+                scores[start:end] = np.cos(np.pi * hamming / self.dimensions)
+            else:
+                scores[start:end] = (codes.astype(np.float32) @ query) * self._scales[start:end]
+        return scores
+    
+    def search(self, query, top_k, similarity_threshold, ef_search=None, nprobe=None):
+        scores = self.scores(query)
+        rows = top_k_indices(scores, top_k, similarity_threshold)
+        return self._labels[rows], scores[rows]
+
+
+# Registered backends; optional libraries can plug in with register_backend()
+INDEX_BACKENDS: Dict[str, type] = {
+    "exact": ExactBackend,
+    "hnsw": HNSWBackend,
+    "faiss": FaissIVFBackend,
+    "quantized": QuantizedBackend,
+}
+
+
+def register_backend(name: str, backend_class: type):
+    """Register a VectorIndexBackend implementation under a name"""
+    INDEX_BACKENDS[name] = backend_class
+
+
+def resolve_backend(name: Optional[str]) -> type:
+    """
+    Pick a backend class by name, falling back to exact search
+    
+    "auto" prefers hnswlib, then faiss-cpu, then exact NumPy search.
+    Backends whose optional library is missing fall back to exact search.
+    
+    Raises:
+        ValueError: If the name is neither "auto" nor a registered backend
+    """
+    name = (name or "exact").lower()
+    if name != "auto" and name not in INDEX_BACKENDS:
+        raise ValueError(f"Unknown vector index backend: {name}. Available: {list(INDEX_BACKENDS.keys())}")
+    candidates = ["hnsw", "faiss", "exact"] if name == "auto" else [name, "exact"]
+    
+    for candidate in candidates:
+        backend_class = INDEX_BACKENDS.get(candidate)
+        if backend_class is None:
+            continue
+        try:
+            # Instantiating a 1-d index is the cheapest availability check
+            backend_class(1)
+            return backend_class
+        except ImportError as e:
+            if name != "auto":
+                print(f"Vector index backend '{candidate}' unavailable ({e}), using exact search")
+    
+    raise ValueError(f"No vector index backend available for: {name}")
+
+
+REDUCTION_METHODS = ("truncate", "pca")
+
+
+class DimensionReducer:
+    """
+    Maps full-width embeddings to fewer dimensions before they are indexed
+    
+    "truncate" keeps the leading dimensions, which is only meaningful for
+    Matryoshka-trained models (e.g. OpenAI text-embedding-3). "pca" projects
+    onto the top principal directions of the session's own embeddings. The
+    projection is not centered, so inner products (and with them cosine
+    similarity) are what is preserved. Reduced vectors are renormalized by
+    the index.
+    """
+    
+    def __init__(self, method: str, dimensions: int, components: Optional[np.ndarray] = None,
+                 rescore_factor: int = 4):
+        if method not in REDUCTION_METHODS:
+            raise ValueError(f"Unknown reduction: {method}. Available: {list(REDUCTION_METHODS)}")
+        if dimensions <= 0:
+            raise ValueError("Reduced dimensions must be positive")
+        if method == "pca" and (components is None or components.shape[0] != dimensions):
+            raise ValueError("PCA reduction needs one component per reduced dimension")
+        
+        self.method = method
+        self.dimensions = dimensions
+        self.components = None if components is None else np.asarray(components, dtype=np.float32)
+        self.rescore_factor = rescore_factor
+    
+    @property
+    def name(self) -> str:
+        return f"{self.method}{self.dimensions}"
+    
+    def check_input(self, dimensions: int):
+        """Validate the full embedding width this reducer will be applied to"""
+        if self.dimensions >= dimensions:
+            raise ValueError(f"Cannot reduce {dimensions}-dimensional embeddings to {self.dimensions}")
+        if self.components is not None and self.components.shape[1] != dimensions:
+            raise ValueError(
+                f"PCA projection was fitted on {self.components.shape[1]}-dimensional embeddings, "
+                f"not {dimensions}"
+            )
+    
+    def transform(self, vectors: np.ndarray) -> np.ndarray:
+        """Reduce rows of full-width vectors"""
+        if self.method == "truncate":
+            return vectors[..., :self.dimensions]
+        return vectors @ self.components.T
+    
+    @classmethod
+    def fit_pca(cls, vectors: np.ndarray, dimensions: int, rescore_factor: int = 4,
+                max_samples: int = 20000) -> Tuple["DimensionReducer", float]:
+        """
+        Fit a PCA projection on (a sample of) a session's embeddings
+        
+        Returns:
+            The reducer and the fraction of the embeddings' energy it retains
+        """
+        matrix = normalize_rows(vectors)
+        if len(matrix) > max_samples:
+            matrix = matrix[np.random.default_rng(0).choice(len(matrix), max_samples, replace=False)]
+        if dimensions >= matrix.shape[1] or dimensions > matrix.shape[0]:
+            raise ValueError(
+                f"PCA to {dimensions} dimensions needs at least {dimensions} chunks "
+                f"of more than {dimensions} dimensions"
+            )
+        
+        # Eigenvectors of the (dimensions x dimensions) second-moment matrix: much cheaper than an SVD of the rows
+        energy, vectors = np.linalg.eigh((matrix.T @ matrix).astype(np.float64))
+        energy, vectors = energy[::-1], vectors[:, ::-1]
+        retained = float(energy[:dimensions].sum() / energy.sum()) if energy.sum() > 0 else 1.0
+        return cls("pca", dimensions, vectors[:, :dimensions].T.astype(np.float32), rescore_factor), retained
+
+
+class SessionIndex:
+    """
+    Embedding index for one session
+    
+    Keeps a metadata table of (doc_id, chunk_index, label) in insertion
+    order and delegates the vector search to a VectorIndexBackend.
+    Labels are assigned incrementally, so rows can be found from a label
+    with a binary search even after deletions.
+    
+    Backends with a rescore_factor (quantized codes) return a wider pool of
+    approximate candidates, which are rescored against the full-precision
+    embeddings of the session documents. The same happens when a reducer
+    shrinks the vectors held by the backend.
+    """
+    
+    def __init__(self, backend_class: type = ExactBackend,
+                 backend_options: Optional[Dict[str, Any]] = None,
+                 documents: Optional[Dict[str, Dict[str, Any]]] = None,
+                 reducer: Optional[DimensionReducer] = None):
+        self.backend_class = backend_class
+        self.backend_options = backend_options or {}
+        self.documents = documents  # Full-precision embeddings used for rescoring
+        self.reducer = reducer
+        self.backend: Optional[VectorIndexBackend] = None
+        self.dimensions: Optional[int] = None  # Full embedding width (queries and documents)
+        self.next_label = 0
+        self.size = 0
+        self._doc_ids = np.empty(0, dtype=object)
+        self._chunk_indices = np.empty(0, dtype=np.int64)
+        self._labels = np.empty(0, dtype=np.int64)
+    
+    def __len__(self) -> int:
+        return self.size
+    
+    @property
+    def doc_ids(self) -> np.ndarray:
+        """Document id of each indexed row"""
+        return self._doc_ids[:self.size]
+    
+    @property
+    def chunk_indices(self) -> np.ndarray:
+        """Chunk position (within its document) of each indexed row"""
+        return self._chunk_indices[:self.size]
+    
+    @property
+    def labels(self) -> np.ndarray:
+        """Backend label of each indexed row"""
+        return self._labels[:self.size]
+    
+    def _reserve(self, rows: int):
+        """Grow the metadata table geometrically so appends stay amortized O(1) per row"""
+        needed = self.size + rows
+        if needed <= len(self._labels):
+            return
+        
+        capacity = max(len(self._labels), 256)
+        while capacity < needed:
+            capacity *= 2
+        
+        doc_ids = np.empty(capacity, dtype=object)
+        chunk_indices = np.empty(capacity, dtype=np.int64)
+        labels = np.empty(capacity, dtype=np.int64)
+        doc_ids[:self.size] = self.doc_ids
+        chunk_indices[:self.size] = self.chunk_indices
+        labels[:self.size] = self.labels
+        self._doc_ids, self._chunk_indices, self._labels = doc_ids, chunk_indices, labels
+    
+    def check_dimensions(self, embeddings: Sequence) -> Optional[np.ndarray]:
+        """
+        Validate embeddings against the index dimensionality
+        
+        Returns:
+            Embeddings as a 2-D float32 array, or None if there are none
+        """
+        if embeddings is None or len(embeddings) == 0:
+            return None
+        
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim != 2:
+            raise ValueError("Embeddings must be a list of equally sized vectors")
+        if self.dimensions is not None and vectors.shape[1] != self.dimensions:
+            raise ValueError(
+                f"Embedding dimension {vectors.shape[1]} does not match "
+                f"the {self.dimensions} dimensions already indexed for this session"
+            )
+        return vectors
+    
+    @property
+    def index_dimensions(self) -> Optional[int]:
+        """Width of the vectors held by the backend"""
+        if self.reducer is not None and self.dimensions is not None:
+            return self.reducer.dimensions
+        return self.dimensions
+    
+    def _ensure_backend(self, dimensions: int):
+        if self.backend is None:
+            if self.reducer is not None:
+                try:
+                    self.reducer.check_input(dimensions)
+                except ValueError as e:
+                    print(f"Dimension reduction disabled for this index: {e}")
+                    self.reducer = None
+            self.dimensions = dimensions
+            self.backend = self.backend_class(self.index_dimensions, **self.backend_options)
+    
+    def _reduce(self, vectors: np.ndarray) -> np.ndarray:
+        """Normalized vectors as held by the backend"""
+        if self.reducer is None:
+            return normalize_rows(vectors)
+        return normalize_rows(self.reducer.transform(vectors))
+    
+    def add(self, doc_id: str, embeddings: Sequence, first_label: Optional[int] = None,
+            first_chunk: int = 0):
+        """
+        Append the chunk embeddings of a document
+        
+        Args:
+            doc_id: Document the chunks belong to
+            embeddings: One embedding per chunk
+            first_label: Label of the first chunk when replaying a saved
+                table; the vectors are then assumed to be in the backend already
+            first_chunk: Chunk index of the first embedding, when appending
+                to a document that is already partly indexed
+        """
+        vectors = self.check_dimensions(embeddings)
+        if vectors is None:
+            return
+        
+        rows = len(vectors)
+        start = self.next_label if first_label is None else first_label
+        labels = np.arange(start, start + rows, dtype=np.int64)
+        
+        self._ensure_backend(vectors.shape[1])
+        if first_label is None:
+            self.backend.add(labels, self._reduce(vectors))
+        
+        self._reserve(rows)
+        end = self.size + rows
+        self._doc_ids[self.size:end] = doc_id
+        self._chunk_indices[self.size:end] = np.arange(first_chunk, first_chunk + rows)
+        self._labels[self.size:end] = labels
+        self.size = end
+        self.next_label = max(self.next_label, start + rows)
+    
+    def remove(self, doc_id: str) -> int:
+        """
+        Remove every row belonging to a document, preserving the order of the rest
+        
+        Returns:
+            Number of rows removed
+        """
+        if self.size == 0:
+            return 0
+        
+        keep = self.doc_ids != doc_id
+        kept = int(keep.sum())
+        removed = self.size - kept
+        if removed:
+            self.backend.remove(self.labels[~keep])
+            self._doc_ids[:kept] = self.doc_ids[keep]
+            self._chunk_indices[:kept] = self.chunk_indices[keep]
+            self._labels[:kept] = self.labels[keep]
+            self._doc_ids[kept:self.size] = None
+            self.size = kept
+        return removed
+    
+    def search(self, query_embedding: Sequence, top_k: int = 3,
+               similarity_threshold: float = 0.3, ef_search: Optional[int] = None,
+               nprobe: Optional[int] = None) -> List[Tuple[str, int, float]]:
+        """
+        Find the chunks most similar to a query
+        
+        Args:
+            query_embedding: Query embedding vector
+            top_k: Number of top results to return
+            similarity_threshold: Minimum cosine similarity
+            ef_search: HNSW search breadth (higher = better recall, slower)
+            nprobe: IVF lists probed per query (higher = better recall, slower)
+        
+        Returns:
+            List of (doc_id, chunk_index, similarity), best first
+        """
+        if self.size == 0 or top_k <= 0:
+            return []
+        
+        query = np.asarray(query_embedding, dtype=np.float32).ravel()
+        if query.shape[0] != self.dimensions:
+            raise ValueError(
+                f"Query embedding has {query.shape[0]} dimensions, "
+                f"but this session is indexed with {self.dimensions}"
+            )
+        
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        
+        rescore_factor = max(getattr(self.backend, "rescore_factor", 0),
+                             self.reducer.rescore_factor if self.reducer is not None else 0)
+        rescore = rescore_factor > 0 and self.documents is not None
+        index_query = query if self.reducer is None else self._reduce(query)[0]
+        if rescore:
+            # Approximate scores only pick candidates; the threshold applies after rescoring
+            labels, scores = self.backend.search(
+                index_query, min(top_k * rescore_factor, self.size), -np.inf, ef_search=ef_search, nprobe=nprobe
+            )
+        else:
+            labels, scores = self.backend.search(
+                index_query, min(top_k, self.size), similarity_threshold, ef_search=ef_search, nprobe=nprobe
+            )
+        
+        rows = np.searchsorted(self.labels, labels)
+        found = rows < self.size
+        found[found] = self._labels[rows[found]] == labels[found]
+        rows, labels = rows[found], labels[found]
+        
+        if rescore:
+            labels, scores = _rank_candidates(
+                labels, self.full_precision(rows) @ query, top_k, similarity_threshold
+            )
+            rows = np.searchsorted(self.labels, labels)
+        else:
+            scores = scores[found]
+        
+        return [
+            (self._doc_ids[row], int(self._chunk_indices[row]), float(score))
+            for row, score in zip(rows, scores)
+        ]
+    
+    def full_precision(self, rows: np.ndarray) -> np.ndarray:
+        """Normalized full-precision embeddings of the given rows (read from the mmapped blobs)"""
+        vectors = np.empty((len(rows), self.dimensions), dtype=np.float32)
+        for i, row in enumerate(rows):
+            vectors[i] = self.documents[self._doc_ids[row]]["embeddings"][self._chunk_indices[row]]
+        return normalize_rows(vectors)
+    
+    def save(self, index_file: Path):
+        """
+        Persist an approximate index next to the session data
+        
+        The backend file is accompanied by a small JSON table recording the
+        first label and row count of each document, so the index can be
+        reattached on load. A document appended to in several batches while
+        others were added has one [first label, rows] run per batch. A
+        checksum of each document's embeddings tells a document replaced
+        since the save (even by one of the same length) from the one indexed.
+        """
+        if self.backend is None or not self.backend.persistent:
+            return
+        
+        runs = {}
+        for doc_id, label in zip(self.doc_ids, self.labels):
+            doc_runs = runs.setdefault(doc_id, [])
+            if doc_runs and doc_runs[-1][0] + doc_runs[-1][1] == label:
+                doc_runs[-1][1] += 1
+            else:
+                doc_runs.append([int(label), 1])
+        table = {doc_id: doc_runs[0] if len(doc_runs) == 1 else doc_runs for doc_id, doc_runs in runs.items()}
+        fingerprints = {doc_id: embeddings_fingerprint(chunk_embeddings(self.documents[doc_id]))
+                        for doc_id in runs if doc_id in self.documents}
+        
+        tmp_file = index_file.with_name(index_file.name + ".tmp")
+        self.backend.save(tmp_file)
+        table_file = index_file.with_suffix(".labels")
+        tmp_table = table_file.with_name(table_file.name + ".tmp")
+        with open(tmp_table, 'w') as f:
+            json.dump({
+                "backend": self.backend.name,
+                "reduction": self.reducer.name if self.reducer is not None else None,
+                "dimensions": self.dimensions,
+                "next_label": self.next_label,
+                "documents": table,
+                "fingerprints": fingerprints
+            }, f)
+        os.replace(tmp_file, index_file)
+        os.replace(tmp_table, table_file)
+    
+    @classmethod
+    def load(cls, index_file: Path, documents: Dict[str, Dict[str, Any]],
+             backend_class: type = ExactBackend,
+             backend_options: Optional[Dict[str, Any]] = None,
+             reducer: Optional[DimensionReducer] = None) -> "SessionIndex":
+        """
+        Build the index for a session's documents
+        
+        A persisted approximate index is reattached and brought up to date:
+        documents deleted since it was saved are removed from it and newer
+        documents are added. Without one, the index is built from the stored
+        embeddings.
+        """
+        index = cls(backend_class, backend_options, documents, reducer)
+        table_file = index_file.with_suffix(".labels")
+        
+        if backend_class.persistent and index_file.exists() and table_file.exists():
+            try:
+                with open(table_file, 'r') as f:
+                    table = json.load(f)
+                reduction = reducer.name if reducer is not None else None
+                if table["backend"] == backend_class.name and table.get("reduction") == reduction:
+                    index._reattach(index_file, table, documents)
+                    return index
+            except Exception as e:
+                print(f"Error loading vector index {index_file}, rebuilding: {e}")
+                index = cls(backend_class, backend_options, documents, reducer)
+        
+        for doc_id, doc in documents.items():
+            index.add(doc_id, chunk_embeddings(doc))
+        return index
+    
+    def _reattach(self, index_file: Path, table: Dict[str, Any],
+                  documents: Dict[str, Dict[str, Any]]):
+        """Load a saved backend and reconcile it with the current documents"""
+        self.dimensions = table["dimensions"]
+        self.backend = self.backend_class.load(index_file, self.index_dimensions, **self.backend_options)
+        self.next_label = table["next_label"]
+        
+        attached = set()
+        saved = []  # (first label, doc_id, first chunk, rows) of every run
+        fingerprints = table.get("fingerprints", {})
+        for doc_id, entry in table["documents"].items():
+            runs = entry if isinstance(entry[0], list) else [entry]
+            document = documents.get(doc_id)
+            embeddings = chunk_embeddings(document) if document is not None else []
+            # A replaced document may have as many chunks as the indexed version, so compare contents too
+            if (len(embeddings) == sum(rows for _, rows in runs)
+                    and fingerprints.get(doc_id) == embeddings_fingerprint(embeddings)):
+                first_chunk = 0
+                for first_label, rows in runs:
+                    saved.append((first_label, doc_id, first_chunk, rows))
+                    first_chunk += rows
+                attached.add(doc_id)
+            else:
+                for first_label, rows in runs:
+                    self.backend.remove(np.arange(first_label, first_label + rows, dtype=np.int64))
+        
+        for first_label, doc_id, first_chunk, rows in sorted(saved):
+            embeddings = chunk_embeddings(documents[doc_id])[first_chunk:first_chunk + rows]
+            self.add(doc_id, embeddings, first_label=first_label, first_chunk=first_chunk)
+        
+        # Documents added after the index was saved
+        for doc_id, document in documents.items():
+            if doc_id not in attached:
+                self.add(doc_id, chunk_embeddings(document))
+
+
+def chunk_embeddings(document: Dict[str, Any]):
+    """Embeddings paired with a chunk (extra embeddings are never searched)"""
+    return document.get("embeddings", [])[:len(document.get("chunks", []))]
+
+
+def embeddings_fingerprint(embeddings: Sequence) -> int:
+    """CRC32 of a document's embeddings as float32, to detect a document replaced since an index was saved"""
+    vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+    return zlib.crc32(vectors) if vectors.size else 0
+
+
+def measure_recall(index: SessionIndex, queries: np.ndarray, top_k: int = 10) -> Dict[str, Any]:
+    """
+    Compare a session index against exact search over the same documents
+    
+    Args:
+        index: Index to evaluate (its documents provide the exact baseline)
+        queries: Query embeddings, one per row
+        top_k: Number of results compared per query
+    
+    Returns:
+        Mean recall@k, mean latency of both searches and index memory
+    """
+    exact = SessionIndex()
+    for doc_id, document in (index.documents or {}).items():
+        exact.add(doc_id, chunk_embeddings(document))
+    
+    recalls = []
+    index_seconds = exact_seconds = 0.0
+    for query in np.asarray(queries, dtype=np.float32).reshape(len(queries), -1):
+        started = time.perf_counter()
+        expected = {(doc_id, chunk) for doc_id, chunk, _ in exact.search(query, top_k, -np.inf)}
+        exact_seconds += time.perf_counter() - started
+        
+        started = time.perf_counter()
+        found = {(doc_id, chunk) for doc_id, chunk, _ in index.search(query, top_k, -np.inf)}
+        index_seconds += time.perf_counter() - started
+        
+        if expected:
+            recalls.append(len(expected & found) / len(expected))
+    
+    count = max(len(recalls), 1)
+    return {
+        "backend": index.backend.name if index.backend is not None else None,
+        "quantization": getattr(index.backend, "quantization", None),
+        "reduction": index.reducer.name if index.reducer is not None else None,
+        "dimensions": index.dimensions,
+        "index_dimensions": index.index_dimensions,
+        "top_k": top_k,
+        "queries": len(recalls),
+        "recall": float(np.mean(recalls)) if recalls else 1.0,
+        "index_latency_ms": 1000 * index_seconds / count,
+        "exact_latency_ms": 1000 * exact_seconds / count,
+        "index_bytes": getattr(index.backend, "nbytes", None),
+        "full_precision_bytes": index.size * (index.dimensions or 0) * 4
+    }
@@ -0,0 +1,164 @@
+"""
+Unit tests for DocumentChunker
+Tests that boundary-indexed chunking matches the original character scan,
+and chunking by token budget
+"""
+
+import pytest
+import sys
+import os
+import re
+import random
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../src'))
+
+from document_processor import DocumentChunker
+from tokenization import create_chunker, get_tokenizer, load_tokenizer
+
+
+def reference_chunk_text(text, chunk_size, chunk_overlap):
+    """The original chunker, scanning backwards from each chunk end character by character"""
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = start + chunk_size
+        if end < len(text):
+            for i in range(end, start + chunk_size // 2, -1):
+                if text[i] in '.!?\n':
+                    end = i + 1
+                    break
+            else:
+                for i in range(end, start + chunk_size // 2, -1):
+                    if text[i].isspace():
+                        end = i
+                        break
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        start = end - chunk_overlap
+        if start <= end - chunk_size + chunk_overlap:
+            start = end
+    return chunks
+
+
+def random_text(seed, ascii_only):
+    rng = random.Random(seed)
+    pieces = ["word", "longerword", "x" * 300, ".", "!", "?", "\n", " ", "  ", "\t", "\r\n"]
+    if not ascii_only:
+        pieces += ["\u00a0", "\u3000", "\u2028", "\x1c", "\u3001", "na\u00efve", "\u65e5\u672c", "\U0001F600", "\U0001F600!"]
+    return "".join(rng.choice(pieces) for _ in range(rng.randint(0, 3000)))
+
+
+class TestDocumentChunker:
+    """Test chunk boundaries against the original implementation"""
+    
+    @pytest.mark.parametrize("ascii_only", [True, False])
+    @pytest.mark.parametrize("seed", range(10))
+    def test_matches_reference(self, seed, ascii_only):
+        text = random_text(seed, ascii_only)
+        for chunk_size, chunk_overlap in [(500, 50), (100, 0), (64, 20), (7, 3)]:
+            chunker = DocumentChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+            assert chunker.chunk_text(text) == reference_chunk_text(text, chunk_size, chunk_overlap)
+    
+    def test_short_and_empty_text(self):
+        chunker = DocumentChunker()
+        assert chunker.chunk_text("") == []
+        assert chunker.chunk_text("   ") == []
+        assert chunker.chunk_text(" short text ") == ["short text"]
+    
+    def test_prefers_sentence_over_word_boundary(self):
+        text = "a" * 300 + ". " + "b " * 150 + "c" * 200
+        chunks = DocumentChunker(chunk_size=500, chunk_overlap=0).chunk_text(text)
+        assert chunks[0] == "a" * 300 + "."
+
+
+class WordTokenizer:
+    """One token per run of non-whitespace characters"""
+    
+    name = "words"
+    special_tokens = 0
+    
+    def token_ends(self, text):
+        return np.array([match.end() for match in re.finditer(r"\S+", text)], dtype=np.int64)
+
+
+class TestTokenChunking:
+    """Test chunking by token budget"""
+    
+    @pytest.mark.parametrize("chunk_size,chunk_overlap", [(64, 8), (20, 0), (200, 40)])
+    def test_chunks_fit_budget_and_stream_identically(self, chunk_size, chunk_overlap):
+        text = random_text(3, ascii_only=True) * 5
+        tokenizer = WordTokenizer()
+        chunker = DocumentChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap, tokenizer=tokenizer)
+        chunks = chunker.chunk_text(text)
+        
+        assert chunks and all(len(tokenizer.token_ends(chunk)) <= chunk_size for chunk in chunks)
+        if not chunk_overlap:
+            # Without overlap every non-whitespace character lands in exactly one chunk
+            assert "".join("".join(chunks).split()) == "".join(text.split())
+        
+        stream = chunker.stream()
+        streamed = []
+        for position in range(0, len(text), 333):
+            streamed += stream.feed(text[position:position + 333])
+        assert streamed + stream.close() == chunks
+    
+    def test_overlap_repeats_trailing_tokens(self):
+        text = " ".join(f"w{i}" for i in range(100))
+        chunks = DocumentChunker(chunk_size=30, chunk_overlap=5, tokenizer=WordTokenizer()).chunk_text(text)
+        
+        assert chunks[0].split() == [f"w{i}" for i in range(30)]
+        assert chunks[1].split()[:5] == [f"w{i}" for i in range(25, 30)]
+    
+    def test_fewer_chunks_than_character_mode(self):
+        text = random_text(4, ascii_only=True) * 5
+        by_characters = create_chunker("characters", "local-hash", "hash-384").chunk_text(text)
+        by_tokens = create_chunker("tokens", "local-hash", "hash-384").chunk_text(text)
+        assert len(by_tokens) < len(by_characters) / 2
+
+
+class TestCreateChunker:
+    """Test chunker settings for uploads"""
+    
+    def test_defaults(self):
+        assert create_chunker("characters", "openai", "text-embedding-3-small").config == {
+            "mode": "characters", "chunk_size": 500, "chunk_overlap": 50
+        }
+        config = create_chunker("tokens", "cohere", "embed-english-v3.0").config
+        assert (config["chunk_size"], config["chunk_overlap"]) == (512, 51)
+        # Capped by the model's own limit
+        assert create_chunker("tokens", "onnx", "sentence-transformers/all-MiniLM-L6-v2:int8").chunk_size <= 256
+    
+    def test_approximate_tokens_match_batching_estimate(self):
+        """Test token-mode chunks of non-ASCII text stay within the batching token estimate"""
+        from embedding_service import estimate_tokens
+        text = random_text(5, ascii_only=False) * 3
+        chunker = create_chunker("tokens", "cohere", "embed-english-v3.0")
+        
+        assert get_tokenizer("cohere", "embed-english-v3.0").name == "approximate"
+        assert len(chunker.tokenizer.token_ends("向量 search")) == estimate_tokens("向量 search") == 5
+        assert all(estimate_tokens(chunk) - 1 <= 512 for chunk in chunker.chunk_text(text))
+    
+    def test_tokenizer_load_failure_falls_back(self, monkeypatch):
+        """Test a tokenizer that cannot be fetched (e.g. offline) falls back to the approximation"""
+        import types
+        
+        def from_pretrained(model_id):
+            raise OSError(f"We couldn't connect to the Hub to load {model_id}")
+        
+        transformers = types.ModuleType("transformers")
+        transformers.AutoTokenizer = types.SimpleNamespace(from_pretrained=from_pretrained)
+        monkeypatch.setitem(sys.modules, "transformers", transformers)
+        
+        assert load_tokenizer("huggingface", "sentence-transformers/all-MiniLM-L6-v2").name == "approximate"
+    
+    def test_tokenizer_is_cached_per_model(self):
+        assert get_tokenizer("voyage", "voyage-2") is get_tokenizer("voyage", "voyage-2")
+    
+    @pytest.mark.parametrize("mode,size,overlap", [
+        ("sentences", None, None), ("tokens", 100, 100), ("characters", 0, None), ("tokens", 600, None)
+    ])
+    def test_invalid_settings(self, mode, size, overlap):
+        with pytest.raises(ValueError):
+            create_chunker(mode, "cohere", "embed-english-v3.0", chunk_size=size, chunk_overlap=overlap)
@@ -0,0 +1,585 @@
+"""
+Unit tests for the RAG DocumentStore
+Tests storage, retrieval and similarity search
+"""
+
+import pytest
+import sys
+import os
+import json
+import numpy as np
+
+# Add source directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../src')))
+
+from document_processor import DocumentStore
+from embedding_service import cosine_similarity
+
+
+def make_document(doc_id, embeddings, filename=None):
+    """Build a stored document with one chunk per embedding"""
+    return {
+        "id": doc_id,
+        "filename": filename or f"{doc_id}.txt",
+        "text": " ".join(f"chunk {i}" for i in range(len(embeddings))),
+        "chunks": [f"{doc_id} chunk {i}" for i in range(len(embeddings))],
+        "embeddings": [list(map(float, e)) for e in embeddings],
+        "upload_time": "2024-01-01T00:00:00",
+        "embedding_provider": "test",
+        "embedding_model": "test"
+    }
+
+
+def reference_search(store, session_id, query, top_k, threshold):
+    """Chunk-by-chunk cosine search, as the store originally did it"""
+    results = []
+    for doc_id, doc in store.documents[session_id].items():
+        for i, (chunk, embedding) in enumerate(zip(doc["chunks"], doc["embeddings"])):
+            similarity = cosine_similarity(query, embedding)
+            if similarity >= threshold:
+                results.append((doc_id, i, similarity))
+    results.sort(key=lambda x: x[2], reverse=True)
+    return results[:top_k]
+
+
+class TestDocumentStoreSearch:
+    """Test vectorized similarity search"""
+    
+    @pytest.fixture
+    def store(self, tmp_path):
+        return DocumentStore(storage_dir=str(tmp_path / "rag_storage"))
+    
+    def test_search_empty_session(self, store):
+        """Test searching a session without documents"""
+        assert store.search_chunks("missing", [0.1, 0.2, 0.3]) == []
+    
+    def test_search_matches_reference_ranking(self, store):
+        """Test vectorized search returns the same ranking as per-chunk cosine"""
+        rng = np.random.default_rng(0)
+        for d in range(5):
+            store.add_document("s1", make_document(f"doc{d}", rng.normal(size=(40, 16))))
+        
+        for _ in range(10):
+            query = rng.normal(size=16).tolist()
+            expected = reference_search(store, "s1", query, top_k=7, threshold=0.1)
+            actual = store.search_chunks("s1", query, top_k=7, similarity_threshold=0.1)
+            assert [(r["doc_id"], r["chunk_index"]) for r in actual] == [e[:2] for e in expected]
+            for r, e in zip(actual, expected):
+                assert r["similarity"] == pytest.approx(e[2], abs=1e-5)
+    
+    def test_search_threshold_filters_results(self, store):
+        """Test chunks below the similarity threshold are excluded"""
+        store.add_document("s1", make_document("doc", [[1, 0], [0, 1], [1, 1]]))
+        results = store.search_chunks("s1", [1, 0], top_k=10, similarity_threshold=0.5)
+        assert [r["chunk_index"] for r in results] == [0, 2]
+        assert results[0]["chunk"] == "doc chunk 0"
+        assert results[0]["document"] == "doc.txt"
+    
+    def test_search_ties_keep_insertion_order(self, store):
+        """Test equal scores are returned in document and chunk order"""
+        store.add_document("s1", make_document("a", [[1, 0], [2, 0]]))
+        store.add_document("s1", make_document("b", [[3, 0]]))
+        results = store.search_chunks("s1", [1, 0], top_k=2, similarity_threshold=0.0)
+        assert [(r["doc_id"], r["chunk_index"]) for r in results] == [("a", 0), ("a", 1)]
+    
+    def test_index_follows_add_and_delete(self, store):
+        """Test the session index is updated incrementally"""
+        store.add_document("s1", make_document("a", [[1, 0]]))
+        assert store.search_chunks("s1", [1, 0])[0]["doc_id"] == "a"
+        
+        store.add_document("s1", make_document("b", [[0, 1]]))
+        assert store.search_chunks("s1", [0, 1])[0]["doc_id"] == "b"
+        
+        store.delete_document("s1", "a")
+        assert store.search_chunks("s1", [1, 0]) == []
+        assert len(store.indexes["s1"]) == 1
+    
+    def test_dimension_mismatch_rejected(self, store):
+        """Test a document with a different embedding size does not corrupt the session"""
+        store.add_document("s1", make_document("a", [[1, 0]]))
+        store.search_chunks("s1", [1, 0])
+        
+        with pytest.raises(ValueError):
+            store.add_document("s1", make_document("b", [[1, 0, 0]]))
+        assert store.get_document("s1", "b") is None
+        assert len(store.search_chunks("s1", [1, 0])) == 1
+    
+    def test_reload_from_disk(self, store, tmp_path):
+        """Test documents saved to disk are searchable after a restart"""
+        store.add_document("s1", make_document("a", [[1, 0], [0, 1]]))
+        
+        reloaded = DocumentStore(storage_dir=str(tmp_path / "rag_storage"))
+        results = reloaded.search_chunks("s1", [0, 1])
+        assert [(r["doc_id"], r["chunk_index"]) for r in results] == [("a", 1)]
+
+
+class TestDocumentStorePersistence:
+    """Test binary, memory-mapped session storage"""
+    
+    def test_embeddings_memory_mapped_on_load(self, tmp_path):
+        """Test reloaded embeddings are float32 views of a mapped blob"""
+        store = DocumentStore(storage_dir=str(tmp_path))
+        store.add_document("s1", make_document("a", [[1, 0, 0], [0, 1, 0]]))
+        store.add_document("s1", make_document("b", [[0, 0, 1]]))
+        store.storages["s1"].compact(store.documents["s1"])
+        
+        reloaded = DocumentStore(storage_dir=str(tmp_path))
+        embeddings = reloaded.get_document("s1", "b")["embeddings"]
+        assert isinstance(embeddings.base, np.memmap) or isinstance(embeddings, np.memmap)
+        assert embeddings.dtype == np.float32
+        np.testing.assert_array_equal(embeddings, [[0, 0, 1]])
+        assert reloaded.get_document("s1", "a")["chunks"] == ["a chunk 0", "a chunk 1"]
+    
+    def test_legacy_json_session_migrated(self, tmp_path):
+        """Test a JSON session with float lists is converted on first load"""
+        legacy = {"a": make_document("a", [[0.5, 0.5], [1.0, 0.0]])}
+        with open(tmp_path / "old.json", 'w') as f:
+            json.dump(legacy, f)
+        
+        store = DocumentStore(storage_dir=str(tmp_path))
+        results = store.search_chunks("old", [1.0, 0.0], top_k=1)
+        assert (results[0]["doc_id"], results[0]["chunk_index"]) == ("a", 1)
+        assert not (tmp_path / "old.json").exists()
+        assert list((tmp_path / "old").glob("snapshot.*.npy"))
+        
+        reloaded = DocumentStore(storage_dir=str(tmp_path))
+        assert reloaded.list_documents("old")[0]["chunk_count"] == 2
+    
+    def test_interrupted_snapshot_ignored(self, tmp_path):
+        """Test a half-written snapshot does not replace the committed one"""
+        store = DocumentStore(storage_dir=str(tmp_path))
+        store.add_document("s1", make_document("a", [[1, 0]]))
+        (tmp_path / "s1" / "snapshot.99.2.npy.tmp").write_bytes(b"partial")
+        
+        reloaded = DocumentStore(storage_dir=str(tmp_path))
+        assert reloaded.get_document("s1", "a") is not None
+    
+    def test_add_appends_only_new_document(self, tmp_path):
+        """Test adding a document writes only its own record to the session log"""
+        store = DocumentStore(storage_dir=str(tmp_path))
+        store.add_document("s1", make_document("a", np.ones((50, 8))))
+        log_file = tmp_path / "s1" / "wal.0.log"
+        size_after_first = log_file.stat().st_size
+        
+        store.add_document("s1", make_document("b", np.ones((1, 8))))
+        assert log_file.stat().st_size - size_after_first < size_after_first
+        assert not list((tmp_path / "s1").glob("snapshot.*"))
+        
+        store.delete_document("s1", "a")
+        reloaded = DocumentStore(storage_dir=str(tmp_path))
+        assert [d["id"] for d in reloaded.list_documents("s1")] == ["b"]
+    
+    def test_torn_log_tail_discarded(self, tmp_path):
+        """Test a partially written log record is detected and truncated"""
+        store = DocumentStore(storage_dir=str(tmp_path))
+        store.add_document("s1", make_document("a", [[1, 0]]))
+        log_file = tmp_path / "s1" / "wal.0.log"
+        good_size = log_file.stat().st_size
+        
+        store.add_document("s1", make_document("b", [[0, 1]]))
+        with open(log_file, 'rb+') as f:
+            f.truncate(log_file.stat().st_size - 3)
+        
+        reloaded = DocumentStore(storage_dir=str(tmp_path))
+        assert [d["id"] for d in reloaded.list_documents("s1")] == ["a"]
+        assert log_file.stat().st_size == good_size
+    
+    def test_corrupt_log_record_discarded(self, tmp_path):
+        """Test a record failing its checksum ends replay"""
+        store = DocumentStore(storage_dir=str(tmp_path))
+        store.add_document("s1", make_document("a", [[1, 0]]))
+        store.add_document("s1", make_document("b", [[0, 1]]))
+        log_file = tmp_path / "s1" / "wal.0.log"
+        data = bytearray(log_file.read_bytes())
+        data[-1] ^= 0xFF
+        log_file.write_bytes(bytes(data))
+        
+        reloaded = DocumentStore(storage_dir=str(tmp_path))
+        assert [d["id"] for d in reloaded.list_documents("s1")] == ["a"]
+    
+    def test_log_compacted_into_snapshot(self, tmp_path):
+        """Test a large log is folded into a snapshot in the background"""
+        store = DocumentStore(storage_dir=str(tmp_path), compaction_min_bytes=1024)
+        for i in range(10):
+            store.add_document("s1", make_document(f"d{i}", np.full((20, 8), i + 1.0)))
+        store.delete_document("s1", "d3")
+        store.wait_for_compaction()
+        
+        session_dir = tmp_path / "s1"
+        assert list(session_dir.glob("snapshot.*.json"))
+        assert len(list(session_dir.glob("wal.*.log"))) <= 2
+        
+        reloaded = DocumentStore(storage_dir=str(tmp_path))
+        ids = [d["id"] for d in reloaded.list_documents("s1")]
+        assert ids == [f"d{i}" for i in range(10) if i != 3]
+        np.testing.assert_array_equal(reloaded.get_document("s1", "d9")["embeddings"][0], np.full(8, 10.0))
+    
+    def test_clear_session_removes_files(self, tmp_path):
+        """Test clearing a session deletes its directory"""
+        store = DocumentStore(storage_dir=str(tmp_path))
+        store.add_document("s1", make_document("a", [[1, 0]]))
+        store.clear_session("s1")
+        assert not (tmp_path / "s1").exists()
+        assert DocumentStore(storage_dir=str(tmp_path)).list_documents("s1") == []
+    
+    @pytest.mark.parametrize("session_id", ["..", ".", "../outside", "a/b", "s1\n", ""])
+    def test_unsafe_session_ids_rejected(self, tmp_path, session_id):
+        """Test session ids that could escape the storage directory never reach the filesystem"""
+        storage_dir = tmp_path / "rag_storage"
+        store = DocumentStore(storage_dir=str(storage_dir))
+        store.add_document("s1", make_document("a", [[1, 0]]))
+        (tmp_path / "keep.txt").write_text("outside the storage directory")
+        before = sorted(str(path) for path in tmp_path.rglob("*"))
+        
+        for operation in (store.clear_session, store.list_documents,
+                          lambda sid: store.add_document(sid, make_document("b", [[0, 1]])),
+                          lambda sid: store.delete_document(sid, "a")):
+            with pytest.raises(ValueError):
+                operation(session_id)
+        
+        assert sorted(str(path) for path in tmp_path.rglob("*")) == before
+        assert store.list_documents("s1")[0]["id"] == "a"
+
+
+class TestSessionCache:
+    """Test lazy session loading and LRU eviction"""
+    
+    def test_sessions_loaded_on_demand(self, tmp_path):
+        """Test opening a store does not load any session"""
+        store = DocumentStore(storage_dir=str(tmp_path))
+        store.add_document("s1", make_document("a", [[1, 0]]))
+        store.add_document("s2", make_document("b", [[0, 1]]))
+        
+        reloaded = DocumentStore(storage_dir=str(tmp_path))
+        assert len(reloaded.documents) == 0
+        assert reloaded.get_document("s2", "b") is not None
+        assert list(reloaded.documents) == ["s2"]
+        assert reloaded.cache_stats()["misses"] == 1
+    
+    def test_unknown_session_not_cached(self, tmp_path):
+        """Test looking up a missing session leaves nothing behind"""
+        store = DocumentStore(storage_dir=str(tmp_path))
+        assert store.list_documents("missing") == []
+        assert store.search_chunks("missing", [1, 0]) == []
+        assert "missing" not in store.documents
+        assert not (tmp_path / "missing").exists()
+    
+    def test_least_recently_used_session_evicted(self, tmp_path):
+        """Test the session cache stays within max_sessions"""
+        store = DocumentStore(storage_dir=str(tmp_path), max_sessions=2)
+        for session_id in ("s1", "s2"):
+            store.add_document(session_id, make_document("a", [[1, 0]]))
+        store.get_document("s1", "a")
+        store.add_document("s3", make_document("a", [[0, 1]]))
+        
+        assert list(store.documents) == ["s1", "s3"]
+        assert "s2" not in store.indexes
+        assert store.cache_stats()["evictions"] == 1
+        
+        # Evicted sessions reload transparently
+        results = store.search_chunks("s2", [1, 0], top_k=1)
+        assert results[0]["doc_id"] == "a"
+        assert "s2" in store.documents
+    
+    def test_byte_budget_evicts(self, tmp_path):
+        """Test the session cache stays within max_bytes"""
+        store = DocumentStore(storage_dir=str(tmp_path), max_bytes=3000)
+        for i in range(3):
+            store.add_document(f"s{i}", make_document("a", np.ones((20, 8))))
+        
+        stats = store.cache_stats()
+        assert stats["sessions"] < 3
+        assert stats["bytes"] <= 3000
+        assert store.get_document("s0", "a") is not None
+    
+    def test_delete_and_clear_unloaded_session(self, tmp_path):
+        """Test deleting from and clearing sessions that are not in memory"""
+        store = DocumentStore(storage_dir=str(tmp_path))
+        store.add_document("s1", make_document("a", [[1, 0]]))
+        store.add_document("s1", make_document("b", [[0, 1]]))
+        store.add_document("s2", make_document("c", [[0, 1]]))
+        
+        reloaded = DocumentStore(storage_dir=str(tmp_path))
+        assert reloaded.delete_document("s1", "a")
+        reloaded.clear_session("s2")
+        assert not (tmp_path / "s2").exists()
+        
+        again = DocumentStore(storage_dir=str(tmp_path))
+        assert [d["id"] for d in again.list_documents("s1")] == ["b"]
+
+
+class TestVectorIndexBackends:
+    """Test approximate nearest-neighbour backends"""
+    
+    @pytest.mark.parametrize("backend", ["hnsw", "faiss"])
+    def test_approximate_backend_finds_exact_match(self, tmp_path, backend):
+        """Test approximate backends return the nearest chunk"""
+        pytest.importorskip("hnswlib" if backend == "hnsw" else "faiss")
+        store = DocumentStore(storage_dir=str(tmp_path), index_backend=backend,
+                              index_options={"train_size": 200})
+        rng = np.random.default_rng(1)
+        vectors = rng.normal(size=(300, 32))
+        store.add_document("s1", make_document("a", vectors[:150]))
+        store.add_document("s1", make_document("b", vectors[150:]))
+        
+        results = store.search_chunks("s1", vectors[200].tolist(), top_k=3,
+                                      ef_search=100, nprobe=16)
+        assert (results[0]["doc_id"], results[0]["chunk_index"]) == ("b", 50)
+        assert results[0]["similarity"] == pytest.approx(1.0, abs=1e-4)
+        
+        store.delete_document("s1", "b")
+        results = store.search_chunks("s1", vectors[200].tolist(), top_k=3)
+        assert all(r["doc_id"] == "a" for r in results)
+    
+    def test_hnsw_index_persisted_next_to_session(self, tmp_path):
+        """Test a saved HNSW index is reused after a restart"""
+        pytest.importorskip("hnswlib")
+        store = DocumentStore(storage_dir=str(tmp_path), index_backend="hnsw",
+                              compaction_min_bytes=0)
+        store.add_document("s1", make_document("a", [[1, 0, 0], [0, 1, 0]]))
+        store.wait_for_compaction()
+        assert (tmp_path / "s1" / "hnsw.index").exists()
+        
+        # Changes logged after the index was saved are reconciled on load
+        store.storages["s1"].compaction_min_bytes = 1 << 30
+        store.add_document("s1", make_document("b", [[0, 0, 1]]))
+        store.delete_document("s1", "a")
+        
+        reloaded = DocumentStore(storage_dir=str(tmp_path), index_backend="hnsw")
+        results = reloaded.search_chunks("s1", [0, 1, 0], top_k=1, similarity_threshold=-1)
+        assert [r["doc_id"] for r in results] == ["b"]
+    
+    def test_index_saved_after_writes_and_on_shutdown(self, tmp_path):
+        """Test a resident session's index is saved without eviction or compaction"""
+        pytest.importorskip("hnswlib")
+        store = DocumentStore(storage_dir=str(tmp_path / "debounced"), index_backend="hnsw")
+        store.add_document("s1", make_document("a", [[1, 0, 0], [0, 1, 0]]))
+        assert not (tmp_path / "debounced" / "s1" / "hnsw.index").exists()
+        store.save_indexes()
+        assert (tmp_path / "debounced" / "s1" / "hnsw.index").exists()
+        
+        store = DocumentStore(storage_dir=str(tmp_path / "eager"), index_backend="hnsw", index_save_delay=0)
+        store.add_document("s1", make_document("a", [[1, 0, 0], [0, 1, 0]]))
+        assert (tmp_path / "eager" / "s1" / "hnsw.index").exists()
+    
+    def test_replaced_document_not_reattached_from_saved_index(self, tmp_path):
+        """Test a document replaced by one of the same length after the index was saved is re-indexed"""
+        pytest.importorskip("hnswlib")
+        rng = np.random.default_rng(2)
+        old, new = rng.normal(size=(2, 20, 16))
+        store = DocumentStore(storage_dir=str(tmp_path), index_backend="hnsw", compaction_min_bytes=0)
+        store.add_document("s1", make_document("a", old))
+        store.wait_for_compaction()
+        assert (tmp_path / "s1" / "hnsw.index").exists()
+        
+        store.storages["s1"].compaction_min_bytes = 1 << 30
+        store.add_document("s1", make_document("a", new))
+        
+        reloaded = DocumentStore(storage_dir=str(tmp_path), index_backend="hnsw")
+        for chunk_index in (0, 7, 19):
+            result = reloaded.search_chunks("s1", new[chunk_index].tolist(), top_k=1)[0]
+            assert result["chunk_index"] == chunk_index
+            assert result["similarity"] == pytest.approx(1.0, abs=1e-4)
+    
+    def test_custom_backend_can_be_registered(self, tmp_path):
+        """Test third-party backends plug in through the registry"""
+        from vector_index import ExactBackend, register_backend, INDEX_BACKENDS
+        
+        class CountingBackend(ExactBackend):
+            name = "counting"
+            searches = 0
+            
+            def search(self, *args, **kwargs):
+                CountingBackend.searches += 1
+                return super().search(*args, **kwargs)
+        
+        register_backend("counting", CountingBackend)
+        try:
+            store = DocumentStore(storage_dir=str(tmp_path), index_backend="counting")
+            store.add_document("s1", make_document("a", [[1, 0]]))
+            assert store.search_chunks("s1", [1, 0])[0]["doc_id"] == "a"
+            assert CountingBackend.searches == 1
+        finally:
+            INDEX_BACKENDS.pop("counting")
+    
+    def test_unknown_backend_rejected(self, tmp_path):
+        """Test a misspelled backend name fails instead of falling back to exact search"""
+        with pytest.raises(ValueError, match="hnws"):
+            DocumentStore(storage_dir=str(tmp_path), index_backend="hnws")
+
+
+class TestQuantization:
+    """Test quantized embedding search with full-precision rescoring"""
+    
+    @pytest.mark.parametrize("quantization", ["float16", "int8", "binary"])
+    def test_rescored_results_match_exact(self, tmp_path, quantization):
+        """Test rescoring returns exact similarities in exact order"""
+        store = DocumentStore(storage_dir=str(tmp_path), quantization=quantization)
+        rng = np.random.default_rng(3)
+        vectors = rng.normal(size=(200, 64))
+        store.add_document("s1", make_document("a", vectors[:100]))
+        store.add_document("s1", make_document("b", vectors[100:]))
+        
+        query = (vectors[120] + 0.1 * rng.normal(size=64)).tolist()
+        results = store.search_chunks("s1", query, top_k=3, similarity_threshold=0.0)
+        expected = reference_search(store, "s1", query, 3, 0.0)
+        assert (results[0]["doc_id"], results[0]["chunk_index"]) == ("b", 20)
+        assert results[0]["similarity"] == pytest.approx(expected[0][2], abs=1e-5)
+        
+        report = store.recall_report("s1", top_k=5, samples=20)
+        assert report["quantization"] == quantization
+        assert report["index_bytes"] < report["full_precision_bytes"]
+        assert report["recall"] >= (0.9 if quantization != "binary" else 0.5)
+    
+    def test_quantization_selected_per_session(self, tmp_path):
+        """Test a session keeps its quantization across restarts"""
+        store = DocumentStore(storage_dir=str(tmp_path))
+        store.add_document("s1", make_document("a", [[1, 0], [0, 1]]))
+        store.add_document("s2", make_document("a", [[1, 0], [0, 1]]))
+        store.set_quantization("s1", "binary")
+        
+        assert store.search_chunks("s1", [1, 0], top_k=1)[0]["chunk_index"] == 0
+        assert store.indexes["s1"].backend.name == "quantized"
+        
+        reloaded = DocumentStore(storage_dir=str(tmp_path))
+        reloaded.search_chunks("s1", [1, 0])
+        reloaded.search_chunks("s2", [1, 0])
+        assert reloaded.indexes["s1"].backend.quantization == "binary"
+        assert reloaded.indexes["s2"].backend.name == "exact"
+        
+        with pytest.raises(ValueError):
+            reloaded.set_quantization("s1", "int4")
+
+
+class TestDimensionReduction:
+    """Test reduced-dimension indexes with full-width rescoring"""
+    
+    def low_rank_vectors(self, rows=300, dimensions=64, rank=12, seed=5):
+        rng = np.random.default_rng(seed)
+        return rng.normal(size=(rows, rank)) @ rng.normal(size=(rank, dimensions)) + 0.01 * rng.normal(
+            size=(rows, dimensions)
+        )
+    
+    def test_pca_matches_exact_search(self, tmp_path):
+        """Test PCA-reduced search returns exact full-width similarities"""
+        store = DocumentStore(storage_dir=str(tmp_path))
+        vectors = self.low_rank_vectors()
+        store.add_document("s1", make_document("a", vectors[:150]))
+        store.add_document("s1", make_document("b", vectors[150:]))
+        
+        summary = store.set_reduction("s1", "pca", 16)
+        assert summary["retained_variance"] > 0.99
+        
+        query = vectors[200].tolist()
+        results = store.search_chunks("s1", query, top_k=3, similarity_threshold=0.0)
+        expected = reference_search(store, "s1", query, 3, 0.0)
+        assert [(r["doc_id"], r["chunk_index"]) for r in results] == [(d, i) for d, i, _ in expected]
+        assert results[0]["similarity"] == pytest.approx(expected[0][2], abs=1e-5)
+        assert store.indexes["s1"].backend.dimensions == 16
+        
+        report = store.recall_report("s1", top_k=5, samples=30)
+        assert report["index_dimensions"] == 16
+        assert report["index_bytes"] * 4 == report["full_precision_bytes"]
+        assert report["recall_delta"] >= -0.05
+        assert report["full_width_recall"] == 1.0
+    
+    def test_reduction_persists_and_applies_to_new_documents(self, tmp_path):
+        """Test the reduction survives a restart and covers later uploads"""
+        store = DocumentStore(storage_dir=str(tmp_path))
+        vectors = self.low_rank_vectors()
+        store.add_document("s1", make_document("a", vectors[:200]))
+        store.set_reduction("s1", "pca", 16)
+        
+        reloaded = DocumentStore(storage_dir=str(tmp_path))
+        reloaded.add_document("s1", make_document("b", vectors[200:]))
+        results = reloaded.search_chunks("s1", vectors[250].tolist(), top_k=1)
+        assert (results[0]["doc_id"], results[0]["chunk_index"]) == ("b", 50)
+        assert reloaded.indexes["s1"].reducer.name == "pca16"
+        
+        reloaded.set_reduction("s1", None)
+        reloaded.search_chunks("s1", vectors[0].tolist())
+        assert reloaded.indexes["s1"].reducer is None
+    
+    def test_truncation(self, tmp_path):
+        """Test Matryoshka truncation keeps the leading dimensions"""
+        store = DocumentStore(storage_dir=str(tmp_path))
+        store.add_document("s1", make_document("a", [[1, 0, 0, 0.5], [0, 1, 0.5, 0]]))
+        store.set_reduction("s1", "truncate", 2)
+        
+        assert store.search_chunks("s1", [0, 1, 0, 0], top_k=1)[0]["chunk_index"] == 1
+        assert store.indexes["s1"].backend.dimensions == 2
+    
+    def test_invalid_reductions_rejected(self, tmp_path):
+        """Test reductions that cannot apply to the session are refused"""
+        store = DocumentStore(storage_dir=str(tmp_path))
+        store.add_document("s1", make_document("a", [[1, 0], [0, 1]]))
+        
+        with pytest.raises(ValueError):
+            store.set_reduction("s1", "truncate", 2)
+        with pytest.raises(ValueError):
+            store.set_reduction("s1", "pca", 8)
+        with pytest.raises(ValueError):
+            store.set_reduction("s1", "svd", 1)
+        with pytest.raises(ValueError):
+            store.set_reduction("empty", "pca", 8)
+    
+    def test_persisted_approximate_index_is_reduced(self, tmp_path):
+        """Test a saved HNSW index is reattached with its reduction"""
+        pytest.importorskip("hnswlib")
+        store = DocumentStore(storage_dir=str(tmp_path), index_backend="hnsw")
+        vectors = self.low_rank_vectors()
+        store.add_document("s1", make_document("a", vectors))
+        store.set_reduction("s1", "pca", 16)
+        store.search_chunks("s1", vectors[0].tolist())
+        store.indexes["s1"].save(store._get_index_file("s1"))
+        
+        reloaded = DocumentStore(storage_dir=str(tmp_path), index_backend="hnsw")
+        results = reloaded.search_chunks("s1", vectors[42].tolist(), top_k=1)
+        assert results[0]["chunk_index"] == 42
+        assert reloaded.indexes["s1"].backend.dimensions == 16
+
+
+class TestHybridSearch:
+    """Test lexical and hybrid retrieval"""
+    
+    def make_store(self, tmp_path):
+        store = DocumentStore(storage_dir=str(tmp_path))
+        code = make_document("code", [[1, 0, 0], [0.9, 0.1, 0]], filename="utils.py")
+        code["chunks"] = ["def load_settings(path): ...", "def save_settings(path): ..."]
+        notes = make_document("notes", [[0, 1, 0], [0, 0, 1]], filename="notes.md")
+        notes["chunks"] = ["settings are loaded at startup", "unrelated text"]
+        store.add_document("s1", code)
+        store.add_document("s1", notes)
+        return store
+    
+    def test_lexical_search_matches_identifiers(self, tmp_path):
+        """Test keyword search finds exact identifiers without embeddings"""
+        store = self.make_store(tmp_path)
+        results = store.search_lexical("s1", "where is load_settings defined?", top_k=2)
+        assert (results[0]["doc_id"], results[0]["chunk_index"]) == ("code", 0)
+        assert results[0]["document"] == "utils.py"
+        assert results[0]["score"] > 0
+    
+    def test_lexical_index_follows_updates(self, tmp_path):
+        """Test the inverted index is maintained on add and delete"""
+        store = self.make_store(tmp_path)
+        store.search_lexical("s1", "settings")
+        
+        store.delete_document("s1", "code")
+        assert all(r["doc_id"] == "notes" for r in store.search_lexical("s1", "settings", top_k=5))
+        
+        replacement = make_document("notes", [[0, 1, 0]])
+        replacement["chunks"] = ["load_settings moved here"]
+        store.add_document("s1", replacement)
+        results = store.search_lexical("s1", "load_settings startup", top_k=5)
+        assert [(r["doc_id"], r["chunk_index"]) for r in results] == [("notes", 0)]
+    
+    def test_hybrid_fuses_both_rankings(self, tmp_path):
+        """Test hybrid search ranks chunks found by both retrievers first"""
+        store = self.make_store(tmp_path)
+        results = store.search_hybrid("s1", "save_settings", [0.9, 0.1, 0], top_k=3,
+                                      similarity_threshold=0.5)
+        assert (results[0]["doc_id"], results[0]["chunk_index"]) == ("code", 1)
+        assert results[0]["similarity"] == pytest.approx(1.0, abs=1e-5)
+        assert results[1]["doc_id"] == "code"
+        assert results[2]["similarity"] is None
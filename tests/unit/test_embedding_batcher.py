@@ -0,0 +1,103 @@
+"""
+Unit tests for embedding micro-batching
+"""
+
+import pytest
+import sys
+import os
+import asyncio
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../src'))
+
+from embedding_batcher import EmbeddingBatcher
+
+
+class FakeEmbedder:
+    """Records batched calls and embeds each text as its length"""
+    
+    def __init__(self, delay=0.0):
+        self.calls = []
+        self.delay = delay
+    
+    async def __call__(self, texts):
+        self.calls.append(list(texts))
+        await asyncio.sleep(self.delay)
+        return np.array([[float(len(text))] for text in texts], dtype=np.float32)
+
+
+class TestEmbeddingBatcher:
+    """Test coalescing, fan-out and metrics"""
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_share_one_call(self):
+        batcher = EmbeddingBatcher(max_wait_ms=20, max_batch_size=64)
+        embedder = FakeEmbedder()
+        
+        texts = ["a", "bb", "ccc", "bb"]
+        results = await asyncio.gather(*(batcher.embed("k", text, embedder) for text in texts))
+        
+        assert len(embedder.calls) == 1
+        assert embedder.calls[0] == ["a", "bb", "ccc"]  # duplicates embedded once
+        assert [float(row[0]) for row in results] == [1.0, 2.0, 3.0, 2.0]
+        stats = batcher.stats()
+        assert stats["requests"] == 4
+        assert stats["batches"] == 1
+        assert stats["timeout_flushes"] == 1
+        assert stats["batch_sizes"] == {3: 1}
+    
+    @pytest.mark.asyncio
+    async def test_full_batch_flushes_without_waiting(self):
+        batcher = EmbeddingBatcher(max_wait_ms=10000, max_batch_size=64)
+        embedder = FakeEmbedder()
+        
+        results = await asyncio.wait_for(
+            asyncio.gather(*(batcher.embed("k", str(i), embedder, max_batch_size=4) for i in range(8))),
+            timeout=1
+        )
+        
+        assert [len(call) for call in embedder.calls] == [4, 4]
+        assert len(results) == 8
+        assert batcher.stats()["full_flushes"] == 2
+        assert batcher.stats()["mean_fill"] == 1.0
+    
+    @pytest.mark.asyncio
+    async def test_keys_are_not_mixed(self):
+        batcher = EmbeddingBatcher(max_wait_ms=10)
+        first, second = FakeEmbedder(), FakeEmbedder()
+        
+        await asyncio.gather(
+            batcher.embed("tenant-a", "x", first),
+            batcher.embed("tenant-b", "y", second),
+            batcher.embed("tenant-a", "z", first)
+        )
+        
+        assert first.calls == [["x", "z"]]
+        assert second.calls == [["y"]]
+    
+    @pytest.mark.asyncio
+    async def test_errors_reach_every_waiter(self):
+        batcher = EmbeddingBatcher(max_wait_ms=5)
+        
+        async def failing(texts):
+            raise Exception("provider down")
+        
+        results = await asyncio.gather(
+            batcher.embed("k", "a", failing), batcher.embed("k", "b", failing), return_exceptions=True
+        )
+        
+        assert all(str(result) == "provider down" for result in results)
+        
+        # The batcher recovers for later requests
+        embedder = FakeEmbedder()
+        assert float((await batcher.embed("k", "abc", embedder))[0]) == 3.0
+    
+    @pytest.mark.asyncio
+    async def test_zero_wait_disables_batching(self):
+        batcher = EmbeddingBatcher(max_wait_ms=0)
+        embedder = FakeEmbedder()
+        
+        await asyncio.gather(batcher.embed("k", "a", embedder), batcher.embed("k", "b", embedder))
+        
+        assert embedder.calls == [["a"], ["b"]]
+        assert batcher.stats()["batches"] == 2
@@ -0,0 +1,136 @@
+"""
+Unit tests for the embedding caches
+"""
+
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../src'))
+
+from embedding_cache import QueryEmbeddingCache, ChunkEmbeddingCache, normalize_query
+from embedding_service import EmbeddingClient
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+    
+    def __call__(self):
+        return self.now
+
+
+class TestQueryEmbeddingCache:
+    """Test the query embedding LRU/TTL cache"""
+    
+    def test_hit_after_put(self):
+        """Test a stored embedding is returned for an equivalent query"""
+        cache = QueryEmbeddingCache(max_entries=10, ttl_seconds=60)
+        cache.put(cache.make_key("openai", "m", "key", "What is  RAG?"), [0.1, 0.2])
+        cached = cache.get(cache.make_key("openai", "m", "key", " What is RAG? "))
+        assert cached.tolist() == pytest.approx([0.1, 0.2])
+        assert not cached.flags.writeable
+        assert cache.stats()["hits"] == 1
+    
+    def test_entries_isolated_per_key_and_model(self):
+        """Test different API keys, providers or models never share entries"""
+        cache = QueryEmbeddingCache(max_entries=10, ttl_seconds=60)
+        cache.put(cache.make_key("openai", "m", "tenant-a", "q"), [1.0])
+        assert cache.get(cache.make_key("openai", "m", "tenant-b", "q")) is None
+        assert cache.get(cache.make_key("openai", "other", "tenant-a", "q")) is None
+        assert cache.get(cache.make_key("cohere", "m", "tenant-a", "q")) is None
+        assert "tenant-a" not in repr(cache._entries)
+    
+    def test_ttl_expiry(self):
+        """Test entries expire after the time-to-live"""
+        clock = FakeClock()
+        cache = QueryEmbeddingCache(max_entries=10, ttl_seconds=5, clock=clock)
+        key = cache.make_key("openai", "m", "k", "q")
+        cache.put(key, [1.0])
+        clock.now = 4.9
+        assert cache.get(key) == [1.0]
+        clock.now = 5.0
+        assert cache.get(key) is None
+        assert cache.stats()["expirations"] == 1
+    
+    def test_lru_eviction(self):
+        """Test the least recently used entry is evicted when full"""
+        cache = QueryEmbeddingCache(max_entries=2, ttl_seconds=60)
+        keys = [cache.make_key("openai", "m", "k", q) for q in ("a", "b", "c")]
+        cache.put(keys[0], [0.0])
+        cache.put(keys[1], [1.0])
+        cache.get(keys[0])
+        cache.put(keys[2], [2.0])
+        assert cache.get(keys[1]) is None
+        assert cache.get(keys[0]) == [0.0]
+        assert cache.stats()["evictions"] == 1
+    
+    def test_normalize_query(self):
+        """Test whitespace and Unicode forms are canonicalized"""
+        assert normalize_query("  café\n menu ") == "café menu"
+
+
+class TestEmbeddingClientQueryCache:
+    """Test EmbeddingClient.embed_query goes through the cache"""
+    
+    def test_repeated_query_calls_provider_once(self):
+        """Test a repeated query is served from the cache"""
+        cache = QueryEmbeddingCache(max_entries=10, ttl_seconds=60)
+        client = EmbeddingClient("openai", api_key="k1", query_cache=cache)
+        calls = []
+        client._embed_openai = lambda texts: calls.append(texts) or [[float(len(calls))]]
+        
+        assert client.embed_query("hello") == [1.0]
+        assert client.embed_query("hello ") == [1.0]
+        assert len(calls) == 1
+        
+        other_tenant = EmbeddingClient("openai", api_key="k2", query_cache=cache)
+        other_tenant._embed_openai = client._embed_openai
+        assert other_tenant.embed_query("hello") == [2.0]
+
+
+class TestChunkEmbeddingCache:
+    """Test the persistent content-addressed chunk cache"""
+    
+    def test_round_trip_and_persistence(self, tmp_path):
+        """Test embeddings survive reopening the cache"""
+        cache = ChunkEmbeddingCache(str(tmp_path / "cache.db"))
+        key = cache.make_key("openai", "m", "chunk text")
+        cache.put_many([(key, [0.5, -1.0])])
+        cache.close()
+        
+        reopened = ChunkEmbeddingCache(str(tmp_path / "cache.db"))
+        assert reopened.get_many([key])[key].tolist() == [0.5, -1.0]
+        assert reopened.get_many([reopened.make_key("openai", "other", "chunk text")]) == {}
+        assert reopened.stats()["entries"] == 1
+    
+    def test_lru_eviction_by_size(self, tmp_path):
+        """Test least recently used entries are evicted past the byte cap"""
+        clock = FakeClock()
+        cache = ChunkEmbeddingCache(str(tmp_path / "cache.db"), max_bytes=4 * 4 * 3, clock=clock)
+        keys = [cache.make_key("p", "m", str(i)) for i in range(4)]
+        for i, key in enumerate(keys[:3]):
+            clock.now = i
+            cache.put_many([(key, [float(i)] * 4)])
+        clock.now = 10
+        cache.get_many([keys[0]])
+        
+        clock.now = 11
+        cache.put_many([(keys[3], [3.0] * 4)])
+        assert set(cache.get_many(keys)) == {keys[0], keys[3]}
+        assert cache.stats()["bytes"] <= 4 * 4 * 3
+    
+    def test_client_embeds_only_misses(self, tmp_path):
+        """Test embed_texts sends only uncached texts and keeps the input order"""
+        cache = ChunkEmbeddingCache(str(tmp_path / "cache.db"))
+        client = EmbeddingClient("openai", api_key="k", chunk_cache=cache)
+        sent = []
+        
+        def fake_provider(texts):
+            sent.append(list(texts))
+            return [[float(len(text))] for text in texts]
+        
+        client._embed_openai = fake_provider
+        assert client.embed_texts(["a", "bb", "a"]) == [[1.0], [2.0], [1.0]]
+        assert client.embed_texts(["ccc", "bb", "a"]) == [[3.0], [2.0], [1.0]]
+        assert sent == [["a", "bb"], ["ccc"]]
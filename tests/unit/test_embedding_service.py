@@ -0,0 +1,247 @@
+"""
+Unit tests for embedding batching
+"""
+
+import pytest
+import sys
+import os
+import time
+import threading
+import asyncio
+import base64
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../src'))
+
+from embedding_service import EmbeddingClient, make_batches, estimate_tokens
+from embedding_cache import ChunkEmbeddingCache
+
+
+class TestMakeBatches:
+    """Test splitting inputs to provider limits"""
+    
+    def test_split_by_count(self):
+        """Test batches never exceed the maximum batch size"""
+        assert make_batches(["a"] * 5, max_batch_size=2) == [(0, 2), (2, 4), (4, 5)]
+    
+    def test_split_by_tokens(self):
+        """Test batches stay within the token budget"""
+        texts = ["x" * 30] * 5  # 11 estimated tokens each
+        assert estimate_tokens(texts[0]) == 11
+        assert make_batches(texts, max_batch_size=100, max_batch_tokens=25) == [(0, 2), (2, 4), (4, 5)]
+    
+    def test_non_ascii_text_counted_per_character(self):
+        """Test a full batch of CJK chunks is split before it exceeds OpenAI's token limit"""
+        texts = ["向量检索增强生成" * 19] * 2048  # 152 characters, at least as many tokens
+        assert estimate_tokens(texts[0]) == 153
+        
+        batches = make_batches(texts, max_batch_size=2048, max_batch_tokens=300000)
+        assert len(batches) == 2
+        assert all(sum(len(text) for text in texts[start:end]) <= 300000 for start, end in batches)
+    
+    def test_model_tokenizer_used_when_available(self, monkeypatch):
+        """Test OpenAI batches are sized with the model's own token counts"""
+        import tokenization
+        
+        class CharacterTokenizer:
+            special_tokens = 0
+            
+            def token_ends(self, text):
+                return list(range(1, len(text) + 1))
+        
+        monkeypatch.setattr(tokenization, "get_tokenizer", lambda provider, model: CharacterTokenizer())
+        client = EmbeddingClient("openai", api_key="k")
+        assert client.count_tokens("x" * 30) == 30
+        assert EmbeddingClient("cohere", api_key="k").count_tokens("x" * 30) == estimate_tokens("x" * 30)
+    
+    def test_oversized_text_gets_own_batch(self):
+        """Test a text above the token budget is still sent, alone"""
+        texts = ["a", "x" * 400, "b"]
+        assert make_batches(texts, max_batch_size=10, max_batch_tokens=20) == [(0, 1), (1, 2), (2, 3)]
+    
+    def test_empty(self):
+        assert make_batches([], max_batch_size=10) == []
+
+
+class TestBatchedEmbedding:
+    """Test EmbeddingClient dispatches batches and reassembles results"""
+    
+    def make_client(self, tmp_path, provider="cohere", concurrency=4):
+        return EmbeddingClient(provider, api_key="k", max_concurrency=concurrency,
+                               chunk_cache=ChunkEmbeddingCache(str(tmp_path / "cache.db")))
+    
+    def test_large_document_uses_few_requests(self, tmp_path):
+        """Test 500 chunks go out in provider-sized batches, results in order"""
+        client = self.make_client(tmp_path)
+        batch_sizes = []
+        lock = threading.Lock()
+        
+        def fake_cohere(texts):
+            with lock:
+                batch_sizes.append(len(texts))
+            time.sleep(0.01 * (len(batch_sizes) % 3))
+            return [[float(text)] for text in texts]
+        
+        client._embed_cohere = fake_cohere
+        texts = [str(i) for i in range(500)]
+        embeddings = client.embed_texts(texts)
+        assert embeddings == [[float(i)] for i in range(500)]
+        assert sorted(batch_sizes) == [20, 96, 96, 96, 96, 96]
+    
+    def test_concurrency_bounded(self, tmp_path):
+        """Test no more than max_concurrency batches are in flight"""
+        client = self.make_client(tmp_path, concurrency=2)
+        active = []
+        peak = []
+        lock = threading.Lock()
+        
+        def fake_cohere(texts):
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            time.sleep(0.02)
+            with lock:
+                active.pop()
+            return [[0.0] for _ in texts]
+        
+        client._embed_cohere = fake_cohere
+        client.embed_texts([str(i) for i in range(96 * 5)])
+        assert max(peak) == 2
+    
+    def test_wrong_count_raises(self, tmp_path):
+        """Test a provider returning too few embeddings is an error"""
+        client = self.make_client(tmp_path)
+        client._embed_cohere = lambda texts: [[0.0]]
+        with pytest.raises(Exception):
+            client.embed_texts(["a", "b"])
+
+
+class TestAsyncEmbedding:
+    """Test the async embedding API"""
+    
+    @pytest.mark.asyncio
+    async def test_aembed_texts_batches_concurrently(self, tmp_path):
+        """Test async batches overlap and results keep input order"""
+        client = EmbeddingClient("cohere", api_key="k", max_concurrency=3,
+                                 chunk_cache=ChunkEmbeddingCache(str(tmp_path / "cache.db")))
+        in_flight = []
+        peak = []
+        
+        async def fake_cohere(texts):
+            in_flight.append(1)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.pop()
+            return [[float(text)] for text in texts]
+        
+        client._aembed_cohere = fake_cohere
+        embeddings = await client.aembed_texts([str(i) for i in range(96 * 5)])
+        assert embeddings == [[float(i)] for i in range(96 * 5)]
+        assert max(peak) == 3
+        
+        # Served from the chunk cache the second time
+        client._aembed_cohere = None
+        assert await client.aembed_texts(["7", "3"]) == [[7.0], [3.0]]
+    
+    @pytest.mark.asyncio
+    async def test_aembed_query_uses_query_cache(self, tmp_path):
+        """Test async query embedding shares the query cache"""
+        from embedding_cache import QueryEmbeddingCache
+        client = EmbeddingClient("openai", api_key="k", query_cache=QueryEmbeddingCache(10, 60),
+                                 chunk_cache=ChunkEmbeddingCache(str(tmp_path / "cache.db")))
+        calls = []
+        
+        async def fake_openai(texts):
+            calls.append(texts)
+            return [[1.0, 2.0]]
+        
+        client._aembed_openai = fake_openai
+        assert await client.aembed_query("hi") == [1.0, 2.0]
+        assert client.embed_query("hi") == [1.0, 2.0]
+        assert len(calls) == 1
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_queries_are_batched(self, tmp_path):
+        """Test concurrent chat queries for one provider/model/key share a call"""
+        from embedding_cache import QueryEmbeddingCache
+        from embedding_batcher import EmbeddingBatcher
+        batcher = EmbeddingBatcher(max_wait_ms=20)
+        calls = []
+        
+        async def fake_openai(texts):
+            calls.append(texts)
+            return [[float(len(text))] for text in texts]
+        
+        clients = []
+        for _ in range(3):
+            client = EmbeddingClient("openai", api_key="k", query_cache=QueryEmbeddingCache(10, 60),
+                                     chunk_cache=ChunkEmbeddingCache(str(tmp_path / "cache.db")),
+                                     batcher=batcher)
+            client._aembed_openai = fake_openai
+            clients.append(client)
+        
+        results = await asyncio.gather(*(client.aembed_query("q" * (i + 1)) for i, client in enumerate(clients)))
+        
+        assert results == [[1.0], [2.0], [3.0]]
+        assert calls == [["q", "qq", "qqq"]]
+    
+    @pytest.mark.asyncio
+    async def test_event_loop_not_blocked(self, tmp_path):
+        """Test a slow local model runs off the event loop"""
+        client = EmbeddingClient("openai", api_key="k",
+                                 chunk_cache=ChunkEmbeddingCache(str(tmp_path / "cache.db")))
+        client.provider = "huggingface"
+        client._embed_huggingface = lambda texts: time.sleep(0.2) or [[0.0] for _ in texts]
+        
+        ticks = 0
+        
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+        
+        task = asyncio.create_task(ticker())
+        await client.aembed_texts(["slow"])
+        task.cancel()
+        assert ticks >= 5
+
+
+class TestNumpyEmbeddings:
+    """Test the float32 ndarray path from provider to store"""
+    
+    def test_as_numpy_returns_float32_matrix(self, tmp_path):
+        """Test as_numpy returns one float32 row per text, cached or not"""
+        client = EmbeddingClient("cohere", api_key="k",
+                                 chunk_cache=ChunkEmbeddingCache(str(tmp_path / "cache.db")))
+        client._embed_cohere = lambda texts: np.arange(len(texts) * 3, dtype=np.float32).reshape(-1, 3)
+        
+        embeddings = client.embed_texts(["a", "b"], as_numpy=True)
+        assert embeddings.dtype == np.float32 and embeddings.shape == (2, 3)
+        cached = client.embed_texts(["b", "a", "c"], as_numpy=True)
+        np.testing.assert_array_equal(cached[:2], embeddings[::-1])
+        assert client.embed_texts(["a"]) == [[0.0, 1.0, 2.0]]
+    
+    def test_openai_base64_decoded(self):
+        """Test OpenAI base64 payloads decode straight to float32 rows"""
+        from embedding_service import decode_openai_embeddings
+        
+        class Item:
+            def __init__(self, embedding):
+                self.embedding = embedding
+        
+        vector = np.array([0.25, -1.5], dtype=np.float32)
+        encoded = base64.b64encode(vector.tobytes()).decode()
+        matrix = decode_openai_embeddings([Item(encoded), Item([1.0, 2.0])])
+        assert matrix.dtype == np.float32
+        np.testing.assert_array_equal(matrix, [[0.25, -1.5], [1.0, 2.0]])
+    
+    def test_store_keeps_array_without_copy(self, tmp_path):
+        """Test DocumentStore keeps a float32 embedding matrix as given"""
+        from document_processor import DocumentStore
+        store = DocumentStore(storage_dir=str(tmp_path / "rag"))
+        embeddings = np.eye(3, dtype=np.float32)
+        store.add_document("s1", {"id": "d", "filename": "d.txt", "text": "abc",
+                                  "chunks": ["a", "b", "c"], "embeddings": embeddings})
+        assert store.get_document("s1", "d")["embeddings"] is embeddings
+        assert store.search_chunks("s1", np.array([0, 1, 0], dtype=np.float32))[0]["chunk_index"] == 1
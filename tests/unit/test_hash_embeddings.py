@@ -0,0 +1,73 @@
+"""
+Unit tests for the local-hash embedding provider
+"""
+
+import pytest
+import sys
+import os
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../src'))
+
+from hash_embeddings import HashEmbedder, parse_dimensions
+from embedding_service import EmbeddingClient
+from document_processor import DocumentStore
+
+
+class TestHashEmbedder:
+    """Test the feature-hashing embedder"""
+    
+    def test_deterministic_unit_vectors(self):
+        texts = ["The quick brown fox", "jumps over the lazy dog", "Ünïcödé text"]
+        first = HashEmbedder(128).encode(texts)
+        second = HashEmbedder(128).encode(list(reversed(texts)))[::-1]
+        
+        assert first.dtype == np.float32 and first.shape == (3, 128)
+        np.testing.assert_array_equal(first, second)
+        np.testing.assert_allclose(np.linalg.norm(first, axis=1), 1.0, rtol=1e-5)
+    
+    def test_shared_trigrams_mean_higher_similarity(self):
+        query, close, far = HashEmbedder(384).encode([
+            "configure the vector index backend",
+            "how to configure the vector index",
+            "bananas are rich in potassium"
+        ])
+        
+        assert query @ close > query @ far + 0.3
+    
+    def test_case_insensitive(self):
+        upper, lower = HashEmbedder(64).encode(["Hello World", "hello world"])
+        np.testing.assert_array_equal(upper, lower)
+    
+    def test_empty_inputs(self):
+        assert HashEmbedder(16).encode([]).shape == (0, 16)
+        
+        embeddings = HashEmbedder(16).encode(["", "a"])
+        assert not embeddings[0].any()
+        assert np.linalg.norm(embeddings[1]) == pytest.approx(1.0)
+    
+    def test_model_dimensions(self):
+        assert parse_dimensions("hash-768") == 768
+        with pytest.raises(ValueError):
+            parse_dimensions("bge-small")
+
+
+class TestLocalHashProvider:
+    """Test the provider end to end through the real DocumentStore"""
+    
+    def test_ingest_and_search(self, tmp_path):
+        client = EmbeddingClient("local-hash", model="hash-256")
+        assert client._chunk_cache() is None  # recomputing beats a cache lookup
+        
+        chunks = ["retrieval augmented generation", "quarterly revenue report", "vector index tuning"]
+        store = DocumentStore(storage_dir=str(tmp_path))
+        store.add_document("s", {
+            "id": "d1",
+            "filename": "d1.txt",
+            "text": " ".join(chunks),
+            "chunks": chunks,
+            "embeddings": client.embed_texts(chunks, as_numpy=True)
+        })
+        
+        results = store.search_chunks("s", client.embed_query("revenue report", as_numpy=True), top_k=1)
+        assert results[0]["chunk"] == "quarterly revenue report"
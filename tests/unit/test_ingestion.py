@@ -0,0 +1,199 @@
+"""
+Unit tests for streaming document ingestion
+Tests incremental extraction and chunking, and the extract/chunk/embed/index pipeline
+"""
+
+import pytest
+import sys
+import os
+import random
+import asyncio
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../src'))
+
+from document_processor import DocumentChunker, DocumentProcessor, DocumentStore
+from embedding_service import EmbeddingClient
+from ingestion import IngestionPipeline, ingestion_stats
+
+
+def make_text(seed, words=3000):
+    rng = random.Random(seed)
+    vocabulary = ["vector", "index", "chunk.", "embedding", "query?", "session", "\n", "  ", "recall!"]
+    return " ".join(rng.choice(vocabulary) for _ in range(words))
+
+
+class GatedClient:
+    """Local-hash embeddings that stop before a given batch until released"""
+    
+    def __init__(self, gate_batch=None, fail_batch=None):
+        self.client = EmbeddingClient("local-hash", model="hash-128")
+        self.gate_batch = gate_batch
+        self.fail_batch = fail_batch
+        self.released = asyncio.Event()
+        self.batches = 0
+    
+    async def aembed_texts(self, texts, as_numpy=False):
+        batch = self.batches
+        self.batches += 1
+        if batch == self.fail_batch:
+            raise RuntimeError("provider unavailable")
+        if batch == self.gate_batch:
+            await self.released.wait()
+        return await self.client.aembed_texts(texts, as_numpy=as_numpy)
+
+
+class TestStreamingExtraction:
+    """Test that incremental extraction and chunking match the whole-document path"""
+    
+    @pytest.mark.parametrize("seed", range(5))
+    def test_streamed_chunks_match_chunk_text(self, seed):
+        rng = random.Random(seed)
+        text = make_text(seed)
+        chunker = DocumentChunker(chunk_size=rng.choice([100, 500]), chunk_overlap=rng.choice([0, 50]))
+        
+        stream = chunker.stream()
+        chunks = []
+        position = 0
+        while position < len(text):
+            step = rng.randint(1, 700)
+            chunks += stream.feed(text[position:position + step])
+            position += step
+        chunks += stream.close()
+        
+        assert chunks == chunker.chunk_text(text)
+    
+    def test_text_pieces_join_to_extracted_text(self):
+        content = ("naïve café " * 5000).encode("utf-8") + b"\xff\xfe broken bytes"
+        pieces = list(DocumentProcessor.iter_text(content, "notes.txt", piece_chars=1001))
+        
+        assert len(pieces) > 1
+        assert "".join(pieces) == content.decode("utf-8", errors="ignore")
+
+
+class TestIngestionPipeline:
+    """Test the pipeline end to end with the offline local-hash provider"""
+    
+    @pytest.fixture
+    def store(self, tmp_path):
+        return DocumentStore(storage_dir=str(tmp_path / "rag_storage"))
+    
+    @pytest.mark.asyncio
+    async def test_matches_serial_ingestion(self, store):
+        text = make_text(0)
+        client = EmbeddingClient("local-hash", model="hash-128")
+        pipeline = IngestionPipeline(store, client, batch_size=16, queue_size=2, embed_workers=3)
+        
+        result = await pipeline.ingest("s", text.encode("utf-8"), "notes.txt",
+                                       metadata={"embedding_provider": "local-hash"})
+        
+        chunks = DocumentChunker(chunk_size=500, chunk_overlap=50).chunk_text(text)
+        document = store.get_document("s", result["doc_id"])
+        assert result["doc_id"] == DocumentProcessor.generate_document_id("notes.txt", text)
+        assert document["chunks"] == chunks and document["text"] == text
+        assert document["embedding_provider"] == "local-hash"
+        np.testing.assert_array_equal(document["embeddings"], client.embed_texts(chunks, as_numpy=True))
+        assert result["stages"]["index"]["chunks"] == len(chunks)
+        assert result["stages"]["extract"]["chars"] == len(text)
+        assert ingestion_stats()["documents"] >= 1
+        
+        # Persisted and searchable after a restart
+        reloaded = DocumentStore(storage_dir=str(store.storage_dir))
+        assert reloaded.get_document("s", result["doc_id"])["chunks"] == chunks
+        query = client.embed_query(chunks[7], as_numpy=True)
+        assert reloaded.search_chunks("s", query, top_k=1)[0]["chunk_index"] == 7
+    
+    @pytest.mark.asyncio
+    async def test_partial_document_is_searchable(self, store):
+        text = make_text(1)
+        client = GatedClient(gate_batch=2)
+        pipeline = IngestionPipeline(store, client, batch_size=8, embed_workers=1)
+        task = asyncio.ensure_future(pipeline.ingest("s", text.encode("utf-8"), "notes.txt"))
+        
+        for _ in range(200):
+            await asyncio.sleep(0.01)
+            documents = store.list_documents("s")
+            if documents and documents[0]["chunk_count"] == 16:
+                break
+        assert documents[0]["chunk_count"] == 16
+        
+        chunks = DocumentChunker(chunk_size=500, chunk_overlap=50).chunk_text(text)
+        query = client.client.embed_query(chunks[3], as_numpy=True)
+        assert store.search_chunks("s", query, top_k=1)[0]["chunk_index"] == 3
+        # Nothing reaches disk before the document is complete
+        assert DocumentStore(storage_dir=str(store.storage_dir)).list_documents("s") == []
+        
+        client.released.set()
+        result = await task
+        assert result["chunks"] == len(chunks)
+        assert store.ingesting == {}
+        assert DocumentStore(storage_dir=str(store.storage_dir)).list_documents("s")[0]["chunk_count"] == len(chunks)
+    
+    @pytest.mark.asyncio
+    async def test_failure_restores_previous_version(self, store):
+        text = make_text(2)
+        await IngestionPipeline(store, GatedClient(), batch_size=8).ingest("s", text.encode("utf-8"), "notes.txt")
+        previous = store.list_documents("s")
+        
+        pipeline = IngestionPipeline(store, GatedClient(fail_batch=3), batch_size=8, embed_workers=1)
+        with pytest.raises(RuntimeError):
+            await pipeline.ingest("s", text.encode("utf-8"), "notes.txt")
+        
+        assert store.list_documents("s") == previous
+        assert store.ingesting == {}
+        assert len(store._get_index("s").doc_ids) == previous[0]["chunk_count"]
+    
+    @pytest.mark.asyncio
+    async def test_empty_document_rejected(self, store):
+        pipeline = IngestionPipeline(store, GatedClient())
+        with pytest.raises(ValueError):
+            await pipeline.ingest("s", b"   \n  ", "blank.txt")
+        assert store.list_documents("s") == []
+    
+    @pytest.mark.asyncio
+    async def test_many_files_share_embedding_calls_and_one_write(self, store, monkeypatch):
+        files = [(f"notes{i}.txt", make_text(i, words=200).encode("utf-8")) for i in range(40)]
+        files.insert(5, ("blank.txt", b"  \n "))
+        client = GatedClient()
+        writes = []
+        storage = store._get_storage("s")
+        monkeypatch.setattr(storage, "append", lambda records: writes.append(len(records)))
+        
+        result = await IngestionPipeline(store, client).ingest_many("s", files)
+        
+        assert client.batches == 1
+        assert writes == [40]
+        assert (result["added"], result["failed"]) == (40, 1)
+        assert result["documents"][5] == {"filename": "blank.txt", "success": False,
+                                          "error": "No text could be extracted from the document"}
+        
+        chunker = DocumentChunker(chunk_size=500, chunk_overlap=50)
+        for (filename, content), report in zip(files[6:], result["documents"][6:]):
+            chunks = chunker.chunk_text(content.decode("utf-8"))
+            document = store.get_document("s", report["doc_id"])
+            assert document["filename"] == filename and document["chunks"] == chunks
+            np.testing.assert_array_equal(document["embeddings"], client.client.embed_texts(chunks, as_numpy=True))
+        query = client.client.embed_query(chunker.chunk_text(files[20][1].decode("utf-8"))[1], as_numpy=True)
+        top = store.search_chunks("s", query, top_k=1)[0]
+        assert (top["doc_id"], top["chunk_index"]) == (result["documents"][20]["doc_id"], 1)
+    
+    def test_interleaved_appends_survive_index_reload(self, tmp_path):
+        """Test a saved approximate index with documents appended in alternating batches"""
+        pytest.importorskip("hnswlib")
+        store = DocumentStore(storage_dir=str(tmp_path), index_backend="hnsw")
+        rng = np.random.default_rng(0)
+        documents = [{"id": f"d{i}", "filename": f"d{i}.txt", "text": "", "chunks": [], "embeddings": []}
+                     for i in range(2)]
+        for batch in range(3):
+            for document in documents:
+                chunks = [f"{document['id']} chunk {batch * 4 + i}" for i in range(4)]
+                store.append_chunks("s", document, chunks, rng.normal(size=(4, 16)))
+        for document in documents:
+            store.commit_document("s", document)
+        store.indexes["s"].save(store._get_index_file("s"))
+        
+        reloaded = DocumentStore(storage_dir=str(tmp_path), index_backend="hnsw")
+        for document in documents:
+            for chunk_index in (0, 5, 11):
+                results = reloaded.search_chunks("s", document["embeddings"][chunk_index], top_k=1)
+                assert (results[0]["doc_id"], results[0]["chunk_index"]) == (document["id"], chunk_index)
@@ -0,0 +1,73 @@
+"""
+Unit tests for the BM25 lexical index
+"""
+
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../src'))
+
+from lexical_index import LexicalIndex, tokenize, reciprocal_rank_fusion
+
+
+class TestTokenize:
+    """Test search term extraction"""
+    
+    def test_identifiers_kept_whole_and_split(self):
+        """Test compound identifiers match exactly and by their parts"""
+        tokens = tokenize("def extract_text_from_file(chunkSize):")
+        assert "extract_text_from_file" in tokens
+        assert {"extract", "text", "from", "file"} <= set(tokens)
+        assert {"chunksize", "chunk", "size"} <= set(tokens)
+    
+    def test_plain_words_lowercased(self):
+        """Test ordinary words are lowercased and not split"""
+        assert tokenize("Hello, World! API") == ["hello", "world", "api"]
+
+
+class TestLexicalIndex:
+    """Test BM25 ranking and incremental maintenance"""
+    
+    def setup_method(self):
+        self.index = LexicalIndex()
+        self.index.add("code", ["def parse_config(path): return load(path)", "import os"])
+        self.index.add("notes", ["the config file lives in the home directory", "nothing here"])
+    
+    def test_exact_identifier_ranks_first(self):
+        """Test a literal identifier beats a chunk sharing only a word"""
+        results = self.index.search("parse_config", top_k=2)
+        assert results[0][:2] == ("code", 0)
+    
+    def test_rare_terms_weigh_more(self):
+        """Test BM25 idf prefers chunks with rarer query terms"""
+        results = self.index.search("config directory", top_k=3)
+        assert results[0][:2] == ("notes", 0)
+        assert all(score > 0 for _, _, score in results)
+    
+    def test_remove_and_replace(self):
+        """Test removed documents stop matching and postings are cleaned up"""
+        assert self.index.remove("code", ["def parse_config(path): return load(path)", "import os"]) == 2
+        assert all(doc_id == "notes" for doc_id, _, _ in self.index.search("parse_config"))
+        assert "parse_config" not in self.index.postings
+        
+        self.index.add("notes", ["a new version"])
+        assert len(self.index) == 1
+        assert self.index.search("config") == []
+    
+    def test_no_match(self):
+        """Test queries without known terms return nothing"""
+        assert self.index.search("kubernetes") == []
+        assert LexicalIndex().search("anything") == []
+
+
+class TestReciprocalRankFusion:
+    """Test rank fusion of result lists"""
+    
+    def test_chunks_in_both_lists_win(self):
+        """Test a chunk ranked by both lists outranks single-list hits"""
+        vector = [("a", 0, 0.9), ("b", 0, 0.8)]
+        lexical = [("c", 0, 7.0), ("b", 0, 5.0)]
+        fused = reciprocal_rank_fusion([vector, lexical], top_k=3)
+        assert [key[:2] for key in fused] == [("b", 0), ("a", 0), ("c", 0)]
+        assert fused[0][2] == pytest.approx(1 / 62 + 1 / 62)
@@ -0,0 +1,75 @@
+"""
+Unit tests for the local embedding model registry
+"""
+
+import sys
+import os
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../src'))
+
+from local_models import LocalModelRegistry
+
+
+class FakeModel:
+    """Stands in for a SentenceTransformer"""
+    
+    def __init__(self, model_id):
+        self.model_id = model_id
+        self.encoded = []
+    
+    def encode(self, texts, **kwargs):
+        self.encoded.append(texts)
+        return [[0.0] for _ in texts]
+
+
+class TestLocalModelRegistry:
+    """Test loading, sharing and evicting local models"""
+    
+    def setup_method(self):
+        self.loads = []
+        
+        def loader(model_id):
+            self.loads.append(model_id)
+            time.sleep(0.02)
+            return FakeModel(model_id)
+        
+        self.registry = LocalModelRegistry(max_models=2, loader=loader)
+    
+    def test_model_loaded_once(self):
+        """Test repeated and concurrent requests share one load"""
+        threads = [threading.Thread(target=self.registry.get, args=("m1",)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert self.registry.get("m1") is self.registry.get("m1")
+        assert self.loads == ["m1"]
+        assert self.registry.stats()["models"]["m1"]["uses"] == 7
+    
+    def test_lru_eviction(self):
+        """Test only max_models stay resident, least recently used go first"""
+        self.registry.get("m1")
+        self.registry.get("m2")
+        self.registry.get("m1")
+        self.registry.get("m3")
+        
+        stats = self.registry.stats()
+        assert set(stats["models"]) == {"m1", "m3"}
+        assert stats["evictions"] == 1
+    
+    def test_preload_with_warmup(self):
+        """Test preloading runs a warmup inference and records timings"""
+        self.registry.preload(["m1"])
+        info = self.registry.stats()["models"]["m1"]
+        assert info["load_seconds"] > 0
+        assert info["warmup_seconds"] is not None
+        assert self.registry.get("m1").encoded == [["warmup"]]
+    
+    def test_preload_failure_is_reported(self):
+        """Test a model that fails to load does not abort preloading"""
+        registry = LocalModelRegistry(loader=lambda model_id: 1 / 0)
+        registry.preload(["broken"])
+        assert registry.stats()["models"] == {}
@@ -0,0 +1,162 @@
+"""
+Unit tests for near-duplicate chunk detection
+Tests MinHash signatures, the LSH index and deduplicated ingestion
+"""
+
+import pytest
+import sys
+import os
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../src'))
+
+from document_processor import DocumentChunker, DocumentStore
+from embedding_service import EmbeddingClient
+from ingestion import IngestionPipeline
+from near_duplicates import NearDuplicateIndex, minhash_signature, similarity
+
+
+def paragraph(rng, chars=450):
+    """One sentence of random words, about chars long"""
+    words = []
+    while sum(len(word) + 1 for word in words) < chars:
+        words.append("".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 9))))
+    return " ".join(words) + ". "
+
+
+class CountingClient:
+    """Local-hash embeddings that count the chunks embedded"""
+    
+    def __init__(self):
+        self.client = EmbeddingClient("local-hash", model="hash-128")
+        self.embedded = 0
+    
+    async def aembed_texts(self, texts, as_numpy=False):
+        self.embedded += len(texts)
+        return await self.client.aembed_texts(texts, as_numpy=as_numpy)
+
+
+class TestSignatures:
+    """Test MinHash similarity estimates and LSH lookups"""
+    
+    def test_similarity_estimates(self):
+        rng = random.Random(0)
+        text = paragraph(rng)
+        edited = text.replace(text.split()[10], "changed", 1)
+        
+        assert similarity(minhash_signature(text), minhash_signature(text.upper().replace(".", "!"))) == 1.0
+        assert similarity(minhash_signature(text), minhash_signature(edited)) > 0.7
+        assert similarity(minhash_signature(text), minhash_signature(paragraph(rng))) < 0.2
+        assert minhash_signature(" ... ") is None
+    
+    def test_index_query_exclude_and_remove(self):
+        rng = random.Random(1)
+        chunks = [paragraph(rng) for _ in range(50)]
+        index = NearDuplicateIndex()
+        index.add("a", chunks[:25])
+        index.add("b", chunks[25:])
+        
+        assert index.query(minhash_signature(chunks[30]), 0.9) == ("b", 5)
+        assert index.query(minhash_signature(chunks[30]), 0.9, exclude=lambda doc_id: doc_id == "b") is None
+        assert index.query(minhash_signature(paragraph(rng)), 0.5) is None
+        
+        index.remove("b")
+        assert index.query(minhash_signature(chunks[30]), 0.9) is None
+        assert len(index) == 25 and index.query(minhash_signature(chunks[3]), 0.9) == ("a", 3)
+
+
+class TestDeduplicatedIngestion:
+    """Test uploads skip chunks already in the session"""
+    
+    @pytest.fixture
+    def store(self, tmp_path):
+        return DocumentStore(storage_dir=str(tmp_path / "rag_storage"))
+    
+    @pytest.fixture
+    def corpus(self):
+        rng = random.Random(2)
+        boilerplate = [paragraph(rng) for _ in range(4)]
+        first = "".join(boilerplate + [paragraph(rng) for _ in range(6)])
+        second = "".join([paragraph(rng) for _ in range(3)] + boilerplate + [paragraph(rng) for _ in range(3)])
+        return first, second
+    
+    def pipeline(self, store, client):
+        return IngestionPipeline(store, client, chunker=DocumentChunker(chunk_size=500, chunk_overlap=0),
+                                 batch_size=4, deduplicate=True)
+    
+    @pytest.mark.asyncio
+    async def test_duplicates_skipped_with_references(self, store, corpus):
+        first, second = corpus
+        client = CountingClient()
+        a = await self.pipeline(store, client).ingest("s", first.encode("utf-8"), "a.txt")
+        b = await self.pipeline(store, client).ingest("s", second.encode("utf-8"), "b.txt")
+        
+        assert a["chunks"] == 10 and a["deduplication"]["duplicates"] == 0
+        assert (b["chunks"], b["deduplication"]["duplicates"]) == (6, 4)
+        assert b["deduplication"]["ratio"] == pytest.approx(0.4)
+        assert client.embedded == 16
+        
+        document = store.get_document("s", b["doc_id"])
+        assert document["duplicate_chunks"] == [
+            {"chunk": 3 + i, "doc_id": a["doc_id"], "chunk_index": i} for i in range(4)
+        ]
+        # References survive a restart
+        reloaded = DocumentStore(storage_dir=str(store.storage_dir))
+        assert reloaded.get_document("s", b["doc_id"])["duplicate_chunks"] == document["duplicate_chunks"]
+    
+    @pytest.mark.asyncio
+    async def test_duplicates_retrievable_after_original_deleted(self, store, corpus):
+        first, second = corpus
+        client = CountingClient()
+        a = await self.pipeline(store, client).ingest("s", first.encode("utf-8"), "a.txt")
+        b = await self.pipeline(store, client).ingest("s", second.encode("utf-8"), "b.txt")
+        boilerplate = store.get_document("s", a["doc_id"])["chunks"][0]
+        
+        assert store.delete_document("s", a["doc_id"])
+        
+        document = store.get_document("s", b["doc_id"])
+        assert len(document["chunks"]) == 10 and document["duplicate_chunks"] == []
+        query = await client.client.aembed_texts([boilerplate], as_numpy=True)
+        for search in (store, DocumentStore(storage_dir=str(store.storage_dir))):
+            result = search.search_chunks("s", query[0].tolist(), top_k=1)[0]
+            assert (result["doc_id"], result["chunk"]) == (b["doc_id"], boilerplate)
+            assert result["similarity"] == pytest.approx(1.0, abs=1e-4)
+            assert search.search_lexical("s", boilerplate, top_k=1)[0]["doc_id"] == b["doc_id"]
+    
+    @pytest.mark.asyncio
+    async def test_reupload_not_matched_against_replaced_version(self, store, corpus):
+        first, _ = corpus
+        client = CountingClient()
+        await self.pipeline(store, client).ingest("s", first.encode("utf-8"), "a.txt")
+        result = await self.pipeline(store, client).ingest("s", first.encode("utf-8"), "a.txt")
+        
+        assert result["chunks"] == 10 and result["deduplication"]["duplicates"] == 0
+        assert len(store.list_documents("s")) == 1
+    
+    @pytest.mark.asyncio
+    async def test_repeats_within_a_document(self, store):
+        rng = random.Random(3)
+        header = paragraph(rng)
+        text = "".join(header + paragraph(rng) for _ in range(5))
+        
+        result = await self.pipeline(store, CountingClient()).ingest("s", text.encode("utf-8"), "pages.txt")
+        
+        document = store.get_document("s", result["doc_id"])
+        assert result["chunks"] == 6 and len(document["duplicate_chunks"]) == 4
+        assert {(ref["doc_id"], ref["chunk_index"]) for ref in document["duplicate_chunks"]} == {
+            (result["doc_id"], 0)
+        }
+    
+    @pytest.mark.asyncio
+    async def test_batch_upload_deduplicates_across_files(self, store, corpus):
+        first, second = corpus
+        client = CountingClient()
+        result = await self.pipeline(store, client).ingest_many(
+            "s", [("a.txt", first.encode("utf-8")), ("b.txt", second.encode("utf-8"))]
+        )
+        
+        assert [file["chunks"] for file in result["documents"]] == [10, 6]
+        assert result["deduplication"]["duplicates"] == 4
+        assert client.embedded == 16
+        duplicates = store.get_document("s", result["documents"][1]["doc_id"])["duplicate_chunks"]
+        assert {ref["doc_id"] for ref in duplicates} == {result["documents"][0]["doc_id"]}
@@ -0,0 +1,85 @@
+"""
+Unit tests for the ONNX Runtime embedding backend
+"""
+
+import pytest
+import sys
+import os
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../src'))
+
+import onnx_embeddings
+import local_models
+from onnx_embeddings import parse_model_id, pool_embeddings
+from local_models import LocalModelRegistry, load_local_model
+
+
+class TestPooling:
+    """Test pooling of token embeddings"""
+    
+    def test_mean_pooling_ignores_padding(self):
+        hidden = np.array([[[1.0, 0.0], [0.0, 1.0], [100.0, 100.0]]], dtype=np.float32)
+        mask = np.array([[1, 1, 0]])
+        
+        pooled = pool_embeddings(hidden, mask, "mean")
+        
+        assert pooled.dtype == np.float32
+        np.testing.assert_allclose(pooled[0], [np.sqrt(0.5), np.sqrt(0.5)], rtol=1e-6)
+    
+    def test_cls_pooling_uses_first_token(self):
+        hidden = np.array([[[3.0, 4.0], [1.0, 0.0]]], dtype=np.float32)
+        
+        pooled = pool_embeddings(hidden, np.ones((1, 2)), "cls")
+        
+        np.testing.assert_allclose(pooled[0], [0.6, 0.8], rtol=1e-6)
+    
+    def test_rows_are_unit_length(self):
+        rng = np.random.default_rng(0)
+        hidden = rng.standard_normal((4, 7, 16)).astype(np.float32)
+        mask = np.ones((4, 7))
+        mask[1, 3:] = 0
+        
+        pooled = pool_embeddings(hidden, mask)
+        
+        np.testing.assert_allclose(np.linalg.norm(pooled, axis=1), 1.0, rtol=1e-5)
+
+
+class TestModelIds:
+    """Test model id parsing and registry dispatch"""
+    
+    def test_int8_suffix(self):
+        assert parse_model_id("BAAI/bge-small-en-v1.5:int8") == ("BAAI/bge-small-en-v1.5", True)
+        assert parse_model_id("BAAI/bge-small-en-v1.5") == ("BAAI/bge-small-en-v1.5", False)
+    
+    def test_onnx_prefix_dispatches_to_onnx_loader(self, monkeypatch):
+        loaded = []
+        monkeypatch.setattr(onnx_embeddings, "load_onnx_model", lambda model_id: loaded.append(model_id) or model_id)
+        
+        registry = LocalModelRegistry(max_models=2)
+        model = registry.get("onnx:sentence-transformers/all-MiniLM-L6-v2:int8")
+        
+        assert model == "sentence-transformers/all-MiniLM-L6-v2:int8"
+        assert loaded == ["sentence-transformers/all-MiniLM-L6-v2:int8"]
+    
+    def test_plain_ids_use_sentence_transformers(self, monkeypatch):
+        monkeypatch.setattr(local_models, "load_sentence_transformer", lambda model_id: "st:" + model_id)
+        
+        assert load_local_model("BAAI/bge-small-en-v1.5") == "st:BAAI/bge-small-en-v1.5"
+
+
+@pytest.mark.skipif(not os.getenv("RAG_ONNX_PARITY"), reason="set RAG_ONNX_PARITY=1 to download models")
+class TestParity:
+    """Compare ONNX Runtime against the PyTorch path (downloads models)"""
+    
+    @pytest.mark.parametrize("model_id,min_cosine", [
+        ("sentence-transformers/all-MiniLM-L6-v2", 0.999),
+        ("sentence-transformers/all-MiniLM-L6-v2:int8", 0.97),
+    ])
+    def test_parity(self, model_id, min_cosine):
+        pytest.importorskip("onnxruntime")
+        pytest.importorskip("sentence_transformers")
+        
+        report = onnx_embeddings.parity_check(model_id)
+        
+        assert report["min_cosine"] >= min_cosine
@@ -0,0 +1,117 @@
+"""
+Unit tests for parallel PDF extraction
+Tests page-range splitting, extraction budgets and in-order streaming of page text
+"""
+
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../src'))
+
+import pdf_extraction
+from pdf_extraction import ExtractionBudgetExceeded, PdfExtractor, _Budget, page_ranges
+from document_processor import MappedFile
+
+
+def make_pdf(pages):
+    """Minimal PDF with one line of text per page"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), len(kids))
+    
+    content = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(content))
+        content += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(content)
+    content += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    content += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    content += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return content
+
+
+class TestBudgets:
+    """Test page ranges and budget accounting (no PDF library needed)"""
+    
+    def test_page_ranges_cover_every_page_once(self):
+        assert page_ranges(0, 8) == []
+        assert page_ranges(8, 8) == [(0, 8)]
+        assert page_ranges(19, 8) == [(0, 8), (8, 16), (16, 19)]
+    
+    def test_cpu_budget_is_summed_over_ranges(self):
+        budget = _Budget(cpu_seconds=1.0, timeout=0)
+        budget.charge(0.6)
+        assert budget.cpu_left() == pytest.approx(0.4)
+        assert budget.time_left() is None
+        with pytest.raises(ExtractionBudgetExceeded):
+            budget.charge(0.6)
+    
+    def test_zero_disables_budgets(self):
+        budget = _Budget(cpu_seconds=0, timeout=0)
+        budget.charge(1e6)
+        assert budget.cpu_left() is None
+
+
+class TestPdfExtractor:
+    """Test extraction of generated PDFs"""
+    
+    @pytest.fixture(autouse=True)
+    def pypdf2(self):
+        pytest.importorskip("PyPDF2")
+    
+    def test_parallel_pages_arrive_in_order(self):
+        pages = [f"Page number {i}" for i in range(23)]
+        extractor = PdfExtractor(max_workers=2, pages_per_task=3, cpu_seconds=0, timeout=60)
+        try:
+            texts = list(extractor.iter_pages(make_pdf(pages)))
+        finally:
+            extractor.shutdown()
+        
+        assert [text.strip() for text in texts] == pages
+        assert extractor.stats()["parallel_documents"] == 1
+        assert extractor.stats()["pages"] == 23
+    
+    def test_small_document_extracted_in_process(self, tmp_path):
+        path = tmp_path / "short.pdf"
+        path.write_bytes(make_pdf(["only page"]))
+        extractor = PdfExtractor(max_workers=4, pages_per_task=8)
+        
+        assert [text.strip() for text in extractor.iter_pages(path)] == ["only page"]
+        assert extractor.stats()["parallel_documents"] == 0
+        assert not extractor.stats()["pool_running"]
+    
+    def test_sources_are_not_copied_to_disk(self, tmp_path, monkeypatch):
+        """Test single-range content is read from memory and mapped files from their own path"""
+        def no_copy(*args, **kwargs):
+            raise AssertionError("content copied to a temporary file")
+        monkeypatch.setattr(pdf_extraction.tempfile, "NamedTemporaryFile", no_copy)
+        
+        extractor = PdfExtractor(max_workers=4, pages_per_task=8)
+        assert [text.strip() for text in extractor.iter_pages(make_pdf(["one", "two"]))] == ["one", "two"]
+        
+        pages = [f"Page number {i}" for i in range(7)]
+        path = tmp_path / "long.pdf"
+        path.write_bytes(make_pdf(pages))
+        mapped = MappedFile(str(path))
+        extractor = PdfExtractor(max_workers=2, pages_per_task=3, cpu_seconds=0, timeout=60)
+        try:
+            assert [text.strip() for text in extractor.iter_pages(mapped)] == pages
+        finally:
+            extractor.shutdown()
+            mapped.close()
+        assert extractor.stats()["parallel_documents"] == 1
+    
+    def test_cpu_budget_rejects_document(self):
+        extractor = PdfExtractor(max_workers=1, pages_per_task=1, cpu_seconds=1e-9, timeout=0)
+        with pytest.raises(ExtractionBudgetExceeded):
+            list(extractor.iter_pages(make_pdf(["a", "b", "c"])))
+        assert extractor.stats()["budget_exceeded"] == 1
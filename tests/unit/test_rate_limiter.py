@@ -0,0 +1,213 @@
+"""
+Unit tests for provider rate limiting and retries
+"""
+
+import pytest
+import sys
+import os
+import asyncio
+from types import SimpleNamespace
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../src'))
+
+from rate_limiter import TokenBucket, RateLimiter, RetryPolicy, is_retryable, retry_after, get_rate_limiter
+from embedding_service import EmbeddingClient
+from embedding_cache import ChunkEmbeddingCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+    
+    def __call__(self):
+        return self.now
+
+
+class FakeAPIError(Exception):
+    """Shaped like the SDK errors: status_code plus response headers"""
+    
+    def __init__(self, status, headers=None):
+        super().__init__(f"status {status}")
+        self.status_code = status
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+def wrapped(error):
+    """Wrap an SDK error the way the provider methods do"""
+    try:
+        raise error
+    except Exception as e:
+        try:
+            raise Exception(f"OpenAI embedding error: {str(e)}")
+        except Exception as outer:
+            return outer
+
+
+class TestTokenBucket:
+    """Test pacing with the token bucket"""
+    
+    def test_burst_then_paced(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate_per_second=10, capacity=10, clock=clock)
+        
+        assert [bucket.reserve(1) for _ in range(10)] == [0.0] * 10
+        assert bucket.reserve(1) == pytest.approx(0.1)
+        assert bucket.reserve(1) == pytest.approx(0.2)
+    
+    def test_reservation_larger_than_capacity_goes_into_debt(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate_per_second=100, capacity=100, clock=clock)
+        
+        assert bucket.reserve(300) == pytest.approx(2.0)
+        clock.now = 2.0
+        assert bucket.reserve(100) == pytest.approx(1.0)
+    
+    def test_sustained_rate_stays_at_limit(self):
+        """Callers that wait as told send exactly at the configured rate"""
+        clock = FakeClock()
+        limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=60000, clock=clock)
+        sent = 0
+        while clock.now < 60:
+            clock.now += limiter.reserve(tokens=500)
+            sent += 1
+        
+        # Token limit: 60000 tokens/min / 500 tokens per request, plus the initial burst
+        assert 120 <= sent <= 125
+
+
+class TestRetries:
+    """Test error classification, Retry-After and retry behavior"""
+    
+    def test_retryable_errors(self):
+        assert is_retryable(wrapped(FakeAPIError(429)))
+        assert is_retryable(wrapped(FakeAPIError(503)))
+        assert not is_retryable(wrapped(FakeAPIError(401)))
+        assert not is_retryable(wrapped(FakeAPIError(409)))
+        assert not is_retryable(Exception("bad input"))
+        
+        class RateLimitError(Exception):
+            pass
+        assert is_retryable(RateLimitError())
+    
+    def test_retry_after_headers(self):
+        assert retry_after(wrapped(FakeAPIError(429, {"retry-after": "7"}))) == 7.0
+        assert retry_after(wrapped(FakeAPIError(429, {"retry-after-ms": "250"}))) == 0.25
+        assert retry_after(FakeAPIError(429, {"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"})) == 0.0
+        assert retry_after(FakeAPIError(429)) is None
+    
+    def test_retry_after_is_honored(self):
+        policy = RetryPolicy(max_retries=3, base_delay=100, max_delay=1000)
+        delay = policy.delay(0, FakeAPIError(429, {"retry-after": "0.02"}))
+        assert delay == 0.02
+        assert 50 <= policy.delay(0, FakeAPIError(429)) <= 100  # jittered backoff otherwise
+    
+    def test_call_retries_then_succeeds(self):
+        limiter = RateLimiter()
+        attempts = []
+        
+        def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise wrapped(FakeAPIError(429, {"retry-after": "0.01"}))
+            return "ok"
+        
+        assert RetryPolicy(max_retries=5).call(limiter, 0, flaky) == "ok"
+        assert len(attempts) == 3
+        assert limiter.stats()["retries"] == 2
+    
+    def test_non_retryable_errors_raise_immediately(self):
+        attempts = []
+        
+        def rejected():
+            attempts.append(1)
+            raise wrapped(FakeAPIError(400))
+        
+        with pytest.raises(Exception, match="OpenAI embedding error"):
+            RetryPolicy(max_retries=5).call(RateLimiter(), 0, rejected)
+        assert len(attempts) == 1
+    
+    @pytest.mark.asyncio
+    async def test_async_call_gives_up_after_max_retries(self):
+        attempts = []
+        
+        async def always_limited():
+            attempts.append(1)
+            raise FakeAPIError(429, {"retry-after": "0"})
+        
+        with pytest.raises(FakeAPIError):
+            await RetryPolicy(max_retries=2).acall(RateLimiter(), 0, always_limited)
+        assert len(attempts) == 3
+
+
+class TestClientRateLimiting:
+    """Test the limiter and retries inside EmbeddingClient"""
+    
+    def test_limiter_shared_per_key(self):
+        first = EmbeddingClient("openai", api_key="shared-key")
+        second = EmbeddingClient("openai", api_key="shared-key")
+        other = EmbeddingClient("openai", api_key="other-key")
+        
+        assert first.rate_limiter is second.rate_limiter
+        assert first.rate_limiter is not other.rate_limiter
+        assert EmbeddingClient("local-hash").rate_limiter is None
+    
+    def test_rate_limited_batch_is_retried(self, tmp_path):
+        client = EmbeddingClient("cohere", api_key="retry-key", max_concurrency=1,
+                                 chunk_cache=ChunkEmbeddingCache(str(tmp_path / "cache.db")))
+        calls = []
+        
+        def fake_cohere(texts):
+            calls.append(list(texts))
+            if len(calls) == 2:
+                raise FakeAPIError(429, {"retry-after": "0.01"})
+            return [[float(text)] for text in texts]
+        
+        client._embed_cohere = fake_cohere
+        embeddings = client.embed_texts([str(i) for i in range(96 * 3)], as_numpy=True)
+        
+        np.testing.assert_array_equal(embeddings[:, 0], np.arange(96 * 3))
+        assert len(calls) == 4  # only the rate-limited batch was sent twice
+        assert calls[1] == calls[2]
+        assert get_rate_limiter("cohere", "retry-key").stats()["retries"] == 1
+    
+    def test_failed_upload_keeps_finished_batches(self, tmp_path):
+        client = EmbeddingClient("cohere", api_key="partial-key", max_concurrency=1,
+                                 chunk_cache=ChunkEmbeddingCache(str(tmp_path / "cache.db")))
+        texts = [str(i) for i in range(96 * 3)]
+        calls = []
+        
+        def failing_cohere(texts):
+            calls.append(list(texts))
+            if len(calls) == 3:
+                raise FakeAPIError(400)
+            return [[float(text)] for text in texts]
+        
+        client._embed_cohere = failing_cohere
+        with pytest.raises(FakeAPIError):
+            client.embed_texts(texts)
+        
+        # Retrying the upload only embeds the batch that failed
+        calls.clear()
+        client._embed_cohere = lambda batch: calls.append(list(batch)) or [[float(text)] for text in batch]
+        assert client.embed_texts(texts)[-1] == [287.0]
+        assert calls == [texts[192:]]
+    
+    @pytest.mark.asyncio
+    async def test_async_failed_upload_keeps_finished_batches(self, tmp_path):
+        client = EmbeddingClient("cohere", api_key="async-partial-key", max_concurrency=2,
+                                 chunk_cache=ChunkEmbeddingCache(str(tmp_path / "cache.db")))
+        texts = [str(i) for i in range(96 * 2)]
+        
+        async def failing_cohere(batch):
+            if batch[0] == "96":
+                raise FakeAPIError(400)
+            return [[float(text)] for text in batch]
+        
+        client._aembed_cohere = failing_cohere
+        with pytest.raises(FakeAPIError):
+            await client.aembed_texts(texts)
+        await asyncio.sleep(0.05)  # let the successful batch finish caching
+        
+        keys, found, missing = client._lookup_cached(client.chunk_cache, texts)
+        assert list(missing.values()) == texts[96:]
@@ -6,12 +6,14 @@ Tests all API endpoints and core functionality
 import pytest
 import sys
 import os
+import httpx
 from fastapi.testclient import TestClient
 
 # Add parent directory to path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
 
 from server import app
+from document_processor import document_store
 
 
 class TestHealthEndpoint:
@@ -228,6 +230,107 @@ class TestRAGDocumentEndpoints:
         assert response.status_code == 200
         data = response.json()
         assert "message" in data
+    
+    def test_rag_stats(self):
+        """Test document store cache statistics"""
+        response = self.client.get("/api/rag/stats")
+        assert response.status_code == 200
+        stats = response.json()["session_cache"]
+        assert {"hits", "misses", "evictions", "sessions"} <= set(stats)
+    
+    def test_invalid_quantization_rejected(self):
+        """Test unknown quantization modes are a client error"""
+        response = self.client.post("/api/rag/quantization",
+                                    json={"session_id": self.session_id, "quantization": "int4"})
+        assert response.status_code == 400
+    
+    def test_invalid_reduction_rejected(self):
+        """Test unknown reduction methods are a client error"""
+        response = self.client.post("/api/rag/reduction",
+                                    json={"session_id": self.session_id, "method": "svd", "dimensions": 64})
+        assert response.status_code == 400
+    
+    def test_unsafe_session_id_rejected(self):
+        """Test session ids that are not safe directory names are a client error"""
+        assert self.client.delete("/api/rag/documents/bad.id").status_code == 400
+        assert self.client.get("/api/rag/documents/bad.id").status_code == 400
+        response = self.client.post("/api/rag/quantization", json={"session_id": "..", "quantization": "int8"})
+        assert response.status_code == 400
+        response = self.client.request("DELETE", "/api/rag/document", json={"session_id": ".", "doc_id": "x"})
+        assert response.status_code == 400
+    
+    def test_invalid_chunking_rejected(self):
+        """Test unknown chunking modes and oversized token budgets are a client error"""
+        for settings in ({"chunking": "sentences"}, {"chunking": "tokens", "chunk_size": 100000}):
+            response = self.client.post("/api/rag/upload", json={
+                "session_id": self.session_id,
+                "filename": "test.txt",
+                "content": "VGhpcyBpcyBhIHRlc3Qu",
+                "embedding_provider": "cohere",
+                "embedding_api_key": "test-key",
+                **settings
+            })
+            assert response.status_code == 400
+    
+    def test_batch_upload_reports_each_file(self):
+        """Test a batch upload adds good files and reports bad ones individually"""
+        response = self.client.post("/api/rag/upload/batch", json={
+            "session_id": self.session_id,
+            "embedding_provider": "local-hash",
+            "files": [
+                {"filename": "a.txt", "content": "VGhpcyBpcyBhIHRlc3Qu"},
+                {"filename": "broken.txt", "content": "not base64!"},
+                {"filename": "blank.txt", "content": "ICAg"},
+                {"filename": "b.md", "content": "QW5vdGhlciBkb2N1bWVudC4="}
+            ]
+        })
+        assert response.status_code == 200
+        data = response.json()
+        assert [file["success"] for file in data["documents"]] == [True, False, False, True]
+        assert (data["added"], data["failed"]) == (2, 2)
+        
+        documents = self.client.get(f"/api/rag/documents/{self.session_id}").json()["documents"]
+        assert {document["filename"] for document in documents} == {"a.txt", "b.md"}
+        self.client.delete(f"/api/rag/documents/{self.session_id}")
+    
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("spool_bytes", ["1048576", "1024"])
+    async def test_raw_upload(self, monkeypatch, tmp_path, spool_bytes):
+        """Test raw-body uploads, both kept in memory and spooled to disk and memory mapped"""
+        import tempfile
+        monkeypatch.setenv("RAG_UPLOAD_SPOOL_BYTES", spool_bytes)
+        monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+        # Numbered lines, so a lost tail would show; streamed in many blocks, far past the spool and write buffers
+        content = "".join(f"Line {i} of a raw plain text upload.\n" for i in range(3000)).encode("utf-8")
+        
+        async def blocks():
+            for offset in range(0, len(content), 1000):
+                yield content[offset:offset + 1000]
+        
+        # Unlike TestClient, the ASGI transport delivers the body block by block
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post(
+                "/api/rag/upload/raw",
+                params={"session_id": self.session_id, "filename": "raw.txt", "embedding_provider": "local-hash"},
+                content=blocks()
+            )
+        assert response.status_code == 200
+        assert response.json()["chunks"] > 1
+        
+        document = document_store.get_document(self.session_id, response.json()["doc_id"])
+        assert document["text"] == content.decode("utf-8")
+        assert list(tmp_path.iterdir()) == []  # The spooled body is removed
+        document_store.clear_session(self.session_id)
+    
+    def test_raw_upload_size_limit(self, monkeypatch):
+        """Test bodies over the upload limit are rejected"""
+        monkeypatch.setenv("RAG_UPLOAD_MAX_BYTES", "1000")
+        response = self.client.post(
+            "/api/rag/upload/raw",
+            params={"session_id": self.session_id, "filename": "big.txt", "embedding_provider": "local-hash"},
+            content=b"x" * 1001
+        )
+        assert response.status_code == 413
 
 
 class TestChatEndpoint: